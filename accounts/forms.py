@@ -1,5 +1,7 @@
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import UserCreationForm
+from django.db.models import Value
+from django.db.models.functions import Lower
 
 User = get_user_model()
 
@@ -8,3 +10,13 @@ class SignupForm(UserCreationForm):
     class Meta:
         model = User
         fields = ("username", "email")
+
+    def clean_username(self):
+        # 大文字・小文字違いのユーザー名は登録させない。UserCreationForm の iexact（LIKE）では
+        # unique_username_ci の索引が使われないので、Lower(username) で比べる
+        username = self.cleaned_data.get("username")
+        # 退会して削除待ちのユーザーの名前もまだ使えない
+        users = User.all_objects.alias(username_lower=Lower("username")).filter(username_lower=Lower(Value(username)))
+        if username and users.exists():
+            raise self.instance.unique_error_message(User, ["username"])
+        return username
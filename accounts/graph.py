@@ -0,0 +1,82 @@
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import caches
+
+from mysite.caches import also_on_commit, get_or_set
+
+from .models import FriendShip
+
+# ユーザーごとのフォロー中・フォロワーの id をソート済みの 64bit 整数配列にしてキャッシュする。
+# 「フォローしているか」は二分探索、相互フォローなどは配列どうしの共通部分で求め、DB を引かない
+
+
+def following_key(user_id):
+    return f"following-ids:{user_id}"
+
+
+def follower_key(user_id):
+    return f"follower-ids:{user_id}"
+
+
+def _load(key, ids):
+    data = get_or_set(key, lambda: array("q", sorted(ids())).tobytes(), alias=settings.FOLLOW_GRAPH_CACHE)
+    result = array("q")
+    result.frombytes(data)
+    return result
+
+
+def get_following_ids(user_id):
+    return _load(
+        following_key(user_id),
+        lambda: FriendShip.objects.filter(follower_id=user_id).values_list("following_id", flat=True),
+    )
+
+
+def get_follower_ids(user_id):
+    return _load(
+        follower_key(user_id),
+        lambda: FriendShip.objects.filter(following_id=user_id).values_list("follower_id", flat=True),
+    )
+
+
+@also_on_commit
+def invalidate_follow_graph(follower_id, following_id):
+    caches[settings.FOLLOW_GRAPH_CACHE].delete_many([following_key(follower_id), follower_key(following_id)])
+
+
+def contains(ids, value):
+    index = bisect_left(ids, value)
+    return index < len(ids) and ids[index] == value
+
+
+def intersect(a, b):
+    # 小さい方の要素を大きい方から二分探索する。どちらもソート済みであること
+    if len(a) > len(b):
+        a, b = b, a
+    return [value for value in a if contains(b, value)]
+
+
+def is_following(follower_id, following_id):
+    return contains(get_following_ids(follower_id), following_id)
+
+
+def mutual_ids(user_id):
+    # 相互フォロー: フォロー中かつフォロワー
+    return intersect(get_following_ids(user_id), get_follower_ids(user_id))
+
+
+def follows_you_ids(viewer_id, user_ids):
+    # user_ids のうち viewer をフォローしているユーザー
+    return intersect(sorted(set(user_ids)), get_follower_ids(viewer_id))
+
+
+def attach_follow_state(users, viewer):
+    users = list(users)
+    following = get_following_ids(viewer.id) if viewer.is_authenticated else array("q")
+    followers = get_follower_ids(viewer.id) if viewer.is_authenticated else array("q")
+    for user in users:
+        user.followed_by_viewer = contains(following, user.id)
+        user.follows_viewer = contains(followers, user.id)
+    return users
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.contrib.auth import hashers
+
+# パラメータは settings から読む。変えると、古いパラメータのハッシュは次のログイン時に作り直される
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    @property
+    def iterations(self):
+        return settings.PASSWORD_HASHER_OPTIONS.get("iterations", hashers.PBKDF2PasswordHasher.iterations)
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    # argon2-cffi が必要
+    @property
+    def time_cost(self):
+        return settings.PASSWORD_HASHER_OPTIONS.get("time_cost", hashers.Argon2PasswordHasher.time_cost)
+
+    @property
+    def memory_cost(self):
+        return settings.PASSWORD_HASHER_OPTIONS.get("memory_cost", hashers.Argon2PasswordHasher.memory_cost)
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_HASHER_OPTIONS.get("parallelism", hashers.Argon2PasswordHasher.parallelism)
+
+
+class ScryptPasswordHasher(hashers.ScryptPasswordHasher):
+    @property
+    def work_factor(self):
+        return settings.PASSWORD_HASHER_OPTIONS.get("work_factor", hashers.ScryptPasswordHasher.work_factor)
+
+    @property
+    def block_size(self):
+        return settings.PASSWORD_HASHER_OPTIONS.get("block_size", hashers.ScryptPasswordHasher.block_size)
+
+    @property
+    def parallelism(self):
+        return settings.PASSWORD_HASHER_OPTIONS.get("parallelism", hashers.ScryptPasswordHasher.parallelism)
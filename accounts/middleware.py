@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.core.cache import caches
+from django.utils.crypto import constant_time_compare
+from django.utils.functional import SimpleLazyObject
+
+from mysite.caches import also_on_commit, is_process_local
+from mysite.instrumentation import record_cache_access
+
+
+def user_cache_key(user_id):
+    return f"auth-user:{user_id}"
+
+
+@also_on_commit
+def invalidate_cached_user(user_id):
+    caches[settings.AUTH_USER_CACHE].delete(user_cache_key(user_id))
+
+
+def get_cached_user(request):
+    # セッションに紐づくユーザーを短い TTL でキャッシュし、リクエストごとの SELECT を省く
+    try:
+        user_id = auth._get_user_session_key(request)
+        backend_path = request.session[auth.BACKEND_SESSION_KEY]
+    except KeyError:
+        return auth.get_user(request)
+    # 他のプロセスでのパスワード変更・退会が見えないキャッシュに置くと、古いセッションを通してしまう
+    if is_process_local(settings.AUTH_USER_CACHE):
+        return auth.get_user(request)
+
+    cache = caches[settings.AUTH_USER_CACHE]
+    key = user_cache_key(user_id)
+    user = cache.get(key)
+    record_cache_access(hit=user is not None)
+    if user is not None:
+        session_hash = request.session.get(auth.HASH_SESSION_KEY)
+        if session_hash and constant_time_compare(session_hash, user.get_session_auth_hash()):
+            user.backend = backend_path
+            return user
+        cache.delete(key)
+
+    # キャッシュにない・パスワードが変わった場合は通常どおり検証する
+    user = auth.get_user(request)
+    if user.is_authenticated:
+        cache.set(key, user, settings.AUTH_USER_CACHE_TIMEOUT)
+    return user
+
+
+class CachedAuthenticationMiddleware(AuthenticationMiddleware):
+    def process_request(self, request):
+        super().process_request(request)
+        request.user = SimpleLazyObject(lambda: self.get_user(request))
+
+    @staticmethod
+    def get_user(request):
+        if not hasattr(request, "_cached_user"):
+            request._cached_user = get_cached_user(request)
+        return request._cached_user
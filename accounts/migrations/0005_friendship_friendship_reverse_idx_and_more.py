@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0004_user_follower_count_user_following_count_and_more"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="friendship",
+            index=models.Index(fields=["following", "follower"], name="friendship_reverse_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="friendship",
+            index=models.Index(fields=["follower", "-created_at", "-id"], name="friendship_following_list_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="friendship",
+            index=models.Index(fields=["following", "-created_at", "-id"], name="friendship_follower_list_idx"),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:16
+
+import logging
+
+from django.db import migrations, models
+import django.db.models.functions.text
+from django.db.models.functions import Lower
+
+logger = logging.getLogger("accounts")
+
+
+def rename_case_collisions(apps, schema_editor):
+    # 大文字・小文字だけが違うユーザー名があると制約を張れないので、最初に登録した 1 人を残して後の人の名前に id を付ける
+    User = apps.get_model("accounts", "User")
+    seen = set()
+    for user in User.objects.annotate(lowered=Lower("username")).order_by("lowered", "pk").iterator():
+        if user.lowered not in seen:
+            seen.add(user.lowered)
+            continue
+        old = user.username
+        suffix = f"_{user.pk}"
+        # 付けた名前が他の人と重なれば、重ならなくなるまで id を足す
+        while User.objects.filter(username__iexact=old[: 150 - len(suffix)] + suffix).exists():
+            suffix += f"_{user.pk}"
+        user.username = old[: 150 - len(suffix)] + suffix
+        user.save(update_fields=["username"])
+        logger.warning(
+            "ユーザー名 %r は他のユーザーと大文字・小文字だけが違うため %r に変更しました。", old, user.username
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0005_friendship_friendship_reverse_idx_and_more"),
+    ]
+
+    operations = [
+        migrations.RunPython(rename_case_collisions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="user",
+            constraint=models.UniqueConstraint(
+                django.db.models.functions.text.Lower("username"),
+                name="unique_username_ci",
+                violation_error_message="同じユーザー名が既に登録済みです。",
+            ),
+        ),
+    ]
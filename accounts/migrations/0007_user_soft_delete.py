@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:20
+
+import accounts.models
+import django.contrib.auth.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0006_user_unique_username_ci"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="user",
+            options={"base_manager_name": "all_objects", "verbose_name": "user", "verbose_name_plural": "users"},
+        ),
+        migrations.AlterModelManagers(
+            name="user",
+            managers=[
+                ("objects", accounts.models.UserManager()),
+                ("all_objects", django.contrib.auth.models.UserManager()),
+            ],
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="deleted_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="user",
+            name="is_deleted",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name="user",
+            index=models.Index(
+                condition=models.Q(("is_deleted", True)), fields=["deleted_at"], name="user_deleted_idx"
+            ),
+        ),
+    ]
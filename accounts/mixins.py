@@ -0,0 +1,11 @@
+from asgiref.sync import sync_to_async
+from django.contrib.auth.mixins import LoginRequiredMixin
+
+
+class AsyncLoginRequiredMixin(LoginRequiredMixin):
+    # request.user の読み込みは同期 DB アクセスなので、スレッドに逃がしてから判定する
+    async def dispatch(self, request, *args, **kwargs):
+        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        if not is_authenticated:
+            return self.handle_no_permission()
+        return await super(LoginRequiredMixin, self).dispatch(request, *args, **kwargs)
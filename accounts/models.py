@@ -1,6 +1,72 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import UserManager as BaseUserManager
 from django.db import models
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+
+class UserManager(BaseUserManager):
+    # 退会したユーザーは、User.all_objects で明示しない限り見えない（ログイン中のセッションも無効になる）
+    def get_queryset(self):
+        return super().get_queryset().filter(is_deleted=False)
 
 
 class User(AbstractUser):
     email = models.EmailField()
+    follower_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    tweet_count = models.PositiveIntegerField(default=0)
+    # 退会はまずこのフラグを立てて隠すだけにし、ツイート・フォローなどの行は tweets.purge で少しずつ消す
+    is_deleted = models.BooleanField(default=False)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = UserManager()
+    all_objects = BaseUserManager()
+
+    class Meta(AbstractUser.Meta):
+        base_manager_name = "all_objects"
+        # URL のユーザー名は大文字・小文字を区別せずに引くので、Lower(username) で一意にして索引を兼ねる
+        constraints = [
+            models.UniqueConstraint(
+                Lower("username"),
+                name="unique_username_ci",
+                violation_error_message="同じユーザー名が既に登録済みです。",
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["deleted_at"], name="user_deleted_idx", condition=models.Q(is_deleted=True)),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        user = super().from_db(db, field_names, values)
+        # 保存時にユーザー名が変わったかを知るため、読み込んだ時点の値を覚えておく
+        user._loaded_username = dict(zip(field_names, values)).get("username")
+        return user
+
+    def soft_delete(self):
+        self.is_deleted = True
+        self.is_active = False
+        self.deleted_at = timezone.now()
+        self.save(update_fields=["is_deleted", "is_active", "deleted_at"])
+
+
+class FriendShip(models.Model):
+    follower = models.ForeignKey(User, on_delete=models.CASCADE, related_name="following_relations")
+    following = models.ForeignKey(User, on_delete=models.CASCADE, related_name="follower_relations")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["follower", "following"], name="unique_friendship"),
+            models.CheckConstraint(check=~models.Q(follower=models.F("following")), name="cannot_follow_self"),
+        ]
+        # unique_friendship が (follower, following) の索引を兼ねるので、逆向きと一覧の並び順用の索引を足す
+        indexes = [
+            models.Index(fields=["following", "follower"], name="friendship_reverse_idx"),
+            models.Index(fields=["follower", "-created_at", "-id"], name="friendship_following_list_idx"),
+            models.Index(fields=["following", "-created_at", "-id"], name="friendship_follower_list_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.follower} -> {self.following}"
@@ -0,0 +1,37 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from mysite import counters
+from mysite.conditional import bump_version
+
+from .graph import invalidate_follow_graph
+from .middleware import invalidate_cached_user
+from .models import FriendShip, User
+from .usernames import invalidate_usernames
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
+    bump_version(f"user:{instance.pk}")
+    # 新しい名前は「存在しない」と覚えているかもしれず、変更前・削除した名前は古い id を指している
+    invalidate_usernames(instance.username, getattr(instance, "_loaded_username", None))
+    instance._loaded_username = instance.username
+
+
+@receiver(post_save, sender=FriendShip)
+def incr_follow_counts(sender, instance, created, **kwargs):
+    if created:
+        counters.buffer.incr(User, instance.follower_id, "following_count")
+        counters.buffer.incr(User, instance.following_id, "follower_count")
+        invalidate_follow_graph(instance.follower_id, instance.following_id)
+        bump_version(f"user:{instance.follower_id}", f"user:{instance.following_id}")
+
+
+@receiver(post_delete, sender=FriendShip)
+def decr_follow_counts(sender, instance, **kwargs):
+    counters.buffer.decr(User, instance.follower_id, "following_count")
+    counters.buffer.decr(User, instance.following_id, "follower_count")
+    invalidate_follow_graph(instance.follower_id, instance.following_id)
+    bump_version(f"user:{instance.follower_id}", f"user:{instance.following_id}")
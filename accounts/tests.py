@@ -1,12 +1,58 @@
+from unittest import mock
+
 from django.contrib.auth import SESSION_KEY, get_user_model
-from django.test import TestCase
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.db import IntegrityError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from mysite import settings
+from tweets.models import Tweet
+
+from .graph import follows_you_ids, is_following, mutual_ids
+from .middleware import user_cache_key
+from .models import FriendShip
+from .usernames import resolve_username
 
 User = get_user_model()
 
 
+class TestAccountDeleteView(TestCase):
+    def setUp(self):
+        caches[settings.USERNAME_CACHE].clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+
+    def test_success_post(self):
+        Tweet.objects.create(user=self.user, content="hello")
+        response = self.client.post(reverse("accounts:delete"))
+        self.assertRedirects(response, reverse("welcome:welcome"))
+        self.assertNotIn(SESSION_KEY, self.client.session)
+        self.assertIsNone(resolve_username("testuser"))
+        # テストでは purge_user タスクもその場で実行される
+        self.assertFalse(User.all_objects.exists())
+        self.assertFalse(Tweet.all_objects.exists())
+
+    def test_deleted_user_is_hidden_until_purged(self):
+        with self.settings(TASKS_EAGER=False):
+            self.client.post(reverse("accounts:delete"))
+        self.assertFalse(User.objects.exists())
+        self.assertFalse(self.client.login(username="testuser", password="testpassword"))
+        response = self.client.post(
+            reverse("accounts:signup"),
+            {
+                "username": "TestUser",
+                "email": "test@test.com",
+                "password1": "testpassword",
+                "password2": "testpassword",
+            },
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("同じユーザー名が既に登録済みです。", response.context["form"].errors["username"])
+
+
 class TestSignupView(TestCase):
     def setUp(self):
         self.url = reverse("accounts:signup")
@@ -29,6 +75,18 @@ class TestSignupView(TestCase):
         self.assertTrue(User.objects.filter(username=valid_data["username"]).exists())
         self.assertIn(SESSION_KEY, self.client.session)
 
+    def test_success_post_does_not_check_password_again(self):
+        valid_data = {
+            "username": "testuser",
+            "email": "test@test.com",
+            "password1": "testpassword",
+            "password2": "testpassword",
+        }
+        with mock.patch.object(User, "check_password") as check_password:
+            self.client.post(self.url, valid_data)
+        check_password.assert_not_called()
+        self.assertIn(SESSION_KEY, self.client.session)
+
     def test_failure_post_with_empty_username(self):
         invalid_data = {
             "username": "",
@@ -112,6 +170,21 @@ class TestSignupView(TestCase):
         self.assertFalse(form.is_valid())
         self.assertIn("同じユーザー名が既に登録済みです。", form.errors["username"])
 
+    def test_failure_post_with_username_in_different_case(self):
+        User.objects.create_user(username="ExistingUser", password="testpassword")
+        invalid_data = {
+            "username": "existinguser",
+            "email": "test@test.com",
+            "password1": "testpassword",
+            "password2": "testpassword",
+        }
+        response = self.client.post(self.url, invalid_data)
+        form = response.context["form"]
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(User.objects.filter(username=invalid_data["username"]).exists())
+        self.assertIn("同じユーザー名が既に登録済みです。", form.errors["username"])
+
     def test_failure_post_with_invalid_email(self):
         invalid_data = {
             "username": "testuser",
@@ -195,6 +268,47 @@ class TestHomeView(TestCase):
         self.assertEqual(response.status_code, 200)
 
 
+class TestCachedAuthentication(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        self.url = reverse("tweets:home")
+
+    def test_user_and_session_are_not_loaded_from_db(self):
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["user"], self.user)
+        for query in context.captured_queries:
+            self.assertNotIn("django_session", query["sql"])
+            self.assertNotIn('FROM "accounts_user" WHERE "accounts_user"."id" = ', query["sql"])
+
+    @override_settings(WEB_CONCURRENCY=2)
+    def test_process_local_cache_is_not_used(self):
+        caches[settings.AUTH_USER_CACHE].clear()
+        self.client.get(self.url)
+        self.assertIsNone(caches[settings.AUTH_USER_CACHE].get(user_cache_key(self.user.pk)))
+
+    def test_cache_is_invalidated_on_save(self):
+        self.client.get(self.url)
+        self.user.first_name = "changed"
+        self.user.save()
+        self.assertIsNone(caches[settings.AUTH_USER_CACHE].get(user_cache_key(self.user.pk)))
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.context["user"].first_name, "changed")
+
+    def test_logged_out_after_password_change(self):
+        self.client.get(self.url)
+        self.user.set_password("newpassword")
+        self.user.save()
+
+        response = self.client.get(self.url)
+        self.assertRedirects(response, f"{reverse(settings.LOGIN_URL)}?next={self.url}")
+
+
 class TestLoginView(TestCase):
     def setUp(self):
         self.url = reverse(settings.LOGIN_URL)
@@ -241,6 +355,28 @@ class TestLoginView(TestCase):
         self.assertIn("このフィールドは必須です。", form.errors["password"])
 
 
+@override_settings(
+    PASSWORD_HASHERS=["accounts.hashers.ScryptPasswordHasher", "django.contrib.auth.hashers.MD5PasswordHasher"],
+    PASSWORD_HASHER_OPTIONS={"work_factor": 2**10},
+)
+class TestPasswordHashers(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="testuser", password=make_password("testpassword", hasher="md5"))
+
+    def test_rehash_on_login(self):
+        self.assertTrue(self.client.login(username="testuser", password="testpassword"))
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("scrypt$"))
+        self.assertIn("$1024$", self.user.password)
+
+    def test_rehash_when_options_change(self):
+        self.client.login(username="testuser", password="testpassword")
+        with self.settings(PASSWORD_HASHER_OPTIONS={"work_factor": 2**11}):
+            self.assertTrue(self.client.login(username="testuser", password="testpassword"))
+        self.user.refresh_from_db()
+        self.assertIn("$2048$", self.user.password)
+
+
 class TestLogoutView(TestCase):
     def test_success_post(self):
         self.client.login(username="testuser", password="testpassword")
@@ -248,8 +384,48 @@ class TestLogoutView(TestCase):
         self.assertRedirects(response, "/accounts/login/")
 
 
-# class TestUserProfileView(TestCase)
-#    def test_success_get(self):
+class TestUserProfileView(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        self.url = reverse("accounts:user_profile", kwargs={"username": self.user.username})
+
+    def test_success_get(self):
+        tweet = Tweet.objects.create(user=self.user, content="hello")
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["profile_user"], self.user)
+        self.assertEqual(list(response.context["tweet_list"]), [tweet])
+
+    @override_settings(TIMELINE_PAGE_SIZE=1)
+    def test_success_get_with_cursor(self):
+        first = Tweet.objects.create(user=self.user, content="first")
+        Tweet.objects.create(user=self.user, content="second")
+
+        response = self.client.get(self.url)
+        response = self.client.get(self.url, {"cursor": response.context["page_obj"].next_cursor})
+        self.assertEqual(list(response.context["tweet_list"]), [first])
+        self.assertFalse(response.context["page_obj"].has_next)
+
+    def test_failure_get_with_not_exists_user(self):
+        response = self.client.get(reverse("accounts:user_profile", kwargs={"username": "nonexistinguser"}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_success_get_with_username_in_different_case(self):
+        response = self.client.get(reverse("accounts:user_profile", kwargs={"username": "TestUser"}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["profile_user"], self.user)
+
+    def test_not_modified_until_profile_changes(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Tweet.objects.create(user=self.user, content="hello")
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_not_modified_without_queries(self):
+        etag = self.client.get(self.url)["ETag"]
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
 
 
 # class TestUserProfileEditView(TestCase):
@@ -262,25 +438,176 @@ class TestLogoutView(TestCase):
 #     def test_failure_post_with_incorrect_user(self):
 
 
-# class TestFollowView(TestCase):
-#     def test_success_post(self):
+class TestFollowView(TestCase):
+    def setUp(self):
+        caches[settings.FOLLOW_GRAPH_CACHE].clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.other = User.objects.create_user(username="other", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+
+    def test_success_post(self):
+        response = self.client.post(reverse("accounts:follow", kwargs={"username": self.other.username}))
+        self.assertRedirects(response, reverse("accounts:user_profile", kwargs={"username": self.other.username}))
+        self.assertTrue(FriendShip.objects.filter(follower=self.user, following=self.other).exists())
+        self.assertTrue(is_following(self.user.pk, self.other.pk))
 
-#     def test_failure_post_with_not_exist_user(self):
+    def test_failure_post_with_not_exist_user(self):
+        response = self.client.post(reverse("accounts:follow", kwargs={"username": "nonexistinguser"}))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(FriendShip.objects.exists())
 
-#     def test_failure_post_with_self(self):
+    def test_failure_post_with_self(self):
+        response = self.client.post(reverse("accounts:follow", kwargs={"username": self.user.username}))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(FriendShip.objects.exists())
 
 
-# class TestUnfollowView(TestCase):
-#     def test_success_post(self):
+class TestUnfollowView(TestCase):
+    def setUp(self):
+        caches[settings.FOLLOW_GRAPH_CACHE].clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.other = User.objects.create_user(username="other", password="testpassword")
+        FriendShip.objects.create(follower=self.user, following=self.other)
+        self.client.login(username="testuser", password="testpassword")
 
-#     def test_failure_post_with_not_exist_tweet(self):
+    def test_success_post(self):
+        self.assertTrue(is_following(self.user.pk, self.other.pk))
+        response = self.client.post(reverse("accounts:unfollow", kwargs={"username": self.other.username}))
+        self.assertRedirects(response, reverse("accounts:user_profile", kwargs={"username": self.other.username}))
+        self.assertFalse(FriendShip.objects.exists())
+        self.assertFalse(is_following(self.user.pk, self.other.pk))
 
-#     def test_failure_post_with_incorrect_user(self):
+    def test_failure_post_with_not_exist_user(self):
+        response = self.client.post(reverse("accounts:unfollow", kwargs={"username": "nonexistinguser"}))
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(FriendShip.objects.exists())
 
+    def test_failure_post_with_self(self):
+        response = self.client.post(reverse("accounts:unfollow", kwargs={"username": self.user.username}))
+        self.assertEqual(response.status_code, 400)
 
-# class TestFollowingListView(TestCase):
-#     def test_success_get(self):
 
+class TestFollowingListView(TestCase):
+    def setUp(self):
+        caches[settings.FOLLOW_GRAPH_CACHE].clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.mutual = User.objects.create_user(username="mutual", password="testpassword")
+        self.other = User.objects.create_user(username="other", password="testpassword")
+        FriendShip.objects.create(follower=self.user, following=self.other)
+        FriendShip.objects.create(follower=self.user, following=self.mutual)
+        FriendShip.objects.create(follower=self.mutual, following=self.user)
+        self.client.login(username="testuser", password="testpassword")
 
-# class TestFollowerListView(TestCase):
-#     def test_success_get(self):
+    def test_success_get(self):
+        response = self.client.get(reverse("accounts:following_list", kwargs={"username": self.user.username}))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "accounts/following_list.html")
+        users = response.context["user_list"]
+        self.assertEqual(users, [self.mutual, self.other])
+        self.assertEqual([user.follows_viewer for user in users], [True, False])
+        self.assertContains(response, "相互フォロー")
+
+    @override_settings(TIMELINE_PAGE_SIZE=1)
+    def test_success_get_with_cursor(self):
+        url = reverse("accounts:following_list", kwargs={"username": self.user.username})
+        response = self.client.get(url)
+        response = self.client.get(url, {"cursor": response.context["page_obj"].next_cursor})
+        self.assertEqual(response.context["user_list"], [self.other])
+
+    def test_failure_get_with_not_exists_user(self):
+        response = self.client.get(reverse("accounts:following_list", kwargs={"username": "nonexistinguser"}))
+        self.assertEqual(response.status_code, 404)
+
+
+class TestFollowerListView(TestCase):
+    def setUp(self):
+        caches[settings.FOLLOW_GRAPH_CACHE].clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.other = User.objects.create_user(username="other", password="testpassword")
+        FriendShip.objects.create(follower=self.other, following=self.user)
+        self.client.login(username="testuser", password="testpassword")
+
+    def test_success_get(self):
+        response = self.client.get(reverse("accounts:follower_list", kwargs={"username": self.user.username}))
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "accounts/follower_list.html")
+        self.assertEqual(response.context["user_list"], [self.other])
+        self.assertContains(response, "フォローされています")
+
+
+class TestFollowGraph(TestCase):
+    def setUp(self):
+        caches[settings.FOLLOW_GRAPH_CACHE].clear()
+        self.users = [User.objects.create_user(username=f"user{i}", password="testpassword") for i in range(4)]
+        a, b, c, d = self.users
+        for follower, following in [(a, b), (a, c), (b, a), (c, d), (d, a)]:
+            FriendShip.objects.create(follower=follower, following=following)
+
+    def test_is_following_is_cached(self):
+        a, b, c, d = self.users
+        self.assertTrue(is_following(a.pk, b.pk))
+        with self.assertNumQueries(0):
+            self.assertTrue(is_following(a.pk, c.pk))
+            self.assertFalse(is_following(a.pk, d.pk))
+
+    def test_cache_is_invalidated_on_follow(self):
+        a, b, c, d = self.users
+        self.assertFalse(is_following(a.pk, d.pk))
+        FriendShip.objects.create(follower=a, following=d)
+        self.assertTrue(is_following(a.pk, d.pk))
+
+    def test_cache_is_invalidated_again_on_commit(self):
+        a, b, c, d = self.users
+        with self.captureOnCommitCallbacks(execute=True):
+            FriendShip.objects.create(follower=a, following=d)
+            # コミット前に他のリクエストが古い行を読んでキャッシュに書き戻した状態
+            caches[settings.FOLLOW_GRAPH_CACHE].clear()
+            with mock.patch.object(FriendShip.objects, "filter", return_value=FriendShip.objects.none()):
+                self.assertFalse(is_following(a.pk, d.pk))
+        self.assertTrue(is_following(a.pk, d.pk))
+
+    def test_mutual_and_follows_you(self):
+        a, b, c, d = self.users
+        self.assertEqual(mutual_ids(a.pk), [b.pk])
+        self.assertEqual(follows_you_ids(a.pk, [b.pk, c.pk, d.pk]), [b.pk, d.pk])
+
+
+class TestUsernameResolver(TestCase):
+    def setUp(self):
+        caches[settings.USERNAME_CACHE].clear()
+        self.user = User.objects.create_user(username="TestUser", password="testpassword")
+
+    def test_resolve_ignores_case(self):
+        self.assertEqual(resolve_username("testuser"), self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(resolve_username("TESTUSER"), self.user.pk)
+
+    def test_lookup_uses_index(self):
+        with CaptureQueriesContext(connection) as queries:
+            resolve_username("testuser")
+        plan = connection.cursor().execute(f"EXPLAIN QUERY PLAN {queries[0]['sql']}").fetchall()
+        self.assertIn("unique_username_ci", str(plan))
+
+    def test_unknown_username_is_cached(self):
+        self.assertIsNone(resolve_username("nobody"))
+        with self.assertNumQueries(0):
+            self.assertIsNone(resolve_username("nobody"))
+        user = User.objects.create_user(username="Nobody", password="testpassword")
+        self.assertEqual(resolve_username("nobody"), user.pk)
+
+    def test_cache_is_invalidated_on_rename(self):
+        self.assertEqual(resolve_username("testuser"), self.user.pk)
+        user = User.objects.get(pk=self.user.pk)
+        user.username = "renamed"
+        user.save()
+        self.assertIsNone(resolve_username("testuser"))
+        self.assertEqual(resolve_username("renamed"), self.user.pk)
+
+    def test_cache_is_invalidated_on_delete(self):
+        self.assertEqual(resolve_username("testuser"), self.user.pk)
+        self.user.delete()
+        self.assertIsNone(resolve_username("testuser"))
+
+    def test_username_is_unique_ignoring_case(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            User.objects.create_user(username="testuser", password="testpassword")
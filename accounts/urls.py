@@ -7,11 +7,12 @@ app_name = "accounts"
 
 urlpatterns = [
     path("signup/", views.SignupView.as_view(), name="signup"),
-    path("login/", auth_views.LoginView.as_view(template_name="accounts/login.html"), name="login"),
+    path("login/", views.LoginView.as_view(), name="login"),
     path("logout/", auth_views.LogoutView.as_view(), name="logout"),
+    path("delete/", views.AccountDeleteView.as_view(), name="delete"),
     path("<str:username>/", views.UserProfileView.as_view(), name="user_profile"),
-    # path('<str:username>/follow/', views.FollowView.as_view(), name='follow'),
-    # path('<str:username>/unfollow/', views.UnFollowView, name='unfollow'),
-    # path('<str:username>/following_list/', views.FollowingListView.as_view(), name='following_list'),
-    # path('<str:username>/follower_list/', views.FollowerListView.as_view(), name='follower_list'),
+    path("<str:username>/follow/", views.FollowView.as_view(), name="follow"),
+    path("<str:username>/unfollow/", views.UnFollowView.as_view(), name="unfollow"),
+    path("<str:username>/following_list/", views.FollowingListView.as_view(), name="following_list"),
+    path("<str:username>/follower_list/", views.FollowerListView.as_view(), name="follower_list"),
 ]
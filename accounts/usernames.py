@@ -0,0 +1,48 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Value
+from django.db.models.functions import Lower
+from django.http import Http404
+
+from mysite.caches import also_on_commit
+from mysite.instrumentation import record_cache_access
+
+from .models import User
+
+# ユーザー名（大文字・小文字は区別しない）→ ユーザー id をキャッシュする。
+# 存在しない名前も 0 として USERNAME_NEGATIVE_TIMEOUT 秒覚えておき、適当な名前を総当たりされても DB を引かない
+MISSING = 0
+
+
+def username_key(username):
+    return f"username:{hashlib.md5(username.lower().encode()).hexdigest()}"
+
+
+def resolve_username(username):
+    cache = caches[settings.USERNAME_CACHE]
+    key = username_key(username)
+    user_id = cache.get(key)
+    record_cache_access(hit=user_id is not None)
+    if user_id is None:
+        # unique_username_ci の索引を使うよう、Lower(username) で比べる
+        users = User.objects.alias(username_lower=Lower("username")).filter(username_lower=Lower(Value(username)))
+        user_id = users.values_list("id", flat=True).first()
+        if user_id is None:
+            cache.set(key, MISSING, settings.USERNAME_NEGATIVE_TIMEOUT)
+        else:
+            cache.set(key, user_id)
+    return user_id or None
+
+
+def resolve_username_or_404(username):
+    user_id = resolve_username(username)
+    if user_id is None:
+        raise Http404
+    return user_id
+
+
+@also_on_commit
+def invalidate_usernames(*usernames):
+    caches[settings.USERNAME_CACHE].delete_many([username_key(username) for username in usernames if username])
@@ -1,11 +1,29 @@
-from django.contrib.auth import authenticate, login
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import login, logout
+from django.contrib.auth import views as auth_views
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import Http404, HttpResponseBadRequest
+from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse_lazy
+from django.views import View
 from django.views.generic import CreateView, TemplateView
 
+from mysite.conditional import ConditionalGetMixin, get_versions, make_etag
+from mysite.pagination import CursorPaginator, InvalidCursor
+from mysite.ratelimit import ratelimit
+from tweets.viewer_state import aattach_viewer_state
+
 from .forms import SignupForm
+from .graph import attach_follow_state, is_following
+from .mixins import AsyncLoginRequiredMixin
+from .models import FriendShip, User
+from .usernames import resolve_username_or_404
 
 
+@ratelimit("ip", "10/h")
 class SignupView(CreateView):
     form_class = SignupForm
     template_name = "accounts/signup.html"
@@ -13,21 +31,116 @@ class SignupView(CreateView):
 
     def form_valid(self, form):
         response = super().form_valid(form)
-        username = form.cleaned_data["username"]
-        password = form.cleaned_data["password1"]
-        user = authenticate(self.request, username=username, password=password)
-        login(self.request, user)
+        # 作ったばかりのユーザーなので authenticate() でパスワードをもう一度ハッシュ化する必要はない
+        login(self.request, self.object, backend="django.contrib.auth.backends.ModelBackend")
         return response
 
 
-class UserProfileView(LoginRequiredMixin, TemplateView):
+def login_username(request):
+    # ユーザー名は大文字・小文字を区別しないので、表記を変えて制限をすり抜けられないようにそろえる
+    username = request.POST.get("username")
+    return username.lower() if username else None
+
+
+# パスワードの総当たりを防ぐため、IP ごとに加えて入力されたユーザー名ごとにも制限する
+@ratelimit("ip", "20/m")
+@ratelimit(login_username, "5/m")
+class LoginView(auth_views.LoginView):
+    template_name = "accounts/login.html"
+
+
+class AccountDeleteView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        # ツイート・フォローなどの行はここでは消さず、tweets.purge_user タスクに任せる
+        user = request.user
+        logout(request)
+        user.soft_delete()
+        return redirect("welcome:welcome")
+
+
+class UserProfileView(AsyncLoginRequiredMixin, ConditionalGetMixin, TemplateView):
     template_name = "accounts/profile.html"
 
-    def get(self, request, *args, **kwargs):
+    def get_etag(self, request, *args, **kwargs):
+        # 表示されるユーザーの投稿・フォローと、閲覧者のいいね・フォローのどちらかが変われば作り直す。
+        # ユーザー名からの id もキャッシュから引くので、304 を返すときは DB を引かない
+        self.profile_user_id = resolve_username_or_404(self.kwargs.get("username") or request.user.username)
+        versions = get_versions(f"user:{self.profile_user_id}", f"user:{request.user.pk}")
+        return make_etag("profile", self.profile_user_id, request.user.pk, *versions, request.GET.get("cursor"))
+
+    async def get(self, request, *args, **kwargs):
         context = self.get_context_data(**kwargs)
-        username = self.kwargs.get("username", None)
-        if username:
-            context["username"] = username
-        else:
-            context["username"] = self.request.user.username
+        try:
+            profile_user = await User.objects.aget(pk=self.profile_user_id)
+        except User.DoesNotExist:
+            raise Http404
+        context["username"] = profile_user.username
+        paginator = CursorPaginator(profile_user.tweets.select_related("user"), settings.TIMELINE_PAGE_SIZE)
+        try:
+            page, following, follows_you = await asyncio.gather(
+                paginator.apage(self.request.GET.get("cursor")),
+                sync_to_async(is_following)(request.user.id, profile_user.id),
+                sync_to_async(is_following)(profile_user.id, request.user.id),
+            )
+        except InvalidCursor:
+            raise Http404
+        context["profile_user"] = profile_user
+        context["is_following"] = following
+        context["follows_you"] = follows_you
+        context["page_obj"] = page
+        context["tweet_list"] = await aattach_viewer_state(page.object_list, self.request.user)
         return self.render_to_response(context)
+
+
+@ratelimit("user", "30/m")
+class FollowView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        user_id = resolve_username_or_404(self.kwargs["username"])
+        if user_id == request.user.id:
+            return HttpResponseBadRequest("自分自身をフォローすることはできません。")
+        FriendShip.objects.get_or_create(follower=request.user, following_id=user_id)
+        return redirect("accounts:user_profile", username=self.kwargs["username"])
+
+
+@ratelimit("user", "30/m")
+class UnFollowView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        user_id = resolve_username_or_404(self.kwargs["username"])
+        if user_id == request.user.id:
+            return HttpResponseBadRequest("自分自身のフォローは解除できません。")
+        FriendShip.objects.filter(follower=request.user, following_id=user_id).delete()
+        return redirect("accounts:user_profile", username=self.kwargs["username"])
+
+
+class FollowingListView(LoginRequiredMixin, TemplateView):
+    template_name = "accounts/following_list.html"
+
+    def get_relations(self, user):
+        # 退会したユーザーとの関係は purge で消えるまで残っている
+        return FriendShip.objects.filter(follower=user, following__is_deleted=False).select_related("following")
+
+    def get_user(self, relation):
+        return relation.following
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        profile_user = get_object_or_404(User, pk=resolve_username_or_404(self.kwargs["username"]))
+        paginator = CursorPaginator(self.get_relations(profile_user), settings.TIMELINE_PAGE_SIZE)
+        try:
+            page = paginator.page(self.request.GET.get("cursor"))
+        except InvalidCursor:
+            raise Http404
+        context["profile_user"] = profile_user
+        context["page_obj"] = page
+        context["user_list"] = attach_follow_state(map(self.get_user, page.object_list), self.request.user)
+        return context
+
+
+class FollowerListView(FollowingListView):
+    template_name = "accounts/follower_list.html"
+
+    def get_relations(self, user):
+        return FriendShip.objects.filter(following=user, follower__is_deleted=False).select_related("follower")
+
+    def get_user(self, relation):
+        return relation.follower
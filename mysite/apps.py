@@ -0,0 +1,9 @@
+from django.apps import AppConfig
+
+
+class MysiteConfig(AppConfig):
+    # モデルは持たない。プロジェクト全体に関わる管理コマンドを置く
+    name = "mysite"
+
+    def ready(self):
+        from . import checks  # noqa: F401
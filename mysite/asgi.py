@@ -11,6 +11,11 @@ import os
 
 from django.core.asgi import get_asgi_application
 
+from mysite.template_cache import precompile_templates
+
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
 
 application = get_asgi_application()
+
+# TEMPLATES_PRECOMPILE=True（本番）なら、リクエストを受ける前にテンプレートをコンパイルしておく
+precompile_templates()
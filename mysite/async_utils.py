@@ -0,0 +1,2 @@
+async def alist(queryset):
+    return [obj async for obj in queryset]
@@ -0,0 +1,100 @@
+import functools
+import math
+import os
+import random
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+from .instrumentation import record_cache_access
+
+BACKENDS = {
+    "locmem": "django.core.cache.backends.locmem.LocMemCache",
+    "file": "django.core.cache.backends.filebased.FileBasedCache",
+    "redis": "django.core.cache.backends.redis.RedisCache",
+    "dummy": "django.core.cache.backends.dummy.DummyCache",
+}
+
+# エイリアスごとのデフォルト TIMEOUT（秒）
+ALIASES = {
+    "default": 300,
+    "timeline": 60,
+    "fragments": 60 * 60,
+    "sessions": 60 * 60 * 24 * 14,
+    "ratelimit": 60 * 60,
+    "graph": 60 * 60,
+    "usernames": 60 * 60,
+    "pages": 60 * 5,
+}
+
+
+def build_caches(base_dir, env=os.environ):
+    # CACHE_<ALIAS>_<NAME> があればそれを、なければ CACHE_<NAME> を使う
+    # 例: CACHE_BACKEND=redis CACHE_LOCATION=redis://127.0.0.1:6379/0 CACHE_FRAGMENTS_MAX_ENTRIES=50000
+    result = {}
+    for alias, timeout in ALIASES.items():
+
+        def get(name, default, alias=alias):
+            return env.get(f"CACHE_{alias.upper()}_{name}", env.get(f"CACHE_{name}", default))
+
+        backend = get("BACKEND", "locmem")
+        config = {
+            "BACKEND": BACKENDS[backend],
+            "TIMEOUT": int(get("TIMEOUT", timeout)),
+            "KEY_PREFIX": alias,
+        }
+        if backend == "locmem":
+            config["LOCATION"] = alias
+        elif backend == "file":
+            config["LOCATION"] = get("LOCATION", str(base_dir / ".cache" / alias))
+        elif backend == "redis":
+            # Redis は maxmemory-policy で追い出すので MAX_ENTRIES は使わない
+            config["LOCATION"] = get("LOCATION", "redis://127.0.0.1:6379/0")
+        if backend in ("locmem", "file"):
+            config["OPTIONS"] = {
+                "MAX_ENTRIES": int(get("MAX_ENTRIES", 10000)),
+                "CULL_FREQUENCY": int(get("CULL_FREQUENCY", 3)),
+            }
+        result[alias] = config
+    return result
+
+
+def also_on_commit(func):
+    # キャッシュを消す関数に付ける。すぐに消したうえで、トランザクション中ならコミット後にもう一度消す。
+    # コミット前に他のリクエストが古い行を読んでキャッシュに書き戻しても、TTL の間残り続けることはない
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        func(*args, **kwargs)
+        if transaction.get_connection().in_atomic_block:
+            transaction.on_commit(lambda: func(*args, **kwargs))
+
+    return wrapper
+
+
+def is_process_local(alias):
+    # locmem はプロセスごとに中身が別なので、Web サーバーを複数プロセスで動かすと他のプロセスの書き込み・削除が見えない
+    return settings.WEB_CONCURRENCY > 1 and isinstance(caches[alias], LocMemCache)
+
+
+def get_or_set(key, compute, timeout=None, alias="default", beta=1.0):
+    # 確率的早期再計算（XFetch）。期限切れ直前のキーをランダムに 1 リクエストだけ先に再計算させ、
+    # 期限切れの瞬間に全員が同時に再計算するのを防ぐ
+    cache = caches[alias]
+    if timeout is None:
+        timeout = cache.default_timeout
+    entry = cache.get(key)
+    if entry is not None:
+        value, delta, expires_at = entry
+        if time.time() - delta * beta * math.log(1.0 - random.random()) < expires_at:
+            record_cache_access(hit=True)
+            return value
+
+    record_cache_access(hit=False)
+    start = time.time()
+    value = compute()
+    delta = time.time() - start
+    cache.set(key, (value, delta, start + timeout), timeout)
+    return value
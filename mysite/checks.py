@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+from .caches import is_process_local
+
+# 他のプロセスでの更新・破棄が見えないと古い内容を返し続けるキャッシュ
+SHARED_CACHE_SETTINGS = ["VERSION_CACHE", "AUTH_USER_CACHE"]
+
+
+@register(Tags.caches)
+def check_shared_caches(app_configs, **kwargs):
+    return [
+        Error(
+            f"{name} のキャッシュ {getattr(settings, name)!r} が locmem のまま、WEB_CONCURRENCY が 2 以上です。",
+            hint=f"CACHE_{getattr(settings, name).upper()}_BACKEND に redis か file を指定してください。",
+            id="mysite.E001",
+        )
+        for name in SHARED_CACHE_SETTINGS
+        if is_process_local(getattr(settings, name))
+    ]
@@ -0,0 +1,86 @@
+import gzip
+import secrets
+import zlib
+
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware as BaseGZipMiddleware
+from django.middleware.gzip import re_accepts_gzip
+from django.utils.cache import patch_vary_headers
+from django.utils.text import StreamingBuffer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 圧縮すると届くまで溜め込まれてしまう形式
+UNCOMPRESSED_CONTENT_TYPES = ("text/event-stream",)
+
+
+def compress(data):
+    # 事前圧縮用。時間をかけてよいので最大の圧縮率で、Content-Encoding ごとの圧縮結果を返す
+    compressed = {"gzip": gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressed["br"] = brotli.compress(data, quality=11)
+    return compressed
+
+
+def _random_filename(max_random_bytes):
+    # django.utils.text と同じく、gzip ヘッダーのファイル名で長さを揺らして BREACH を防ぐ
+    return b"a" * secrets.randbelow(max_random_bytes) if max_random_bytes else None
+
+
+def compress_sequence(sequence, max_random_bytes=None):
+    # チャンクごとに flush するので、圧縮器の中に溜まらずにすぐ送られる。全体は 1 本の gzip ストリームになる
+    buf = StreamingBuffer()
+    with gzip.GzipFile(
+        filename=_random_filename(max_random_bytes), mode="wb", compresslevel=6, fileobj=buf, mtime=0
+    ) as zfile:
+        yield buf.read()
+        for item in sequence:
+            zfile.write(item)
+            zfile.flush(zlib.Z_SYNC_FLUSH)
+            yield buf.read()
+    yield buf.read()
+
+
+async def acompress_sequence(sequence, max_random_bytes=None):
+    buf = StreamingBuffer()
+    with gzip.GzipFile(
+        filename=_random_filename(max_random_bytes), mode="wb", compresslevel=6, fileobj=buf, mtime=0
+    ) as zfile:
+        yield buf.read()
+        async for item in sequence:
+            zfile.write(item)
+            zfile.flush(zlib.Z_SYNC_FLUSH)
+            yield buf.read()
+    yield buf.read()
+
+
+class GZipMiddleware(BaseGZipMiddleware):
+    # django の GZipMiddleware に加えて、
+    # - GZIP_MIN_LENGTH バイト未満のレスポンスと text/event-stream は圧縮しない
+    # - ストリーミングはチャンクごとに flush し、チャンクの到着を遅らせない
+    def process_response(self, request, response):
+        if response.get("Content-Type", "").startswith(UNCOMPRESSED_CONTENT_TYPES):
+            return response
+        if not response.streaming:
+            if len(response.content) < settings.GZIP_MIN_LENGTH:
+                return response
+            return super().process_response(request, response)
+
+        if response.has_header("Content-Encoding"):
+            return response
+        patch_vary_headers(response, ("Accept-Encoding",))
+        if not re_accepts_gzip.search(request.META.get("HTTP_ACCEPT_ENCODING", "")):
+            return response
+        if response.is_async:
+            response.streaming_content = acompress_sequence(response.streaming_content, self.max_random_bytes)
+        else:
+            response.streaming_content = compress_sequence(response.streaming_content, self.max_random_bytes)
+        del response.headers["Content-Length"]
+        etag = response.get("ETag")
+        if etag and etag.startswith('"'):
+            response.headers["ETag"] = "W/" + etag
+        response.headers["Content-Encoding"] = "gzip"
+        return response
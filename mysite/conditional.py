@@ -0,0 +1,116 @@
+import hashlib
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import urlencode
+
+from .caches import also_on_commit, is_process_local
+
+
+def version_key(scope):
+    return f"version:{scope}"
+
+
+def get_versions(*scopes):
+    # キャッシュから消えていた版は新しい値で作り直す。古い ETag と一致することはないので、取りこぼしは再描画になるだけ
+    cache = caches[settings.VERSION_CACHE]
+    keys = [version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+@also_on_commit
+def bump_version(*scopes):
+    caches[settings.VERSION_CACHE].set_many({version_key(scope): time.time_ns() for scope in scopes}, None)
+
+
+def make_etag(*parts):
+    digest = hashlib.md5(":".join(map(str, parts)).encode()).hexdigest()
+    return f'W/"{digest}"'
+
+
+class ConditionalGetMixin:
+    # get_etag() が前回と同じ値を返せば、ビューを実行せず描画もせずに 304 を返す。
+    # ETag は DB を引かずに（引いても索引 1 回で）求まるものから作ること
+    def get_etag(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def dispatch(self, request, *args, **kwargs):
+        # 版が他のプロセスと共有されていなければ、古い ETag で 304 を返しかねないので使わない
+        if request.method not in ("GET", "HEAD") or is_process_local(settings.VERSION_CACHE):
+            return super().dispatch(request, *args, **kwargs)
+        if self.view_is_async:
+            return self._adispatch(request, *args, **kwargs)
+        etag = self.get_etag(request, *args, **kwargs)
+        return get_conditional_response(request, etag=etag) or self._finish(
+            super().dispatch(request, *args, **kwargs), etag
+        )
+
+    async def _adispatch(self, request, *args, **kwargs):
+        etag = await sync_to_async(self.get_etag)(request, *args, **kwargs)
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified:
+            return not_modified
+        return self._finish(await super().dispatch(request, *args, **kwargs), etag)
+
+    @staticmethod
+    def _finish(response, etag):
+        if response.status_code == 200:
+            response["ETag"] = etag
+            # ログインユーザーごとの内容なので共有キャッシュには置かせず、毎回 ETag で確認させる
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class AnonymousPageCacheMixin:
+    # セッション Cookie を持たないリクエストには、描画済みのページをキャッシュから返す
+    page_cache_timeout = None
+    # キーに含めるクエリパラメータ。それ以外（utm_* など）を付けられてもキャッシュを分けない
+    page_cache_query_params = ()
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD") or settings.SESSION_COOKIE_NAME in request.COOKIES:
+            return super().dispatch(request, *args, **kwargs)
+        if self.view_is_async:
+            return self._adispatch(request, *args, **kwargs)
+        return self._get_cached(request) or self._store(request, super().dispatch(request, *args, **kwargs))
+
+    async def _adispatch(self, request, *args, **kwargs):
+        return self._get_cached(request) or self._store(request, await super().dispatch(request, *args, **kwargs))
+
+    def _page_key(self, request):
+        params = sorted((name, value) for name in self.page_cache_query_params for value in request.GET.getlist(name))
+        return f"page:{request.path}?{urlencode(params)}"
+
+    def _get_cached(self, request):
+        cached = caches[settings.ANONYMOUS_PAGE_CACHE].get(self._page_key(request))
+        return cached and self._cached_response(request, *cached)
+
+    def _store(self, request, response):
+        if response.status_code != 200:
+            return response
+        if hasattr(response, "render"):
+            response.render()
+        entry = (response.content, response["Content-Type"])
+        caches[settings.ANONYMOUS_PAGE_CACHE].set(self._page_key(request), entry, self.get_page_cache_timeout())
+        return self._cached_response(request, *entry)
+
+    def _cached_response(self, request, content, content_type):
+        etag = make_etag(content)
+        response = get_conditional_response(request, etag=etag) or HttpResponse(content, content_type=content_type)
+        response["ETag"] = etag
+        patch_cache_control(response, public=True, max_age=self.get_page_cache_timeout())
+        # ログインすると内容が変わるので、Cookie ごとに分けてキャッシュさせる
+        patch_vary_headers(response, ["Cookie"])
+        return response
+
+    def get_page_cache_timeout(self):
+        return self.page_cache_timeout or settings.ANONYMOUS_PAGE_TIMEOUT
@@ -0,0 +1,86 @@
+import atexit
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+logger = logging.getLogger("mysite.counters")
+
+
+class CounterBuffer:
+    # カウンタの増減をメモリ上にためておき、UPDATE ... SET n = n + delta でまとめて反映する
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._deltas = defaultdict(int)
+        self._last_flush = time.monotonic()
+
+    def incr(self, model, pk, field, delta=1):
+        with self._lock:
+            self._deltas[(model._meta.label, field, pk)] += delta
+            due = (
+                len(self._deltas) >= settings.COUNTER_FLUSH_SIZE
+                or time.monotonic() - self._last_flush >= settings.COUNTER_FLUSH_INTERVAL
+            )
+        if due:
+            self.flush_on_commit()
+
+    def decr(self, model, pk, field, delta=1):
+        self.incr(model, pk, field, -delta)
+
+    def pending(self, model, pk, field):
+        with self._lock:
+            return self._deltas.get((model._meta.label, field, pk), 0)
+
+    def flush_if_due(self, **kwargs):
+        if time.monotonic() - self._last_flush >= settings.COUNTER_FLUSH_INTERVAL:
+            self.flush_on_commit()
+
+    def flush_on_commit(self):
+        # flush は他のリクエストの分も含めて書き込むので、呼び出し元のトランザクションと一緒に巻き戻されないよう
+        # コミットを待ってから書き込む（トランザクションの外ならすぐに書き込む）
+        transaction.on_commit(self.flush)
+
+    def flush(self):
+        # トランザクションの外から呼ぶこと。中からは flush_on_commit を使う
+        with self._lock:
+            deltas, self._deltas = self._deltas, defaultdict(int)
+            self._last_flush = time.monotonic()
+
+        # 同じ増減量の行は pk__in でひとつの UPDATE にまとめる
+        batches = defaultdict(list)
+        for (label, field, pk), delta in deltas.items():
+            if delta:
+                batches[(label, field, delta)].append(pk)
+        for (label, field, delta), pks in batches.items():
+            try:
+                # 呼び出し元のトランザクションを巻き込まないよう、UPDATE ごとにセーブポイントを切る
+                with transaction.atomic():
+                    model = apps.get_model(label)
+                    # 実際の件数とずれていても 0 未満にはしない（ずれは reconcile_counters で直す）
+                    model._base_manager.filter(pk__in=pks).update(**{field: Greatest(F(field) + delta, 0)})
+            except Exception:
+                # リクエストを失敗させず、次の flush でやり直す
+                logger.exception("カウンタ %s.%s を更新できませんでした", label, field)
+                with self._lock:
+                    for pk in pks:
+                        self._deltas[(label, field, pk)] += delta
+        return len(deltas)
+
+    def flush_at_exit(self):
+        # プロセスの終了時にたまっている分を書き込む。それでも失われた分は reconcile_counters で数え直す
+        if settings.COUNTER_FLUSH_AT_EXIT and self._deltas:
+            self.flush()
+
+    def clear(self):
+        with self._lock:
+            self._deltas.clear()
+
+
+buffer = CounterBuffer()
+atexit.register(buffer.flush_at_exit)
@@ -0,0 +1,77 @@
+import os
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+
+def _flag(value):
+    return value.lower() in ("1", "true", "yes", "on")
+
+
+def build_databases(base_dir, env=os.environ):
+    # DB_ENGINE=postgresql DB_NAME=... DB_USER=... DB_HOST=... のように環境変数で切り替える
+    engine = env.get("DB_ENGINE", "sqlite3")
+    if "." not in engine:
+        # SQLite は BEGIN IMMEDIATE で書き込みロックを先に取れる mysite.sqlite3 バックエンドで開く
+        engine = "mysite.sqlite3" if engine == "sqlite3" else f"django.db.backends.{engine}"
+    default = {
+        "ENGINE": engine,
+        # 接続を使い回し、再利用前に生きているか確認する
+        "CONN_MAX_AGE": int(env.get("DB_CONN_MAX_AGE", 60)),
+        "CONN_HEALTH_CHECKS": _flag(env.get("DB_CONN_HEALTH_CHECKS", "true")),
+    }
+    if engine in ("mysite.sqlite3", "django.db.backends.sqlite3"):
+        default["NAME"] = env.get("DB_NAME", str(base_dir / "db.sqlite3"))
+        # ロック待ちの秒数（busy timeout）はここだけで決める
+        default["OPTIONS"] = {"timeout": int(env.get("DB_SQLITE_TIMEOUT", 20))}
+        if engine == "mysite.sqlite3":
+            default["OPTIONS"]["transaction_mode"] = env.get("DB_SQLITE_TRANSACTION_MODE", "IMMEDIATE")
+    else:
+        default.update(
+            {
+                "NAME": env.get("DB_NAME", "mysite"),
+                "USER": env.get("DB_USER", ""),
+                "PASSWORD": env.get("DB_PASSWORD", ""),
+                "HOST": env.get("DB_HOST", ""),
+                "PORT": env.get("DB_PORT", ""),
+            }
+        )
+        if env.get("DB_POOL") == "pgbouncer":
+            # トランザクション単位のプーリングではサーバーサイドカーソルが使えない。接続はプーラーに任せる
+            default["DISABLE_SERVER_SIDE_CURSORS"] = True
+            default["CONN_MAX_AGE"] = 0
+
+    databases = {"default": default}
+    # DB_REPLICA_NAME（SQLite のファイル）か DB_REPLICA_HOST があれば読み込み用の replica を追加する
+    if env.get("DB_REPLICA_NAME") or env.get("DB_REPLICA_HOST"):
+        replica = dict(default)
+        replica["NAME"] = env.get("DB_REPLICA_NAME", default["NAME"])
+        if "HOST" in default:
+            replica["HOST"] = env.get("DB_REPLICA_HOST", default["HOST"])
+        if "OPTIONS" in default:
+            replica["OPTIONS"] = dict(default["OPTIONS"])
+            # 読み込み専用なので書き込みロックは取らない。テストで同じファイルを指すときにプライマリと取り合わない
+            if "transaction_mode" in replica["OPTIONS"]:
+                replica["OPTIONS"]["transaction_mode"] = "DEFERRED"
+        replica["TEST"] = {"MIRROR": "default"}
+        databases["replica"] = replica
+    return databases
+
+
+def build_sqlite_pragmas(env=os.environ):
+    return {
+        "journal_mode": env.get("SQLITE_JOURNAL_MODE", "WAL"),
+        "synchronous": env.get("SQLITE_SYNCHRONOUS", "NORMAL"),
+        "mmap_size": int(env.get("SQLITE_MMAP_SIZE", 256 * 1024 * 1024)),
+    }
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+connection_created.connect(configure_sqlite, dispatch_uid="configure_sqlite")
@@ -0,0 +1,161 @@
+import bisect
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import Http404, HttpResponse
+
+logger = logging.getLogger("mysite.performance")
+
+_stats = contextvars.ContextVar("request_stats", default=None)
+
+# ミリ秒単位のバケット境界
+BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+def record_cache_access(hit):
+    stats = _stats.get()
+    if stats is not None:
+        stats["cache_hits" if hit else "cache_misses"] += 1
+
+
+class Histogram:
+    def __init__(self, window=1000):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, duration_ms):
+        self.counts[bisect.bisect_left(BUCKETS, duration_ms)] += 1
+        self.total += duration_ms
+        self.count += 1
+        self.recent.append(duration_ms)
+
+    def quantile(self, q):
+        # 直近 window 件から求める
+        values = sorted(self.recent)
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+
+    def observe(self, view_name, duration_ms):
+        with self._lock:
+            self.histograms.setdefault(view_name, Histogram()).observe(duration_ms)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+
+    def render(self):
+        name = "http_request_duration_seconds"
+        lines = [f"# HELP {name} View response time.", f"# TYPE {name} histogram"]
+        quantiles = []
+        with self._lock:
+            for view_name, histogram in sorted(self.histograms.items()):
+                label = f'view="{view_name}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{label},le="{bound / 1000}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{label},le="+Inf"}} {histogram.count}')
+                lines.append(f"{name}_sum{{{label}}} {histogram.total / 1000}")
+                lines.append(f"{name}_count{{{label}}} {histogram.count}")
+                for q in (0.5, 0.9, 0.99):
+                    quantiles.append(f'{name}_recent{{{label},quantile="{q}"}} {histogram.quantile(q) / 1000}')
+        lines += [f"# TYPE {name}_recent gauge", *quantiles]
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class PerformanceMiddleware:
+    # PERF_INSTRUMENTATION=true のときだけ有効。DB 時間・クエリ数・テンプレート描画・キャッシュ・全体時間を計測し、
+    # Server-Timing ヘッダーとログに出力する
+    sync_capable = True
+    async_capable = False
+
+    def __init__(self, get_response):
+        if not settings.PERF_INSTRUMENTATION:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = {"queries": 0, "db_time": 0.0, "render_time": 0.0, "cache_hits": 0, "cache_misses": 0}
+        token = _stats.set(stats)
+
+        def execute_wrapper(execute, sql, params, many, context):
+            start = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                stats["queries"] += 1
+                stats["db_time"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(execute_wrapper))
+                response = self.get_response(request)
+        finally:
+            _stats.reset(token)
+        total = time.perf_counter() - start
+
+        view_name = request.resolver_match.view_name if request.resolver_match else "unresolved"
+        metrics.observe(view_name, total * 1000)
+        response["Server-Timing"] = ", ".join(
+            [
+                f'db;dur={stats["db_time"] * 1000:.1f};desc="{stats["queries"]} queries"',
+                f'render;dur={stats["render_time"] * 1000:.1f}',
+                f'cache;desc="hit={stats["cache_hits"]} miss={stats["cache_misses"]}"',
+                f"total;dur={total * 1000:.1f}",
+            ]
+        )
+        logger.info(
+            json.dumps(
+                {
+                    "view": view_name,
+                    "method": request.method,
+                    "status": response.status_code,
+                    "total_ms": round(total * 1000, 1),
+                    "db_ms": round(stats["db_time"] * 1000, 1),
+                    "queries": stats["queries"],
+                    "render_ms": round(stats["render_time"] * 1000, 1),
+                    "cache_hits": stats["cache_hits"],
+                    "cache_misses": stats["cache_misses"],
+                }
+            )
+        )
+        return response
+
+    def process_template_response(self, request, response):
+        # render() はこの直後に呼ばれるので、ここから post_render_callback までを描画時間とする
+        stats = _stats.get()
+        start = time.perf_counter()
+
+        def finish(rendered):
+            stats["render_time"] += time.perf_counter() - start
+
+        response.add_post_render_callback(finish)
+        return response
+
+
+def metrics_view(request):
+    if not settings.PERF_INSTRUMENTATION or request.META.get("REMOTE_ADDR") not in settings.INTERNAL_IPS:
+        raise Http404
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4")
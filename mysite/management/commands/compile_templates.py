@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.template import engines
+
+from mysite.template_cache import benchmark_render, compile_templates, extends_chain, iter_template_names
+
+
+class Command(BaseCommand):
+    help = (
+        "templates/ 以下のテンプレートをすべて読み込んでコンパイルし、構文エラーがないか確認します。"
+        "--benchmark を付けると、base.html を継承するページの描画時間を cached loader のあり・なしで比べます。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--all", action="store_true", help="admin などプロジェクト外のアプリのテンプレートも含める"
+        )
+        parser.add_argument(
+            "--benchmark", type=int, default=0, metavar="N", help="各テンプレートを N 回ずつ描画して比べる"
+        )
+
+    def handle(self, *args, **options):
+        names = list(iter_template_names(include_all=options["all"]))
+        start = time.perf_counter()
+        compiled, errors = compile_templates(names)
+        elapsed = time.perf_counter() - start
+        for name, error in errors:
+            self.stderr.write(f"{name}: {error}")
+        if errors:
+            raise CommandError(f"{len(errors)} 件のテンプレートに構文エラーがあります。")
+        self.stdout.write(f"{compiled} 件のテンプレートを {elapsed * 1000:.1f}ms でコンパイルしました。")
+
+        if options["benchmark"]:
+            self.benchmark(names, options["benchmark"])
+
+    def benchmark(self, names, iterations):
+        engine = engines["django"].engine
+        pages = [name for name in names if "base.html" in extends_chain(engine, name)]
+        results, skipped = benchmark_render(pages, iterations)
+        self.stdout.write(f"{'template':<32} {'uncached':>10} {'cached':>10} {'speedup':>8}")
+        for name, uncached, cached in results:
+            self.stdout.write(
+                f"{name:<32} {uncached * 1000:>8.3f}ms {cached * 1000:>8.3f}ms {uncached / cached:>7.1f}x"
+            )
+        if skipped:
+            self.stdout.write(f"空のコンテキストで描画できないため除外: {', '.join(skipped)}")
@@ -0,0 +1,77 @@
+import base64
+from datetime import datetime
+
+from django.core.paginator import InvalidPage
+from django.db.models import Q
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+def encode_cursor(created_at, pk):
+    raw = f"{created_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, pk = raw.split("|")
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor("不正なカーソルです。")
+
+
+def keyset_filter(fields, position):
+    # (created_at, id) < (c, i) を複合インデックスで引ける形に展開する
+    time_field, id_field = fields
+    created_at, pk = position
+    return Q(**{f"{time_field}__lt": created_at}) | Q(**{time_field: created_at, f"{id_field}__lt": pk})
+
+
+class CursorPage:
+    def __init__(self, object_list, next_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @classmethod
+    def from_items(cls, items, per_page, key):
+        # per_page + 1 件取得しておき、余りがあれば次ページありとみなす（COUNT は使わない）
+        items = list(items)
+        if len(items) <= per_page:
+            return cls(items)
+        return cls(items[:per_page], encode_cursor(*key(items[per_page - 1])))
+
+
+class CursorPaginator:
+    def __init__(self, object_list, per_page, fields=("created_at", "id")):
+        self.object_list = object_list
+        self.per_page = per_page
+        self.fields = fields
+
+    def _page_queryset(self, cursor):
+        queryset = self.object_list.order_by(*[f"-{field}" for field in self.fields])
+        if cursor:
+            queryset = queryset.filter(keyset_filter(self.fields, decode_cursor(cursor)))
+        return queryset[: self.per_page + 1]
+
+    def _key(self, obj):
+        return tuple(getattr(obj, field) for field in self.fields)
+
+    def page(self, cursor=None):
+        return CursorPage.from_items(self._page_queryset(cursor), self.per_page, key=self._key)
+
+    async def apage(self, cursor=None):
+        items = [obj async for obj in self._page_queryset(cursor)]
+        return CursorPage.from_items(items, self.per_page, key=self._key)
@@ -0,0 +1,112 @@
+import gzip
+import json
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from unittest import mock
+from urllib.parse import urlencode
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import connection
+from django.template.response import SimpleTemplateResponse
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver, reverse
+
+BUDGET_FILE = Path(__file__).resolve().parent / "perf_budgets.json"
+SKIP_NAMESPACES = {"admin"}
+
+
+def load_budgets(path=BUDGET_FILE):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def iter_routes(patterns=None, namespace=None):
+    # mysite.urls の名前付きルートを (名前, URL パラメータ名のリスト) で列挙する
+    if patterns is None:
+        patterns = get_resolver().url_patterns
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            if pattern.namespace in SKIP_NAMESPACES:
+                continue
+            child_namespace = pattern.namespace or namespace
+            if namespace and pattern.namespace:
+                child_namespace = f"{namespace}:{pattern.namespace}"
+            yield from iter_routes(pattern.url_patterns, child_namespace)
+        elif isinstance(pattern, URLPattern) and pattern.name:
+            name = f"{namespace}:{pattern.name}" if namespace else pattern.name
+            yield name, list(pattern.pattern.converters)
+
+
+def seed(size):
+    # size 件のツイートと、閲覧ユーザーがフォローする size // 10 人の投稿者を bulk_create で作る
+    from accounts.models import FriendShip
+    from tweets import search
+    from tweets.models import Like, TimelineEntry, Tweet
+
+    User = get_user_model()
+    password = make_password("testpassword")
+    viewer = User.objects.create(username="perf-viewer", password=password)
+    authors = User.objects.bulk_create(
+        [User(username=f"perf-author{i}", password=password) for i in range(max(1, size // 10))]
+    )
+    FriendShip.objects.bulk_create([FriendShip(follower=viewer, following=author) for author in authors])
+    tweets = Tweet.objects.bulk_create(
+        [Tweet(user=authors[i % len(authors)], content=f"tweet {i}") for i in range(size)], batch_size=1000
+    )
+    TimelineEntry.objects.bulk_create(
+        [TimelineEntry(owner=viewer, tweet=tweet, created_at=tweet.created_at) for tweet in tweets], batch_size=1000
+    )
+    Like.objects.bulk_create([Like(user=viewer, tweet=tweet) for tweet in tweets[::2]], batch_size=1000)
+    if search.is_available():
+        search.rebuild_index()
+    return {"viewer": viewer, "username": authors[0].username, "pk": tweets[-1].pk if tweets else 0}
+
+
+@contextmanager
+def capture_render_time():
+    timings = []
+    original = SimpleTemplateResponse.render
+
+    def render(response):
+        start = time.perf_counter()
+        try:
+            return original(response)
+        finally:
+            timings.append(time.perf_counter() - start)
+
+    with mock.patch.object(SimpleTemplateResponse, "render", render):
+        yield timings
+
+
+def measure(client, url):
+    with capture_render_time() as renders, CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        response = client.get(url, HTTP_ACCEPT_ENCODING="gzip")
+        total = time.perf_counter() - start
+    sent = b"" if response.streaming else response.content
+    body = gzip.decompress(sent) if response.get("Content-Encoding") == "gzip" else sent
+    return {
+        "status": response.status_code,
+        "queries": len(queries.captured_queries),
+        "sql_time": sum(float(query["time"]) for query in queries.captured_queries),
+        "render_time": sum(renders),
+        "total_time": total,
+        "bytes": len(body),
+        "sent_bytes": len(sent),
+    }
+
+
+def measure_routes(client, fixtures, budgets):
+    results = {}
+    for name, params in iter_routes():
+        if name not in budgets:
+            continue
+        url = reverse(name, kwargs={param: fixtures[param] for param in params})
+        if budgets[name].get("params"):
+            url += "?" + urlencode(budgets[name]["params"])
+        # 1 回目はキャッシュのウォームアップとして捨てる
+        client.get(url)
+        results[name] = measure(client, url)
+    return results
@@ -0,0 +1,124 @@
+import hashlib
+import ipaddress
+import math
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.utils.deprecation import MiddlewareMixin
+
+PERIODS = {"s": 1, "m": 60, "h": 60 * 60, "d": 60 * 60 * 24}
+
+
+@lru_cache
+def _networks(proxies):
+    return [ipaddress.ip_network(proxy, strict=False) for proxy in proxies]
+
+
+def _is_trusted(address, networks):
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in networks)
+
+
+def client_ip(request):
+    # 信頼するプロキシ経由のときだけ X-Forwarded-For を見る。クライアントは先頭に好きな値を書けるので、
+    # 右（自分に近い側）から辿って、信頼するプロキシでない最初のアドレスをクライアントとみなす
+    remote_addr = request.META.get("REMOTE_ADDR", "")
+    networks = _networks(tuple(settings.RATELIMIT_TRUSTED_PROXIES))
+    if not networks or not _is_trusted(remote_addr, networks):
+        return remote_addr
+    forwarded = [address.strip() for address in request.META.get("HTTP_X_FORWARDED_FOR", "").split(",")]
+    for address in reversed(list(filter(None, forwarded))):
+        if not _is_trusted(address, networks):
+            return address
+    return remote_addr
+
+
+class RateLimit:
+    # key: "ip" / "user"（未ログインなら IP）/ "post:<フィールド名>" / request を受け取る関数
+    # rate: "5/m" や "100/10m" のように「回数/期間」で書く
+    def __init__(self, key, rate, methods=("POST",)):
+        self.key = key
+        count, period = rate.split("/")
+        self.limit = int(count)
+        unit = period.lstrip("0123456789")
+        self.window = int(period[: -len(unit)] or 1) * PERIODS[unit]
+        self.methods = methods
+
+    def identify(self, request):
+        if callable(self.key):
+            return self.key(request)
+        if self.key == "user" and request.user.is_authenticated:
+            return f"user:{request.user.pk}"
+        if self.key.startswith("post:"):
+            return request.POST.get(self.key[5:]) or None
+        return client_ip(request)
+
+    def check(self, request, route, now=None):
+        # スライディングウィンドウ・カウンタ。固定窓の件数を 2 つだけ持ち、
+        # 直前の窓の件数を経過時間で按分して足すことで、窓の境目でまとめて通してしまうのを防ぐ。
+        # 制限を超えていれば再試行までの秒数、超えていなければ None を返す
+        ident = self.identify(request)
+        if ident is None:
+            return None
+        now = time.time() if now is None else now
+        index, elapsed = divmod(now, self.window)
+        # 関数の repr はプロセスごとに変わるので、名前でキーを作る
+        name = f"{self.key.__module__}.{self.key.__qualname__}" if callable(self.key) else self.key
+        digest = hashlib.md5(f"{route}:{name}:{ident}".encode()).hexdigest()
+        key = f"ratelimit:{digest}:{self.window}:{int(index)}"
+        cache = caches[settings.RATELIMIT_CACHE]
+        try:
+            current = cache.incr(key)
+        except ValueError:
+            if cache.add(key, 1, self.window * 2):
+                current = 1
+            else:
+                current = cache.incr(key)
+        previous = cache.get(f"ratelimit:{digest}:{self.window}:{int(index) - 1}", 0)
+        weight = 1 - elapsed / self.window
+        if previous * weight + current <= self.limit:
+            return None
+        if current > self.limit:
+            # 今の窓だけで超えているので、次の窓で按分された件数が limit を下回るまで待つ
+            wait = self.window - elapsed + self.window * (1 - self.limit / current)
+        else:
+            wait = self.window * (1 - (self.limit - current) / previous) - elapsed
+        return max(1, math.ceil(wait))
+
+
+def ratelimit(key, rate, methods=("POST",)):
+    # ビューの関数・クラスに付けると RateLimitMiddleware が制限する。重ねて付ければすべて適用される
+    def decorator(view):
+        view.ratelimits = [*getattr(view, "ratelimits", []), RateLimit(key, rate, methods)]
+        return view
+
+    return decorator
+
+
+class RateLimitMiddleware(MiddlewareMixin):
+    def __init__(self, get_response):
+        if not settings.RATELIMIT_ENABLE:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        limits = getattr(getattr(view_func, "view_class", view_func), "ratelimits", None)
+        if not limits:
+            return None
+        route = request.resolver_match.view_name
+        for limit in limits:
+            if request.method not in limit.methods:
+                continue
+            retry_after = limit.check(request, route)
+            if retry_after is not None:
+                response = HttpResponse("リクエストが多すぎます。しばらくしてから再度お試しください。", status=429)
+                response["Retry-After"] = str(retry_after)
+                return response
+        return None
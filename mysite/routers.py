@@ -0,0 +1,61 @@
+import contextvars
+
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+
+PIN_COOKIE = "pin_primary"
+
+# リクエストの外（タスクのワーカー、管理コマンド、ビューが起こしたスレッド）はプライマリから読む。
+# 書き込んだ直後の行をレプリカの遅れで読み落とさないよう、レプリカを使うのは ReplicaPinningMiddleware が許可した読み込みだけ
+_pinned = contextvars.ContextVar("pinned_to_primary", default=True)
+
+
+def pin_to_primary():
+    _pinned.set(True)
+
+
+def read_from_replica():
+    _pinned.set(False)
+
+
+def is_pinned_to_primary():
+    return _pinned.get()
+
+
+class ReplicaRouter:
+    # 読み込みのリクエストではレプリカへ。書き込みがあったリクエストではその後の読み込みもプライマリに固定する
+    def db_for_read(self, model, **hints):
+        if not settings.DATABASE_REPLICA or _pinned.get():
+            return None
+        if model._meta.app_label in settings.REPLICA_APP_LABELS:
+            return settings.DATABASE_REPLICA
+        return None
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db == settings.DATABASE_REPLICA:
+            return False
+        return None
+
+
+class ReplicaPinningMiddleware(MiddlewareMixin):
+    # 書き込んだユーザーは REPLICA_STICKY_SECONDS の間、次のリクエストもプライマリから読む（read-your-writes）
+    def process_request(self, request):
+        if not self.is_write(request) and PIN_COOKIE not in request.COOKIES:
+            read_from_replica()
+
+    def process_response(self, request, response):
+        if self.is_write(request):
+            response.set_cookie(PIN_COOKIE, "1", max_age=settings.REPLICA_STICKY_SECONDS, httponly=True)
+        pin_to_primary()
+        return response
+
+    @staticmethod
+    def is_write(request):
+        return request.method not in ("GET", "HEAD", "OPTIONS")
@@ -0,0 +1,16 @@
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+# DJANGO_ENV=dev (デフォルト) / test / prod で読み込む設定を切り替える。
+# manage.py test のときは test になる。DJANGO_SETTINGS_MODULE=mysite.settings.prod のように直接指定してもよい
+DJANGO_ENV = os.environ.get("DJANGO_ENV", "dev")
+
+if DJANGO_ENV == "dev":
+    from .dev import *  # noqa: F401, F403
+elif DJANGO_ENV == "test":
+    from .test import *  # noqa: F401, F403
+elif DJANGO_ENV == "prod":
+    from .prod import *  # noqa: F401, F403
+else:
+    raise ImproperlyConfigured(f"DJANGO_ENV は dev / test / prod のいずれかを指定してください: {DJANGO_ENV}")
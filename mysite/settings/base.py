@@ -0,0 +1,334 @@
+"""
+Django settings for mysite project.
+
+Generated by 'django-admin startproject' using Django 4.0.3.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/4.0/topics/settings/
+
+For the full list of settings and their values, see
+https://docs.djangoproject.com/en/4.0/ref/settings/
+"""
+
+import os
+from pathlib import Path
+
+from mysite.caches import build_caches
+from mysite.db import build_databases, build_sqlite_pragmas
+
+# Build paths inside the project like this: BASE_DIR / 'subdir'.
+BASE_DIR = Path(__file__).resolve().parent.parent.parent
+AUTH_USER_MODEL = "accounts.User"
+
+# Quick-start development settings - unsuitable for production
+# See https://docs.djangoproject.com/en/4.0/howto/deployment/checklist/
+
+# SECURITY WARNING: keep the secret key used in production secret!
+SECRET_KEY = "django-insecure-x+hlabr82)0gfep+bo%6nsehz_n%5_w4*9u*pd9tllw10dj1s1"
+
+# SECURITY WARNING: don't run with debug turned on in production!
+# 開発用の mysite/settings/dev.py で有効にする
+DEBUG = False
+
+ALLOWED_HOSTS = []
+
+INTERNAL_IPS = ["127.0.0.1"]
+
+# Application definition
+
+INSTALLED_APPS = [
+    "django.contrib.admin",
+    "django.contrib.auth",
+    "django.contrib.contenttypes",
+    "django.contrib.sessions",
+    "django.contrib.messages",
+    "django.contrib.staticfiles",
+    "accounts.apps.AccountsConfig",
+    "tweets.apps.TweetsConfig",
+    "welcome.apps.WelcomeConfig",
+    "tasks.apps.TasksConfig",
+    "mysite.apps.MysiteConfig",
+]
+
+MIDDLEWARE = [
+    "mysite.instrumentation.PerformanceMiddleware",
+    "django.middleware.security.SecurityMiddleware",
+    "mysite.staticfiles.StaticFilesMiddleware",
+    "mysite.compression.GZipMiddleware",
+    "mysite.routers.ReplicaPinningMiddleware",
+    "django.contrib.sessions.middleware.SessionMiddleware",
+    "django.middleware.common.CommonMiddleware",
+    "django.middleware.csrf.CsrfViewMiddleware",
+    "accounts.middleware.CachedAuthenticationMiddleware",
+    "mysite.ratelimit.RateLimitMiddleware",
+    "django.contrib.messages.middleware.MessageMiddleware",
+    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+]
+
+ROOT_URLCONF = "mysite.urls"
+
+TEMPLATES = [
+    {
+        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        "DIRS": [BASE_DIR / "templates"],
+        "APP_DIRS": True,
+        "OPTIONS": {
+            "context_processors": [
+                "django.template.context_processors.debug",
+                "django.template.context_processors.request",
+                "django.contrib.auth.context_processors.auth",
+                "django.contrib.messages.context_processors.messages",
+            ],
+        },
+    },
+]
+
+# True なら wsgi.py / asgi.py の読み込み時に全テンプレートをコンパイルしておく。構文エラーがあれば起動に失敗する
+TEMPLATES_PRECOMPILE = False
+
+WSGI_APPLICATION = "mysite.wsgi.application"
+
+
+# Database
+# https://docs.djangoproject.com/en/4.0/ref/settings/#databases
+
+# 環境変数 DB_ENGINE / DB_NAME / DB_CONN_MAX_AGE などで切り替える。詳しくは mysite/db.py を参照
+
+DATABASES = build_databases(BASE_DIR)
+
+# SQLite の接続ごとに WAL・synchronous=NORMAL・mmap_size を設定する。ロック待ちは DB_SQLITE_TIMEOUT 秒
+SQLITE_PRAGMAS = build_sqlite_pragmas()
+
+# DB_REPLICA_NAME / DB_REPLICA_HOST を設定すると tweets・accounts の読み込みを replica に振り分ける
+DATABASE_ROUTERS = ["mysite.routers.ReplicaRouter"]
+DATABASE_REPLICA = "replica" if "replica" in DATABASES else None
+REPLICA_APP_LABELS = ["tweets", "accounts"]
+REPLICA_STICKY_SECONDS = 5
+
+
+# Cache
+# 環境変数 CACHE_BACKEND (locmem / file / redis) などで切り替える。詳しくは mysite/caches.py を参照
+
+CACHES = build_caches(BASE_DIR)
+
+# Web サーバーのプロセス数（gunicorn はこの環境変数をワーカー数の既定値に使う）。
+# 2 以上のとき、プロセスをまたいで共有する必要があるキャッシュが locmem だと mysite.checks がエラーにする
+WEB_CONCURRENCY = int(os.environ.get("WEB_CONCURRENCY", 1))
+
+
+# Sessions
+# SESSION_BACKEND=cached_db (デフォルト) / signed_cookies / cache / db
+
+SESSION_ENGINE = "django.contrib.sessions.backends." + os.environ.get("SESSION_BACKEND", "cached_db")
+SESSION_CACHE_ALIAS = "sessions"
+
+# ログイン中ユーザーのキャッシュ。User の保存・削除時に破棄される
+AUTH_USER_CACHE = "default"
+AUTH_USER_CACHE_TIMEOUT = 60
+
+# プロフィールなどの URL のユーザー名 → id のキャッシュ。ユーザー名の変更・削除で破棄される。
+# 存在しないユーザー名は USERNAME_NEGATIVE_TIMEOUT 秒だけ覚えておく
+USERNAME_CACHE = "usernames"
+USERNAME_NEGATIVE_TIMEOUT = 60
+
+
+# Rate limiting
+# ビューに @ratelimit で宣言した制限を RateLimitMiddleware が適用する。カウンタは ratelimit キャッシュに置く
+
+RATELIMIT_ENABLE = os.environ.get("RATELIMIT_ENABLE", "true").lower() in ("1", "true", "yes", "on")
+RATELIMIT_CACHE = "ratelimit"
+# リバースプロキシの後ろに置くときは、そのアドレス（CIDR 可）をカンマ区切りで指定する。
+# ここに含まれる REMOTE_ADDR からのリクエストに限り、X-Forwarded-For からクライアントの IP を取る
+RATELIMIT_TRUSTED_PROXIES = [
+    proxy.strip() for proxy in os.environ.get("RATELIMIT_TRUSTED_PROXIES", "").split(",") if proxy.strip()
+]
+
+
+# Password hashing
+# PASSWORD_HASHER=argon2 (argon2-cffi が必要) / scrypt で優先するハッシュを切り替える。
+# 他の方式のハッシュも検証でき、ログインに成功した時点で優先する方式・パラメータで作り直される
+
+PASSWORD_HASHER_CLASSES = {
+    "pbkdf2": "accounts.hashers.PBKDF2PasswordHasher",
+    "argon2": "accounts.hashers.Argon2PasswordHasher",
+    "scrypt": "accounts.hashers.ScryptPasswordHasher",
+}
+PASSWORD_HASHER = os.environ.get("PASSWORD_HASHER", "pbkdf2")
+PASSWORD_HASHERS = [PASSWORD_HASHER_CLASSES[PASSWORD_HASHER]] + [
+    path for name, path in PASSWORD_HASHER_CLASSES.items() if name != PASSWORD_HASHER
+]
+# 例: PASSWORD_HASHER_OPTIONS=time_cost=3,memory_cost=65536
+PASSWORD_HASHER_OPTIONS = {}
+for option in filter(None, os.environ.get("PASSWORD_HASHER_OPTIONS", "").split(",")):
+    name, value = option.split("=")
+    PASSWORD_HASHER_OPTIONS[name.strip()] = int(value)
+
+
+# Password validation
+# https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
+
+AUTH_PASSWORD_VALIDATORS = [
+    {
+        "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.MinimumLengthValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.CommonPasswordValidator",
+    },
+    {
+        "NAME": "django.contrib.auth.password_validation.NumericPasswordValidator",
+    },
+]
+
+
+# Internationalization
+# https://docs.djangoproject.com/en/4.0/topics/i18n/
+
+LANGUAGE_CODE = "ja"
+
+TIME_ZONE = "Asia/Tokyo"
+
+USE_I18N = True
+
+USE_TZ = True
+
+
+# Static files (CSS, JavaScript, Images)
+# https://docs.djangoproject.com/en/4.0/howto/static-files/
+
+STATIC_URL = "static/"
+STATIC_ROOT = BASE_DIR / "staticfiles"
+
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    # collectstatic でファイル名に内容のハッシュを付け、.gz / .br も書き出す（brotli が無い環境では .gz のみ）
+    "staticfiles": {"BACKEND": "mysite.staticfiles.CompressedManifestStaticFilesStorage"},
+}
+STATIC_COMPRESS_EXTENSIONS = [".css", ".js", ".mjs", ".map", ".svg", ".html", ".txt", ".json", ".xml", ".ttf", ".otf"]
+STATIC_COMPRESS_MIN_SIZE = 256
+
+# STATIC_SERVE=true で StaticFilesMiddleware が STATIC_ROOT のファイルを返す。
+# ハッシュ付きのファイルは STATIC_IMMUTABLE_MAX_AGE 秒、それ以外は STATIC_MAX_AGE 秒キャッシュさせる
+STATIC_SERVE = os.environ.get("STATIC_SERVE", "").lower() in ("1", "true", "yes", "on")
+STATIC_IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+STATIC_MAX_AGE = 60
+
+
+# Response compression
+# Accept-Encoding に gzip があれば、この長さ以上の HTML・JSON とストリーミングを圧縮する。
+# 1 パケットに収まる程度のレスポンスは、圧縮しても届くまでの時間が変わらない
+
+GZIP_MIN_LENGTH = 1024
+
+# Default primary key field type
+# https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
+
+DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+
+LOGIN_URL = "accounts:login"
+LOGIN_REDIRECT_URL = "tweets:home"
+LOGOUT_URL = "accounts:logout"
+LOGOUT_REDIRECT_URL = "accounts:login"
+
+
+# Timeline
+# フォロワー数がこの値以上のユーザーのツイートは fan-out せず、読み込み時に取得する
+
+TIMELINE_FANOUT_THRESHOLD = 10000
+TIMELINE_FANOUT_BATCH_SIZE = 1000
+TIMELINE_BACKFILL_SIZE = 100
+TIMELINE_PAGE_SIZE = 20
+TIMELINE_CACHE = "timeline"
+# 新着確認（tweets:home_updates）。ロングポーリングは TIMELINE_POLL_INTERVAL 秒ごとに確認し、最大 TIMELINE_POLL_TIMEOUT 秒待つ。
+# Server-Sent Events は TIMELINE_STREAM_TIMEOUT 秒で切り、クライアントに再接続させる
+TIMELINE_POLL_INTERVAL = 2
+TIMELINE_POLL_TIMEOUT = 25
+TIMELINE_POLL_MAX = 100
+TIMELINE_STREAM_TIMEOUT = 5 * 60
+
+
+# Follow graph
+# ユーザーごとのフォロー中・フォロワーの id 配列をキャッシュする。フォロー・解除で破棄される
+
+FOLLOW_GRAPH_CACHE = "graph"
+
+
+# HTTP caching
+# ログイン後のページは ETag の版をここに置き、ツイート・いいね・フォローで更新する。
+# セッションを持たない訪問者には描画済みのページを ANONYMOUS_PAGE_TIMEOUT 秒キャッシュして返す
+
+VERSION_CACHE = "default"
+ANONYMOUS_PAGE_CACHE = "pages"
+ANONYMOUS_PAGE_TIMEOUT = 60 * 5
+
+
+# Counters
+# いいね数・フォロワー数などはメモリ上にためて、件数か経過秒数のどちらかを超えたらまとめて書き込む
+
+COUNTER_FLUSH_SIZE = 500
+COUNTER_FLUSH_INTERVAL = 5
+# プロセスの終了時にも書き込む
+COUNTER_FLUSH_AT_EXIT = True
+
+
+# Tweet fragment cache
+
+TWEET_FRAGMENT_CACHE = "fragments"
+TWEET_FRAGMENT_TIMEOUT = 60 * 60
+
+
+# Background tasks
+# fan-out や検索インデックスの更新は DB の tasks_task テーブルに積み、manage.py run_tasks で実行する。
+# TASKS_EAGER=true なら積まずにその場で実行する（テストはこちら）
+
+TASKS_EAGER = os.environ.get("TASKS_EAGER", "").lower() in ("1", "true", "yes", "on")
+TASKS_MAX_ATTEMPTS = 5
+# 再実行までの秒数。失敗するたびに倍になる
+TASKS_RETRY_DELAY = 5
+TASKS_RETRY_MAX_DELAY = 60 * 60
+# running のままこの秒数を過ぎたタスクは、ワーカーが落ちたとみなして pending に戻す
+TASKS_LOCK_TIMEOUT = 5 * 60
+# 完了したタスクを残しておく秒数
+TASKS_RETENTION = 60 * 60 * 24
+
+
+# Deletion
+# ツイートの削除と退会はフラグを立てて隠すだけにし、関連する行は tweets.purge_* タスクが後から消す。
+# 1 回のタスクで PURGE_BATCH_SIZE 行ずつ消し、PURGE_TIME_LIMIT 秒を過ぎたら続きを次のタスクに回す
+
+PURGE_BATCH_SIZE = 1000
+PURGE_TIME_LIMIT = 1
+
+
+# Tweet archive
+# manage.py archive_tweets で、TWEET_ARCHIVE_AFTER_DAYS 日より前の月のツイートを月ごとの圧縮ファイルに移して DB から消す。
+# 移したツイートの個別ページはファイルの索引から読む。
+# TWEET_ARCHIVE_CODEC=gzip / zstd (zstandard が必要)
+
+TWEET_ARCHIVE_DIR = Path(os.environ.get("TWEET_ARCHIVE_DIR", BASE_DIR / "archive"))
+TWEET_ARCHIVE_AFTER_DAYS = 365
+TWEET_ARCHIVE_CODEC = os.environ.get("TWEET_ARCHIVE_CODEC", "gzip")
+# 1 ブロックにまとめて圧縮する件数。大きいほど縮むが、1 件読むたびに展開する量が増える
+TWEET_ARCHIVE_BLOCK_SIZE = 64
+
+
+# Performance instrumentation
+# PERF_INSTRUMENTATION=true で Server-Timing ヘッダー・計測ログ・/metrics/ を有効にする
+
+PERF_INSTRUMENTATION = os.environ.get("PERF_INSTRUMENTATION", "").lower() in ("1", "true", "yes", "on")
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "mysite.performance": {"handlers": ["console"], "level": "INFO", "propagate": False},
+        "tasks": {"handlers": ["console"], "level": "INFO", "propagate": False},
+        "mysite.counters": {"handlers": ["console"], "level": "INFO", "propagate": False},
+    },
+}
@@ -0,0 +1,51 @@
+import os
+
+from django.core.exceptions import ImproperlyConfigured
+
+from .base import *  # noqa: F401, F403
+from .base import TEMPLATES
+
+DEBUG = False
+
+SECRET_KEY = os.environ.get("DJANGO_SECRET_KEY")
+if not SECRET_KEY:
+    raise ImproperlyConfigured("本番環境では DJANGO_SECRET_KEY を設定してください。")
+
+# 例: DJANGO_ALLOWED_HOSTS=example.com,www.example.com
+ALLOWED_HOSTS = [host.strip() for host in os.environ.get("DJANGO_ALLOWED_HOSTS", "").split(",") if host.strip()]
+
+
+# Templates
+# 一度コンパイルしたテンプレートをプロセス内に持ち続け、ファイルの更新は確認しない。
+# 起動時にすべてコンパイルしておくので、最初のリクエストで読み込み・コンパイルの時間がかからない
+
+TEMPLATES = [
+    {
+        **TEMPLATES[0],
+        "APP_DIRS": False,
+        "OPTIONS": {
+            **TEMPLATES[0]["OPTIONS"],
+            "context_processors": [
+                processor
+                for processor in TEMPLATES[0]["OPTIONS"]["context_processors"]
+                if processor != "django.template.context_processors.debug"
+            ],
+            "loaders": [
+                (
+                    "django.template.loaders.cached.Loader",
+                    [
+                        "django.template.loaders.filesystem.Loader",
+                        "django.template.loaders.app_directories.Loader",
+                    ],
+                ),
+            ],
+        },
+    },
+]
+TEMPLATES_PRECOMPILE = True
+
+
+# Static files
+# collectstatic で STATIC_ROOT に書き出したファイルを StaticFilesMiddleware から返す
+
+STATIC_SERVE = True
@@ -0,0 +1,29 @@
+import os
+import tempfile
+
+from .base import *  # noqa: F401, F403
+
+# テストでは安全性より速さを優先する。manage.py test のときに自動で使われる
+PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
+
+# タスクは積まずにその場で実行する
+TASKS_EAGER = True
+
+# 複数スレッドのワーカーを動かすテストのため、SQLite のテスト DB もファイルに置く。
+# メモリ上の共有 DB ではテーブルのロックを待たずに失敗する
+if DATABASES["default"]["ENGINE"] == "mysite.sqlite3":  # noqa: F405
+    DATABASES["default"]["TEST"] = {  # noqa: F405
+        "NAME": os.path.join(tempfile.gettempdir(), f"mysite-test-{os.getpid()}.sqlite3")
+    }
+
+# テスト DB を消した後に、元の DB へカウンタを書き込まないようにする
+COUNTER_FLUSH_AT_EXIT = False
+
+# 同じ IP から何度も送るテストが制限に掛からないようにする。制限のテストでは override_settings で有効にする
+RATELIMIT_ENABLE = False
+
+# collectstatic していなくても {% static %} を使えるようにする
+STORAGES = {
+    **STORAGES,  # noqa: F405
+    "staticfiles": {"BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage"},
+}
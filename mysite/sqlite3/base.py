@@ -0,0 +1,28 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.sqlite3 import base
+
+TRANSACTION_MODES = ("DEFERRED", "IMMEDIATE", "EXCLUSIVE")
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    # Django 5.1 の OPTIONS["transaction_mode"] と同じ。既定の BEGIN（DEFERRED）では、読んでから書くトランザクションが
+    # 重なると書き込みに移る時点で busy timeout を待たずに "database is locked" で失敗するので、
+    # IMMEDIATE なら BEGIN の時点で書き込みロックを取り、取れるまで timeout 秒待つ
+    def __init__(self, settings_dict, *args, **kwargs):
+        super().__init__(settings_dict, *args, **kwargs)
+        self.transaction_mode = settings_dict["OPTIONS"].get("transaction_mode")
+        if self.transaction_mode is not None and self.transaction_mode.upper() not in TRANSACTION_MODES:
+            raise ImproperlyConfigured(
+                f"transaction_mode は {' / '.join(TRANSACTION_MODES)} のいずれかを指定してください: {self.transaction_mode}"
+            )
+
+    def get_connection_params(self):
+        params = super().get_connection_params()
+        params.pop("transaction_mode", None)
+        return params
+
+    def _start_transaction_under_autocommit(self):
+        if self.transaction_mode is None:
+            super()._start_transaction_under_autocommit()
+        else:
+            self.cursor().execute(f"BEGIN {self.transaction_mode.upper()}")
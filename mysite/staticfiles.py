@@ -0,0 +1,107 @@
+import mimetypes
+import re
+from pathlib import Path
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import FileResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.http import http_date
+
+from .compression import compress
+
+# 事前圧縮したファイルの拡張子。Accept-Encoding に含まれていれば、この順で優先する
+ENCODINGS = {"br": ".br", "gzip": ".gz"}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    # collectstatic でハッシュ付きのファイル名にしたあと、圧縮した .gz / .br を同じ場所に書き出す。
+    # 配信時は StaticFilesMiddleware が Accept-Encoding で選ぶだけで、リクエストごとには圧縮しない
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        for name in sorted({*paths, *self.hashed_files.values()}):
+            if Path(name).suffix in settings.STATIC_COMPRESS_EXTENSIONS:
+                self.compress_file(name)
+
+    def compress_file(self, name):
+        path = Path(self.path(name))
+        data = path.read_bytes()
+        if len(data) < settings.STATIC_COMPRESS_MIN_SIZE:
+            return
+        for encoding, compressed in compress(data).items():
+            # ほとんど縮まないなら、展開の手間がかかるだけなので置かない
+            if len(compressed) < len(data) * 0.95:
+                path.with_name(path.name + ENCODINGS[encoding]).write_bytes(compressed)
+
+
+class StaticFile:
+    def __init__(self, path, immutable):
+        self.path = path
+        self.content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        self.variants = [
+            (encoding, path.with_name(path.name + suffix))
+            for encoding, suffix in ENCODINGS.items()
+            if path.with_name(path.name + suffix).is_file()
+        ]
+        stat = path.stat()
+        self.last_modified = int(stat.st_mtime)
+        self.etag = f'"{self.last_modified:x}-{stat.st_size:x}"'
+        # ファイル名にハッシュが付いていれば中身は変わらないので、ブラウザに確認させずに使い続けさせる
+        if immutable:
+            self.cache_control = f"public, max-age={settings.STATIC_IMMUTABLE_MAX_AGE}, immutable"
+        else:
+            self.cache_control = f"public, max-age={settings.STATIC_MAX_AGE}"
+
+    def respond(self, request):
+        accept_encoding = request.headers.get("Accept-Encoding", "")
+        encoding, path = next(
+            ((encoding, path) for encoding, path in self.variants if re.search(rf"\b{encoding}\b", accept_encoding)),
+            (None, self.path),
+        )
+        etag = self.etag if encoding is None else f'{self.etag[:-1]}-{encoding}"'
+        response = get_conditional_response(request, etag=etag, last_modified=self.last_modified)
+        if response is None:
+            response = FileResponse(path.open("rb"), content_type=self.content_type, filename=self.path.name)
+            if encoding:
+                response["Content-Encoding"] = encoding
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(self.last_modified)
+        response["Cache-Control"] = self.cache_control
+        if self.variants:
+            patch_vary_headers(response, ["Accept-Encoding"])
+        return response
+
+
+def scan_static_root(root, hashed_names):
+    # URL のパス → StaticFile。.gz / .br は元のファイルの variants として扱う
+    files = {}
+    if not root.is_dir():
+        return files
+    for path in sorted(root.rglob("*")):
+        if path.is_file() and path.suffix not in ENCODINGS.values():
+            name = path.relative_to(root).as_posix()
+            files[name] = StaticFile(path, immutable=name in hashed_names)
+    return files
+
+
+class StaticFilesMiddleware(MiddlewareMixin):
+    # STATIC_SERVE=true のとき、collectstatic 済みの STATIC_ROOT のファイルをビューより手前で返す。
+    # ファイル一覧は起動時に読み込むので、リクエストごとにディスクを探さず、一覧にないパスには応えない
+    def __init__(self, get_response):
+        if not settings.STATIC_SERVE:
+            raise MiddlewareNotUsed
+        super().__init__(get_response)
+        self.prefix = "/" + urlsplit(settings.STATIC_URL).path.strip("/") + "/"
+        hashed_names = set(getattr(staticfiles_storage, "hashed_files", {}).values())
+        self.files = scan_static_root(Path(settings.STATIC_ROOT), hashed_names)
+
+    def process_request(self, request):
+        if request.method not in ("GET", "HEAD") or not request.path_info.startswith(self.prefix):
+            return None
+        static_file = self.files.get(request.path_info[len(self.prefix) :])
+        return static_file and static_file.respond(request)
@@ -0,0 +1,97 @@
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.template import Context, Engine, TemplateSyntaxError, engines
+from django.template.loader_tags import ExtendsNode
+from django.template.utils import get_app_template_dirs
+
+BASE_LOADERS = ["django.template.loaders.filesystem.Loader", "django.template.loaders.app_directories.Loader"]
+
+
+def iter_template_names(include_all=False):
+    # DIRS と各アプリの templates/ にあるファイルを get_template() に渡す名前で列挙する。
+    # include_all でなければ、admin など BASE_DIR の外にあるアプリのテンプレートは除く
+    engine = engines["django"].engine
+    app_dirs = get_app_template_dirs("templates")
+    if not include_all:
+        app_dirs = [directory for directory in app_dirs if directory.resolve().is_relative_to(settings.BASE_DIR)]
+    seen = set()
+    for directory in map(Path, [*engine.dirs, *app_dirs]):
+        for path in sorted(directory.rglob("*")):
+            name = path.relative_to(directory).as_posix()
+            if path.is_file() and not path.name.startswith(".") and name not in seen:
+                seen.add(name)
+                yield name
+
+
+def compile_templates(names=None):
+    # cached loader を使っていれば、コンパイル結果がそのままこのプロセスのキャッシュに載る
+    engine = engines["django"].engine
+    compiled, errors = 0, []
+    for name in iter_template_names() if names is None else names:
+        try:
+            engine.get_template(name)
+        except TemplateSyntaxError as e:
+            errors.append((name, e))
+        else:
+            compiled += 1
+    return compiled, errors
+
+
+def precompile_templates():
+    # wsgi.py / asgi.py から呼ぶ。構文エラーがあれば起動を止める
+    if not settings.TEMPLATES_PRECOMPILE:
+        return
+    compiled, errors = compile_templates()
+    if errors:
+        name, error = errors[0]
+        raise TemplateSyntaxError(f"{name}: {error}") from error
+
+
+def build_engine(cached):
+    # 設定中のエンジンと同じディレクトリ・ライブラリで、ローダーだけを変えたエンジンを作る
+    configured = engines["django"].engine
+    loaders = [("django.template.loaders.cached.Loader", BASE_LOADERS)] if cached else BASE_LOADERS
+    return Engine(
+        dirs=configured.dirs,
+        loaders=loaders,
+        libraries=configured.libraries,
+        string_if_invalid=configured.string_if_invalid,
+        file_charset=configured.file_charset,
+    )
+
+
+def extends_chain(engine, name):
+    # {% extends %} をたどり、継承元のテンプレート名を近い順に返す。継承元を変数で指定していればそこで止める
+    chain = []
+    template = engine.get_template(name)
+    while True:
+        nodes = template.nodelist.get_nodes_by_type(ExtendsNode)
+        if not nodes or not isinstance(nodes[0].parent_name.var, str):
+            return chain
+        chain.append(nodes[0].parent_name.var)
+        template = engine.get_template(chain[-1])
+
+
+def benchmark_render(names, iterations=100):
+    # 各テンプレートを cached loader なし・ありのエンジンで iterations 回ずつ描画し、1 回あたりの秒数を返す。
+    # 空のコンテキスト（csrf_token だけ入れる）で描画できないテンプレートは skipped に入れる
+    results, skipped = [], []
+    uncached, cached = build_engine(cached=False), build_engine(cached=True)
+    context = {"csrf_token": "benchmark"}
+    for name in names:
+        timings = []
+        for engine in (uncached, cached):
+            try:
+                engine.get_template(name).render(Context(context))
+            except Exception:
+                skipped.append(name)
+                break
+            start = time.perf_counter()
+            for _ in range(iterations):
+                engine.get_template(name).render(Context(context))
+            timings.append((time.perf_counter() - start) / iterations)
+        else:
+            results.append((name, *timings))
+    return results, skipped
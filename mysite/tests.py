@@ -0,0 +1,581 @@
+import contextvars
+import gzip
+import importlib
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from .caches import build_caches, get_or_set
+from .checks import check_shared_caches
+from .compression import GZipMiddleware, brotli, compress
+from .db import build_databases
+from .instrumentation import metrics
+from .perf import iter_routes, load_budgets, measure_routes, seed
+from .ratelimit import RateLimit, client_ip
+from .routers import PIN_COOKIE, ReplicaRouter, is_pinned_to_primary, pin_to_primary, read_from_replica
+from .template_cache import build_engine, extends_chain, iter_template_names
+
+
+class TestBuildCaches(SimpleTestCase):
+    def test_default_aliases(self):
+        config = build_caches(Path("/tmp"), env={})
+        self.assertEqual(
+            set(config),
+            {"default", "timeline", "fragments", "sessions", "ratelimit", "graph", "usernames", "pages"},
+        )
+        self.assertEqual(config["timeline"]["BACKEND"], "django.core.cache.backends.locmem.LocMemCache")
+
+    def test_environment_overrides(self):
+        env = {
+            "CACHE_BACKEND": "file",
+            "CACHE_MAX_ENTRIES": "100",
+            "CACHE_FRAGMENTS_MAX_ENTRIES": "5000",
+            "CACHE_SESSIONS_BACKEND": "redis",
+            "CACHE_SESSIONS_LOCATION": "redis://cache:6379/1",
+        }
+        config = build_caches(Path("/tmp"), env=env)
+        self.assertEqual(config["timeline"]["LOCATION"], "/tmp/.cache/timeline")
+        self.assertEqual(config["timeline"]["OPTIONS"]["MAX_ENTRIES"], 100)
+        self.assertEqual(config["fragments"]["OPTIONS"]["MAX_ENTRIES"], 5000)
+        self.assertEqual(config["sessions"]["LOCATION"], "redis://cache:6379/1")
+        self.assertNotIn("OPTIONS", config["sessions"])
+
+
+class TestSharedCaches(SimpleTestCase):
+    def test_locmem_with_multiple_processes(self):
+        self.assertEqual(check_shared_caches(None), [])
+        with override_settings(WEB_CONCURRENCY=2):
+            self.assertEqual([error.id for error in check_shared_caches(None)], ["mysite.E001", "mysite.E001"])
+
+
+class TestGetOrSet(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        caches_setting = build_caches(Path(directory.name), env={"CACHE_BACKEND": "file"})
+        override = override_settings(CACHES=caches_setting)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.calls = 0
+
+    def compute(self):
+        self.calls += 1
+        return self.calls
+
+    def test_value_is_computed_once(self):
+        self.assertEqual(get_or_set("key", self.compute, timeout=60), 1)
+        self.assertEqual(get_or_set("key", self.compute, timeout=60), 1)
+        self.assertEqual(self.calls, 1)
+        self.assertIsNotNone(caches["default"].get("key"))
+
+    def test_early_recompute(self):
+        get_or_set("key", self.compute, timeout=60)
+        # beta を極端に大きくすると期限前でも必ず再計算される
+        self.assertEqual(get_or_set("key", self.compute, timeout=60, beta=1e12), 2)
+
+
+class TestBuildDatabases(SimpleTestCase):
+    def test_sqlite_default(self):
+        config = build_databases(Path("/tmp"), env={})["default"]
+        self.assertEqual(config["ENGINE"], "mysite.sqlite3")
+        self.assertEqual(config["NAME"], "/tmp/db.sqlite3")
+        self.assertEqual(config["OPTIONS"], {"timeout": 20, "transaction_mode": "IMMEDIATE"})
+        self.assertEqual(config["CONN_MAX_AGE"], 60)
+        self.assertTrue(config["CONN_HEALTH_CHECKS"])
+
+    def test_postgresql_with_pgbouncer(self):
+        env = {"DB_ENGINE": "postgresql", "DB_NAME": "twitter", "DB_HOST": "db", "DB_POOL": "pgbouncer"}
+        config = build_databases(Path("/tmp"), env=env)["default"]
+        self.assertEqual(config["ENGINE"], "django.db.backends.postgresql")
+        self.assertEqual(config["HOST"], "db")
+        self.assertTrue(config["DISABLE_SERVER_SIDE_CURSORS"])
+        self.assertEqual(config["CONN_MAX_AGE"], 0)
+
+
+class TestSqlitePragmas(TestCase):
+    def test_pragmas_are_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA synchronous")
+            self.assertEqual(cursor.fetchone()[0], 1)
+            # busy timeout は OPTIONS の timeout（秒）だけで決まる
+            cursor.execute("PRAGMA busy_timeout")
+            self.assertEqual(cursor.fetchone()[0], settings.DATABASES["default"]["OPTIONS"]["timeout"] * 1000)
+
+
+class TestSqliteTransactionMode(SimpleTestCase):
+    def create_database(self, transaction_mode, timeout=5):
+        # 一時ファイルに counter テーブルを作り、transaction_mode を指定した接続の alias とファイル名を返す
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        alias, name = f"concurrent-{transaction_mode.lower()}", f"{tmpdir.name}/db.sqlite3"
+        options = {"timeout": timeout, "transaction_mode": transaction_mode}
+        settings_dict = {**connection.settings_dict, "NAME": name, "OPTIONS": options}
+        patcher = mock.patch.dict(connections.settings, {alias: settings_dict})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # 接続はファイル名ごと alias に紐付いて残るので、テストごとに閉じて捨てる
+        self.addCleanup(connections.__delitem__, alias)
+        self.addCleanup(connections[alias].close)
+        with connections[alias].cursor() as cursor:
+            cursor.execute("CREATE TABLE counter (value INTEGER)")
+            cursor.execute("INSERT INTO counter VALUES (0)")
+        return alias, name
+
+    def increment_concurrently(self, transaction_mode, threads=8):
+        # 同じファイルに別々の接続から「読んでから書く」トランザクションを同時に流し、(最終値, エラー) を返す
+        alias, _ = self.create_database(transaction_mode)
+        errors = []
+
+        def increment():
+            try:
+                with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+                    cursor.execute("SELECT value FROM counter")
+                    value = cursor.fetchone()[0]
+                    time.sleep(0.02)
+                    cursor.execute("UPDATE counter SET value = %s", [value + 1])
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connections[alias].close()
+
+        workers = [threading.Thread(target=increment) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        with connections[alias].cursor() as cursor:
+            cursor.execute("SELECT value FROM counter")
+            value = cursor.fetchone()[0]
+        connections[alias].close()
+        return value, errors
+
+    def hold_write_lock(self, name):
+        # 別の接続で書き込みトランザクションを開いたままにする
+        holder = sqlite3.connect(name, isolation_level=None)
+        self.addCleanup(holder.close)
+        holder.execute("BEGIN IMMEDIATE")
+        return holder
+
+    def test_immediate_waits_for_lock(self):
+        self.assertEqual(self.increment_concurrently("IMMEDIATE"), (8, []))
+
+    def test_immediate_fails_before_reading(self):
+        alias, name = self.create_database("IMMEDIATE", timeout=0.05)
+        self.hold_write_lock(name)
+        with self.assertRaisesMessage(OperationalError, "database is locked"):
+            with transaction.atomic(using=alias):
+                self.fail("BEGIN IMMEDIATE でロックを待つはず")
+
+    def test_deferred_fails_with_locked(self):
+        alias, name = self.create_database("DEFERRED", timeout=0.05)
+        self.hold_write_lock(name)
+        values = []
+        # DEFERRED の BEGIN はロックを取らないので読めてしまい、書き込みに移るところで失敗する
+        with self.assertRaisesMessage(OperationalError, "database is locked"):
+            with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+                cursor.execute("SELECT value FROM counter")
+                values.append(cursor.fetchone()[0])
+                cursor.execute("UPDATE counter SET value = value + 1")
+        self.assertEqual(values, [0])
+
+
+class TestReplicaRouter(SimpleTestCase):
+    def setUp(self):
+        self.router = ReplicaRouter()
+
+    def test_build_databases_with_replica(self):
+        databases = build_databases(Path("/tmp"), env={"DB_REPLICA_NAME": "/tmp/replica.sqlite3"})
+        self.assertEqual(databases["replica"]["NAME"], "/tmp/replica.sqlite3")
+        self.assertEqual(databases["replica"]["TEST"], {"MIRROR": "default"})
+        self.assertEqual(databases["replica"]["OPTIONS"]["transaction_mode"], "DEFERRED")
+        self.assertEqual(databases["default"]["OPTIONS"]["transaction_mode"], "IMMEDIATE")
+
+    @override_settings(DATABASE_REPLICA="replica")
+    def test_reads_go_to_replica_until_write(self):
+        from tweets.models import Tweet
+
+        def run():
+            read_from_replica()
+            self.assertEqual(self.router.db_for_read(Tweet), "replica")
+            self.assertEqual(self.router.db_for_write(Tweet), "default")
+            self.assertTrue(is_pinned_to_primary())
+            self.assertIsNone(self.router.db_for_read(Tweet))
+
+        contextvars.copy_context().run(run)
+
+    @override_settings(DATABASE_REPLICA="replica")
+    def test_outside_requests_read_from_primary(self):
+        from tweets.models import Tweet
+
+        # タスクのワーカーや管理コマンドは ReplicaPinningMiddleware を通らない
+        self.assertIsNone(contextvars.Context().run(self.router.db_for_read, Tweet))
+
+    @override_settings(DATABASE_REPLICA="replica")
+    def test_other_apps_are_not_routed(self):
+        from django.contrib.sessions.models import Session
+
+        self.assertIsNone(self.router.db_for_read(Session))
+
+    @override_settings(DATABASE_REPLICA=None)
+    def test_no_replica_configured(self):
+        from tweets.models import Tweet
+
+        self.assertIsNone(self.router.db_for_read(Tweet))
+
+    def test_replica_is_not_migrated(self):
+        with self.settings(DATABASE_REPLICA="replica"):
+            self.assertFalse(self.router.allow_migrate("replica", "tweets"))
+            self.assertIsNone(self.router.allow_migrate("default", "tweets"))
+
+
+class TestReplicaPinningMiddleware(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="testuser", password="testpassword")
+
+    def test_pin_cookie_is_set_after_write(self):
+        response = self.client.post(reverse("accounts:login"), {"username": "testuser", "password": "testpassword"})
+        self.assertEqual(response.cookies[PIN_COOKIE]["max-age"], settings.REPLICA_STICKY_SECONDS)
+
+    def test_pin_cookie_is_not_set_on_read(self):
+        response = self.client.get(reverse("welcome:welcome"))
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+
+
+@unittest.skipUnless(settings.DATABASE_REPLICA, "DB_REPLICA_NAME が設定されていません。")
+class TestReplicaDatabase(TestCase):
+    databases = set(settings.DATABASES) & {"default", "replica"}
+
+    def test_reads_use_replica_connection(self):
+        from tweets.models import Tweet
+
+        def run():
+            read_from_replica()
+            self.assertEqual(Tweet.objects.all().db, "replica")
+            pin_to_primary()
+            self.assertEqual(Tweet.objects.all().db, "default")
+
+        contextvars.copy_context().run(run)
+
+
+class TestQueryBudgets(TestCase):
+    # PERF_SIZES=10,1000,100000 python manage.py test mysite.tests.TestQueryBudgets のように件数を変えられる
+    # PERF_REPORT=1 でルートごとのクエリ数・SQL 時間・描画時間を表示する
+    def setUp(self):
+        self.budgets = load_budgets()
+        self.sizes = [int(size) for size in os.environ.get("PERF_SIZES", "10,100").split(",")]
+
+    def test_every_route_has_budget(self):
+        for name, params in iter_routes():
+            with self.subTest(route=name):
+                self.assertTrue(name in self.budgets["budgets"] or name in self.budgets["skip"])
+
+    def test_query_count_within_budget(self):
+        results = {}
+        for size in self.sizes:
+            with transaction.atomic():
+                for alias in settings.CACHES:
+                    caches[alias].clear()
+                fixtures = seed(size)
+                self.client.force_login(fixtures["viewer"])
+                results[size] = measure_routes(self.client, fixtures, self.budgets["budgets"])
+                transaction.set_rollback(True)
+
+        if os.environ.get("PERF_REPORT"):
+            self.report(results)
+        for name, budget in self.budgets["budgets"].items():
+            counts = [results[size][name]["queries"] for size in self.sizes]
+            with self.subTest(route=name):
+                self.assertEqual(results[self.sizes[-1]][name]["status"], 200)
+                self.assertEqual(min(counts), max(counts), f"データ量に応じてクエリ数が増えています: {counts}")
+                self.assertLessEqual(max(counts), budget["queries"])
+
+    def report(self, results):
+        for size, routes in results.items():
+            for name, result in routes.items():
+                sys.stderr.write(
+                    f"{size:>7} {name:<24} queries={result['queries']:<3} sql={result['sql_time'] * 1000:.1f}ms "
+                    f"render={result['render_time'] * 1000:.1f}ms total={result['total_time'] * 1000:.1f}ms "
+                    f"bytes={result['bytes']} sent={result['sent_bytes']} ({self.saving(result):.0%} saved)\n"
+                )
+
+    @staticmethod
+    def saving(result):
+        return 1 - result["sent_bytes"] / result["bytes"] if result["bytes"] else 0
+
+
+@override_settings(PERF_INSTRUMENTATION=True)
+class TestPerformanceMiddleware(TestCase):
+    def setUp(self):
+        metrics.reset()
+        self.user = get_user_model().objects.create_user(username="testuser", password="testpassword")
+        self.client.force_login(self.user)
+
+    def test_server_timing_header(self):
+        with self.assertLogs("mysite.performance", level="INFO") as logs:
+            response = self.client.get(reverse("tweets:home"))
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response["Server-Timing"], r'db;dur=[\d.]+;desc="\d+ queries", render;dur=[\d.]+')
+        self.assertIn('"view": "tweets:home"', logs.output[0])
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse("tweets:home"))
+        self.client.get(reverse("tweets:home"))
+        response = self.client.get(reverse("metrics"))
+        content = response.content.decode()
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('http_request_duration_seconds_count{view="tweets:home"} 2', content)
+        self.assertIn('http_request_duration_seconds_recent{view="tweets:home",quantile="0.99"}', content)
+
+    @override_settings(PERF_INSTRUMENTATION=False)
+    def test_disabled_by_default(self):
+        response = self.client.get(reverse("tweets:home"))
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 404)
+
+
+@override_settings(RATELIMIT_ENABLE=True)
+class TestRateLimit(TestCase):
+    def setUp(self):
+        caches[settings.RATELIMIT_CACHE].clear()
+        self.request = RequestFactory().post("/", {"username": "testuser"})
+
+    def test_parse_rate(self):
+        limit = RateLimit("ip", "100/10m")
+        self.assertEqual((limit.limit, limit.window), (100, 600))
+
+    def test_sliding_window(self):
+        limit = RateLimit("ip", "2/m")
+        self.assertIsNone(limit.check(self.request, "route", now=6000))
+        self.assertIsNone(limit.check(self.request, "route", now=6001))
+        # 次の窓で 3 件 * (1 - 20 / 60) = 2 件まで減るのを待つ
+        self.assertEqual(limit.check(self.request, "route", now=6002), 78)
+        # 次の窓に入っても、直前の窓の 3 件が経過時間に応じて残っている
+        self.assertIsNotNone(limit.check(self.request, "route", now=6060 + 15))
+        self.assertIsNone(limit.check(self.request, "route", now=6120 + 1))
+
+    def test_keys_are_separated(self):
+        limit = RateLimit("post:username", "1/m")
+        self.assertIsNone(limit.check(self.request, "route", now=6000))
+        self.assertIsNone(limit.check(self.request, "other-route", now=6000))
+        self.assertIsNone(limit.check(RequestFactory().post("/", {"username": "other"}), "route", now=6000))
+        self.assertIsNotNone(limit.check(self.request, "route", now=6000))
+
+    def test_login_returns_429(self):
+        url = reverse("accounts:login")
+        for _ in range(5):
+            self.assertEqual(self.client.post(url, {"username": "testuser", "password": "wrong"}).status_code, 200)
+        response = self.client.post(url, {"username": "testuser", "password": "wrong"})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response["Retry-After"]), 1)
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_login_limit_ignores_case(self):
+        url = reverse("accounts:login")
+        for username in ["testuser", "TestUser", "TESTUSER", "testUser", "Testuser"]:
+            self.client.post(url, {"username": username, "password": "wrong"})
+        response = self.client.post(url, {"username": "TESTuser", "password": "wrong"})
+        self.assertEqual(response.status_code, 429)
+
+    def test_forwarded_for_is_ignored_without_trusted_proxies(self):
+        request = RequestFactory().post("/", REMOTE_ADDR="10.0.0.1", HTTP_X_FORWARDED_FOR="203.0.113.5")
+        self.assertEqual(client_ip(request), "10.0.0.1")
+
+    @override_settings(RATELIMIT_TRUSTED_PROXIES=["10.0.0.0/8"])
+    def test_client_ip_behind_trusted_proxies(self):
+        factory = RequestFactory()
+        # 先頭のアドレスはクライアントが偽装できるので、右から辿って信頼しない最初のアドレスを使う
+        request = factory.post("/", REMOTE_ADDR="10.0.0.1", HTTP_X_FORWARDED_FOR="198.51.100.7, 203.0.113.5, 10.0.0.2")
+        self.assertEqual(client_ip(request), "203.0.113.5")
+        # 信頼しないアドレスから直接来たリクエストのヘッダーは使わない
+        request = factory.post("/", REMOTE_ADDR="192.0.2.1", HTTP_X_FORWARDED_FOR="203.0.113.5")
+        self.assertEqual(client_ip(request), "192.0.2.1")
+        request = factory.post("/", REMOTE_ADDR="10.0.0.1", HTTP_X_FORWARDED_FOR="10.0.0.2")
+        self.assertEqual(client_ip(request), "10.0.0.1")
+
+    @override_settings(RATELIMIT_TRUSTED_PROXIES=["10.0.0.0/8"])
+    def test_clients_behind_proxy_are_limited_separately(self):
+        limit = RateLimit("ip", "1/m")
+        factory = RequestFactory()
+        first = factory.post("/", REMOTE_ADDR="10.0.0.1", HTTP_X_FORWARDED_FOR="203.0.113.5")
+        second = factory.post("/", REMOTE_ADDR="10.0.0.1", HTTP_X_FORWARDED_FOR="203.0.113.6")
+        self.assertIsNone(limit.check(first, "route", now=6000))
+        self.assertIsNone(limit.check(second, "route", now=6000))
+        self.assertIsNotNone(limit.check(first, "route", now=6000))
+
+
+class TestCompileTemplates(SimpleTestCase):
+    def test_compile_project_templates(self):
+        names = list(iter_template_names())
+        self.assertIn("base.html", names)
+        self.assertIn("tweets/home.html", names)
+        self.assertNotIn("admin/base.html", names)
+        out = StringIO()
+        call_command("compile_templates", stdout=out)
+        self.assertIn(f"{len(names)} 件のテンプレートを", out.getvalue())
+
+    def test_syntax_error(self):
+        with tempfile.TemporaryDirectory() as directory:
+            Path(directory, "broken.html").write_text("{% if %}{% endif %}", encoding="utf-8")
+            templates = [{**settings.TEMPLATES[0], "DIRS": [directory]}]
+            with override_settings(TEMPLATES=templates), self.assertRaises(CommandError):
+                call_command("compile_templates", stdout=StringIO(), stderr=StringIO())
+
+    def test_benchmark(self):
+        out = StringIO()
+        call_command("compile_templates", benchmark=2, stdout=out)
+        self.assertRegex(out.getvalue(), r"tweets/home\.html +[\d.]+ms +[\d.]+ms")
+        self.assertEqual(extends_chain(build_engine(cached=True), "tweets/home.html"), ["base.html"])
+
+    def test_prod_settings_use_cached_loader(self):
+        settings_module = self.load_prod_settings(DJANGO_SECRET_KEY="secret", DJANGO_ALLOWED_HOSTS="example.com")
+        self.assertFalse(settings_module.DEBUG)
+        self.assertEqual(settings_module.ALLOWED_HOSTS, ["example.com"])
+        self.assertTrue(settings_module.TEMPLATES_PRECOMPILE)
+        loader, loaders = settings_module.TEMPLATES[0]["OPTIONS"]["loaders"][0]
+        self.assertEqual(loader, "django.template.loaders.cached.Loader")
+
+    def test_prod_settings_require_secret_key(self):
+        with self.assertRaises(ImproperlyConfigured):
+            self.load_prod_settings(DJANGO_SECRET_KEY="")
+
+    def load_prod_settings(self, **environ):
+        sys.modules.pop("mysite.settings.prod", None)
+        with mock.patch.dict(os.environ, environ):
+            return importlib.import_module("mysite.settings.prod")
+
+
+@override_settings(GZIP_MIN_LENGTH=100)
+class TestGZipMiddleware(SimpleTestCase):
+    def setUp(self):
+        self.request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING="gzip, deflate")
+
+    def process(self, response):
+        return GZipMiddleware(lambda request: response)(self.request)
+
+    def test_compress_above_threshold(self):
+        content = b"tweet " * 100
+        response = self.process(HttpResponse(content))
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.content), content)
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+    def test_skip_below_threshold(self):
+        response = self.process(HttpResponse(b"tweet" * 10))
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+    def test_skip_event_stream(self):
+        response = self.process(StreamingHttpResponse(iter([b"data: 1\n\n"]), content_type="text/event-stream"))
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(b"".join(response.streaming_content), b"data: 1\n\n")
+
+    def test_streaming_chunks_are_flushed(self):
+        chunks = [f"chunk {i}\n".encode() for i in range(3)]
+        response = self.process(StreamingHttpResponse(iter(chunks)))
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        received, snapshots = b"", []
+        for data in response.streaming_content:
+            received += decompressor.decompress(data)
+            snapshots.append(received)
+        # 各チャンクは次のチャンクを待たずに展開できる
+        for i in range(1, len(chunks) + 1):
+            self.assertIn(b"".join(chunks[:i]), snapshots)
+        self.assertEqual(received, b"".join(chunks))
+
+    async def test_async_streaming(self):
+        async def chunks():
+            yield b"first\n"
+            yield b"second\n"
+
+        response = self.process(StreamingHttpResponse(chunks()))
+        sent = [data async for data in response.streaming_content]
+        self.assertEqual(zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(b"".join(sent[:2])), b"first\n")
+        self.assertEqual(gzip.decompress(b"".join(sent)), b"first\nsecond\n")
+
+
+class TestStaticFiles(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        source, self.root = Path(directory.name, "static"), Path(directory.name, "root")
+        source.mkdir()
+        self.content = "body { color: black; }\n" * 100
+        (source / "app.css").write_text(self.content, encoding="utf-8")
+        (source / "tiny.js").write_text("1;", encoding="utf-8")
+        override = override_settings(
+            STATIC_ROOT=self.root,
+            STATICFILES_DIRS=[source],
+            STATICFILES_FINDERS=["django.contrib.staticfiles.finders.FileSystemFinder"],
+            STORAGES={
+                **settings.STORAGES,
+                "staticfiles": {"BACKEND": "mysite.staticfiles.CompressedManifestStaticFilesStorage"},
+            },
+            STATIC_SERVE=True,
+        )
+        override.enable()
+        self.addCleanup(override.disable)
+        call_command("collectstatic", interactive=False, verbosity=0)
+        self.url = staticfiles_storage.url("app.css")
+
+    def test_precompressed_at_collectstatic(self):
+        hashed = self.root / self.url.removeprefix(settings.STATIC_URL).lstrip("/")
+        self.assertRegex(hashed.name, r"^app\.[0-9a-f]{12}\.css$")
+        self.assertEqual(gzip.decompress(hashed.with_name(hashed.name + ".gz").read_bytes()).decode(), self.content)
+        self.assertFalse((self.root / "tiny.js.gz").exists())
+
+    @unittest.skipUnless(brotli, "brotli がインストールされていません")
+    def test_brotli_precompressed_at_collectstatic(self):
+        hashed = self.root / self.url.removeprefix(settings.STATIC_URL).lstrip("/")
+        self.assertEqual(brotli.decompress(hashed.with_name(hashed.name + ".br").read_bytes()).decode(), self.content)
+        self.assertFalse((self.root / "tiny.js.br").exists())
+
+    def test_gzip_only_without_brotli(self):
+        with mock.patch("mysite.compression.brotli", None):
+            self.assertEqual(list(compress(self.content.encode())), ["gzip"])
+
+    @unittest.skipUnless(brotli, "brotli がインストールされていません")
+    def test_brotli(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip, br")
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(b"".join(response.streaming_content)).decode(), self.content)
+
+    def test_serve_hashed_file(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/css")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertIn("Accept-Encoding", response["Vary"])
+        self.assertEqual(gzip.decompress(b"".join(response.streaming_content)).decode(), self.content)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"], HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response.status_code, 304)
+
+    def test_serve_without_encoding(self):
+        response = self.client.get("/static/app.css")
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response["Cache-Control"], f"public, max-age={settings.STATIC_MAX_AGE}")
+        self.assertEqual(b"".join(response.streaming_content).decode(), self.content)
+
+    def test_unknown_path(self):
+        self.assertEqual(self.client.get("/static/missing.css").status_code, 404)
+        self.assertEqual(self.client.get("/static/../manage.py").status_code, 404)
@@ -11,6 +11,11 @@ import os
 
 from django.core.wsgi import get_wsgi_application
 
+from mysite.template_cache import precompile_templates
+
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mysite.settings")
 
 application = get_wsgi_application()
+
+# TEMPLATES_PRECOMPILE=True（本番）なら、リクエストを受ける前にテンプレートをコンパイルしておく
+precompile_templates()
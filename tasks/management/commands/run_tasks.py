@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from tasks.queue import Worker, purge_finished
+
+
+class Command(BaseCommand):
+    help = "DB に積まれたバックグラウンドタスクを実行します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, help="タスクを実行するスレッド数（省略時は SQLite なら 1、それ以外は 4）"
+        )
+        parser.add_argument("--batch-size", type=int, default=100, help="1 回に取り出すタスク数")
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="タスクがないときに待つ秒数")
+        parser.add_argument("--once", action="store_true", help="実行できるタスクがなくなったら終了する")
+
+    def handle(self, *args, **options):
+        worker = Worker(workers=options["workers"], batch_size=options["batch_size"])
+        processed = 0
+        try:
+            while True:
+                count = worker.run_once()
+                processed += count
+                if count:
+                    continue
+                if options["once"]:
+                    break
+                purge_finished()
+                time.sleep(options["poll_interval"])
+        except KeyboardInterrupt:
+            pass
+        finally:
+            worker.shutdown()
+        self.stdout.write(f"{processed} 件のタスクを処理しました。")
@@ -0,0 +1,198 @@
+import logging
+import random
+import threading
+import traceback
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from mysite import counters
+
+from .models import Task
+
+logger = logging.getLogger("tasks")
+
+registry = {}
+
+
+class TaskFunction:
+    def __init__(self, func, name, batch=False, max_attempts=None):
+        self.func = func
+        self.name = name
+        self.batch = batch
+        self.max_attempts = max_attempts
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def enqueue(self, key=None, delay=0, **payload):
+        return enqueue(self.name, payload, key=key, delay=delay)
+
+    def run(self, payloads):
+        # batch=True の関数は同じ種類のタスクの payload をリストでまとめて受け取る
+        if self.batch:
+            self.func(payloads)
+        else:
+            for payload in payloads:
+                self.func(**payload)
+
+
+def task(name=None, batch=False, max_attempts=None):
+    def decorator(func):
+        registered = TaskFunction(func, name or f"{func.__module__}.{func.__name__}", batch, max_attempts)
+        registry[registered.name] = registered
+        return registered
+
+    return decorator
+
+
+def enqueue(name, payload, key=None, delay=0):
+    # 呼び出し元のトランザクションと一緒にコミットされるので、ロールバックされた操作のタスクは残らない
+    if settings.TASKS_EAGER:
+        registry[name].run([payload])
+        return None
+    fields = {"name": name, "payload": payload, "run_at": timezone.now() + timedelta(seconds=delay)}
+    if key is None:
+        return Task.objects.create(**fields)
+    return Task.objects.get_or_create(key=key, defaults=fields)[0]
+
+
+def retry_delay(attempts):
+    # 指数バックオフ。同時に失敗したタスクが同時に再実行されないよう揺らぎを入れる
+    delay = min(settings.TASKS_RETRY_MAX_DELAY, settings.TASKS_RETRY_DELAY * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+def purge_finished():
+    # 失敗したタスクは調査用に残す
+    cutoff = timezone.now() - timedelta(seconds=settings.TASKS_RETENTION)
+    return Task.objects.filter(status=Task.Status.DONE, finished_at__lt=cutoff).delete()[0]
+
+
+def default_workers():
+    # SQLite は書き込みが 1 本ずつなので、スレッドを増やしてもロック待ちが増えるだけ
+    return 1 if connection.vendor == "sqlite" else 4
+
+
+class Worker:
+    def __init__(self, workers=None, batch_size=100):
+        self.token = uuid.uuid4().hex
+        self.batch_size = batch_size
+        self.workers = default_workers() if workers is None else workers
+        # workers が 1 以下ならスレッドを使わずその場で実行する
+        self.executor = (
+            ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="tasks") if self.workers > 1 else None
+        )
+
+    def claim(self):
+        now = timezone.now()
+        # 落ちたワーカーが掴んだままのタスクを戻す
+        stale = now - timedelta(seconds=settings.TASKS_LOCK_TIMEOUT)
+        Task.objects.filter(status=Task.Status.RUNNING, locked_at__lt=stale).update(
+            status=Task.Status.PENDING, locked_by=""
+        )
+        with transaction.atomic():
+            pending = Task.objects.filter(status=Task.Status.PENDING, run_at__lte=now).order_by("run_at", "id")
+            if connection.features.has_select_for_update_skip_locked:
+                pending = pending.select_for_update(skip_locked=True)
+            ids = list(pending.values_list("id", flat=True)[: self.batch_size])
+            # 他のワーカーと取り合っても、status が pending のまま残っていた分だけが自分のものになる
+            Task.objects.filter(id__in=ids, status=Task.Status.PENDING).update(
+                status=Task.Status.RUNNING, locked_by=self.token, locked_at=now, attempts=F("attempts") + 1
+            )
+        return list(Task.objects.filter(id__in=ids, locked_by=self.token, status=Task.Status.RUNNING))
+
+    def run_once(self):
+        tasks = self.claim()
+        groups = defaultdict(list)
+        for claimed in sorted(tasks, key=lambda claimed: (claimed.run_at, claimed.id)):
+            groups[claimed.name].append(claimed)
+
+        jobs = []
+        for name, group in groups.items():
+            func = registry.get(name)
+            if func is None or func.batch:
+                jobs.append((func, group))
+            else:
+                jobs += [(func, [claimed]) for claimed in group]
+        if self.executor is None:
+            for func, group in jobs:
+                self.execute(func, group)
+        else:
+            wait([self.executor.submit(self.execute_in_thread, func, group) for func, group in jobs])
+        return len(tasks)
+
+    def execute_in_thread(self, func, group):
+        try:
+            self.execute(func, group)
+        finally:
+            close_old_connections()
+
+    def execute(self, func, group):
+        error = self.run_group(func, group)
+        if error is None:
+            done = group
+        elif func is None or len(group) == 1:
+            self.fail(func, group, error)
+            done = []
+        else:
+            # まとめて実行して失敗したときは 1 件ずつ実行し直し、失敗した payload のタスクだけを再試行に回す
+            done = []
+            for claimed in group:
+                error = self.run_group(func, [claimed])
+                if error is None:
+                    done.append(claimed)
+                else:
+                    self.fail(func, [claimed], error)
+        if done:
+            Task.objects.filter(id__in=[claimed.id for claimed in done]).update(
+                status=Task.Status.DONE, finished_at=timezone.now(), locked_by=""
+            )
+
+    def run_group(self, func, group):
+        # 成功すれば None、失敗すればトレースバックを返す
+        try:
+            if func is None:
+                raise LookupError(f"登録されていないタスクです: {group[0].name}")
+            # 途中で失敗したら書き込みを残さず、そのまま再実行できるようにする
+            with transaction.atomic():
+                func.run([claimed.payload for claimed in group])
+        except Exception:
+            logger.exception("タスク %s が失敗しました", group[0].name)
+            return traceback.format_exc()
+        return None
+
+    def fail(self, func, group, error):
+        max_attempts = (func and func.max_attempts) or settings.TASKS_MAX_ATTEMPTS
+        now = timezone.now()
+        for claimed in group:
+            claimed.last_error = error
+            claimed.locked_by = ""
+            if func is None or claimed.attempts >= max_attempts:
+                claimed.status = Task.Status.FAILED
+                claimed.finished_at = now
+            else:
+                claimed.status = Task.Status.PENDING
+                claimed.run_at = now + timedelta(seconds=retry_delay(claimed.attempts))
+        Task.objects.bulk_update(group, ["last_error", "locked_by", "status", "finished_at", "run_at"])
+
+    def shutdown(self):
+        # タスクの中で増減したカウンタを書き込んでから止まる
+        counters.buffer.flush()
+        if self.executor is not None:
+            # DB 接続はスレッドごとなので、全スレッドが 1 つずつ受け取るまで待たせてそれぞれで閉じる
+            barrier = threading.Barrier(self.workers)
+            wait([self.executor.submit(self.close_in_thread, barrier) for _ in range(self.workers)])
+            self.executor.shutdown()
+
+    def close_in_thread(self, barrier):
+        try:
+            connections.close_all()
+        finally:
+            barrier.wait()
@@ -0,0 +1,159 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from accounts.models import FriendShip
+from tweets.models import TimelineEntry, Tweet
+
+from .models import Task
+from .queue import Worker, enqueue, task
+
+User = get_user_model()
+
+calls = []
+
+
+@task(name="tests.record")
+def record(value):
+    calls.append([value])
+
+
+@task(name="tests.record_batch", batch=True)
+def record_batch(payloads):
+    calls.append([payload["value"] for payload in payloads])
+
+
+@task(name="tests.record_batch_or_fail", batch=True)
+def record_batch_or_fail(payloads):
+    calls.append([payload["value"] for payload in payloads])
+    if any(payload["value"] < 0 for payload in payloads):
+        raise ValueError(payloads)
+
+
+@task(name="tests.fail", max_attempts=2)
+def fail(value):
+    raise ValueError(value)
+
+
+@task(name="tests.create_user")
+def create_user(username):
+    # 読んでから書くので、トランザクションの途中で書き込みロックを取りに行く
+    if not User.objects.filter(username=username).exists():
+        User.objects.create_user(username=username)
+
+
+@override_settings(TASKS_EAGER=False)
+class TestTaskQueue(TestCase):
+    def setUp(self):
+        calls.clear()
+        self.worker = Worker(workers=1)
+
+    def test_enqueue_stores_task(self):
+        record.enqueue(value=1)
+        self.assertEqual(Task.objects.get().payload, {"value": 1})
+        self.assertEqual(calls, [])
+
+    @override_settings(TASKS_EAGER=True)
+    def test_eager_runs_immediately(self):
+        record.enqueue(value=1)
+        self.assertEqual(calls, [[1]])
+        self.assertFalse(Task.objects.exists())
+
+    def test_idempotency_key(self):
+        record.enqueue(key="once", value=1)
+        record.enqueue(key="once", value=2)
+        self.assertEqual(Task.objects.count(), 1)
+        self.worker.run_once()
+        self.assertEqual(calls, [[1]])
+
+    def test_run_once(self):
+        record.enqueue(value=1)
+        record.enqueue(value=2)
+        self.assertEqual(self.worker.run_once(), 2)
+        self.assertEqual(calls, [[1], [2]])
+        self.assertFalse(Task.objects.exclude(status=Task.Status.DONE).exists())
+        self.assertEqual(self.worker.run_once(), 0)
+
+    def test_same_type_tasks_are_batched(self):
+        for value in range(3):
+            record_batch.enqueue(value=value)
+        self.worker.run_once()
+        self.assertEqual(calls, [[0, 1, 2]])
+
+    def test_failed_batch_is_retried_one_by_one(self):
+        for value in (1, -1, 2):
+            record_batch_or_fail.enqueue(value=value)
+        with self.assertLogs("tasks", "ERROR"):
+            self.worker.run_once()
+        self.assertEqual(calls, [[1, -1, 2], [1], [-1], [2]])
+        statuses = {task.payload["value"]: task.status for task in Task.objects.all()}
+        self.assertEqual(statuses, {1: Task.Status.DONE, -1: Task.Status.PENDING, 2: Task.Status.DONE})
+
+    def test_delayed_task_is_not_run_early(self):
+        record.enqueue(delay=60, value=1)
+        self.assertEqual(self.worker.run_once(), 0)
+
+    def test_retry_with_backoff(self):
+        fail.enqueue(value=1)
+        with self.assertLogs("tasks", "ERROR"):
+            self.worker.run_once()
+        failed = Task.objects.get()
+        self.assertEqual(failed.status, Task.Status.PENDING)
+        self.assertEqual(failed.attempts, 1)
+        self.assertGreater(failed.run_at, timezone.now())
+        self.assertIn("ValueError", failed.last_error)
+
+        Task.objects.update(run_at=timezone.now())
+        with self.assertLogs("tasks", "ERROR"):
+            self.worker.run_once()
+        failed.refresh_from_db()
+        self.assertEqual(failed.status, Task.Status.FAILED)
+        self.assertEqual(failed.attempts, 2)
+
+    def test_unknown_task_fails(self):
+        Task.objects.create(name="tests.unknown")
+        with self.assertLogs("tasks", "ERROR"):
+            self.worker.run_once()
+        self.assertEqual(Task.objects.get().status, Task.Status.FAILED)
+
+    def test_stale_running_task_is_reclaimed(self):
+        stale = timezone.now() - timedelta(hours=1)
+        Task.objects.create(name="tests.record", payload={"value": 1}, status=Task.Status.RUNNING, locked_at=stale)
+        self.worker.run_once()
+        self.assertEqual(calls, [[1]])
+
+    def test_run_tasks_command(self):
+        enqueue("tests.record", {"value": 1})
+        out = StringIO()
+        call_command("run_tasks", once=True, workers=1, stdout=out)
+        self.assertEqual(calls, [[1]])
+        self.assertIn("1 件", out.getvalue())
+
+    def test_fan_out_runs_in_worker(self):
+        user = User.objects.create_user(username="testuser", password="testpassword")
+        author = User.objects.create_user(username="author", password="testpassword")
+        FriendShip.objects.create(follower=user, following=author)
+        tweet = Tweet.objects.create(user=author, content="hello")
+        self.assertFalse(TimelineEntry.objects.filter(owner=user, tweet=tweet).exists())
+
+        self.worker.run_once()
+        self.assertTrue(TimelineEntry.objects.filter(owner=user, tweet=tweet).exists())
+
+
+@override_settings(TASKS_EAGER=False)
+class TestConcurrentWorker(TransactionTestCase):
+    # 複数スレッドが同時に書き込んでも、ロック待ちで失敗せず全部 1 回で終わること（テスト DB はファイル）
+    def test_multiple_threads(self):
+        for i in range(40):
+            create_user.enqueue(username=f"user{i}")
+        worker = Worker(workers=4, batch_size=40)
+        try:
+            self.assertEqual(worker.run_once(), 40)
+        finally:
+            worker.shutdown()
+        self.assertEqual(User.objects.count(), 40)
+        self.assertEqual(set(Task.objects.values_list("status", "attempts")), {(Task.Status.DONE, 1)})
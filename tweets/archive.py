@@ -0,0 +1,317 @@
+import gzip
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+from bisect import bisect_right
+from contextlib import contextmanager
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.dateparse import parse_datetime
+
+from .dataset import chunked
+from .models import Tweet
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# 月ごとのアーカイブは tweets-YYYY-MM.N.jsonl.gz（または .zst）の本体と tweets-YYYY-MM.N.idx の索引の組。
+# N は同じ月に後から足した分の通し番号で、一度書き出したファイルは変更しない。
+# 本体は TWEET_ARCHIVE_BLOCK_SIZE 件ずつ独立に圧縮したブロックをつなげたもので、全体を zcat すれば JSONL として読める。
+# 索引は id 順の (tweet id, ブロックの位置, ブロックの長さ) の固定長レコードで、mmap して二分探索する
+
+CODECS = {"gzip": ".gz", "zstd": ".zst"}
+INDEX_MAGIC = b"TWARCH1\n"
+INDEX_ENTRY = struct.Struct("<qQI")
+PART_PATTERN = re.compile(r"tweets-(\d{4}-\d{2})\.(\d+)\.idx")
+
+
+def _zstandard():
+    if zstandard is None:
+        raise ImproperlyConfigured("zstd のアーカイブを扱うには zstandard パッケージが必要です。")
+    return zstandard
+
+
+def compress_block(codec, data):
+    if codec == "zstd":
+        return _zstandard().ZstdCompressor(level=19).compress(data)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def decompress_block(codec, data):
+    if codec == "zstd":
+        return _zstandard().ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def to_record(tweet):
+    return {
+        "id": tweet.id,
+        "user_id": tweet.user_id,
+        "content": tweet.content,
+        "created_at": tweet.created_at.isoformat(),
+        "like_count": tweet.like_count,
+        "version": tweet.version,
+    }
+
+
+def from_record(record):
+    tweet = Tweet(
+        id=record["id"],
+        user_id=record["user_id"],
+        content=record["content"],
+        created_at=parse_datetime(record["created_at"]),
+        like_count=record["like_count"],
+        version=record["version"],
+    )
+    tweet.is_archived = True
+    return tweet
+
+
+@contextmanager
+def locked(directory):
+    # アーカイブを書き換えるプロセス同士（archive_tweets と退会処理など）が同じ N に書き出したり、
+    # 同じパートを書き出し直したりしないように、ディレクトリの .lock ファイルで排他ロックを取る。
+    # ロックは開いたファイルごとなので、取ったまま write_part() を呼ぶと待ち続ける。中では _write_part() を使う
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / ".lock", "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK は 10 秒で諦めるので取れるまで繰り返す
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def write_part(directory, month, records, codec=None, block_size=None):
+    # records は id 順の to_record() の結果。書き出した id のリストを返す（なければファイルを作らない）
+    with locked(directory):
+        return _write_part(directory, month, records, codec, block_size)
+
+
+def _write_part(directory, month, records, codec=None, block_size=None):
+    codec = codec or settings.TWEET_ARCHIVE_CODEC
+    if codec not in CODECS:
+        raise ImproperlyConfigured(f"TWEET_ARCHIVE_CODEC は gzip / zstd のいずれかを指定してください: {codec}")
+    directory = Path(directory)
+    parts = [
+        int(match[2]) for match in map(PART_PATTERN.fullmatch, os.listdir(directory)) if match and match[1] == month
+    ]
+    stem = f"tweets-{month}.{max(parts, default=-1) + 1}"
+    data_path = directory / f"{stem}.jsonl{CODECS[codec]}"
+    index_path = directory / f"{stem}.idx"
+
+    entries = []
+    with open(f"{data_path}.tmp", "wb") as f:
+        for block in chunked(records, block_size or settings.TWEET_ARCHIVE_BLOCK_SIZE):
+            data = compress_block(
+                codec, "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in block).encode()
+            )
+            entries += [(record["id"], f.tell(), len(data)) for record in block]
+            f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    if not entries:
+        os.remove(f"{data_path}.tmp")
+        return []
+    entries.sort()
+    with open(f"{index_path}.tmp", "wb") as f:
+        f.write(INDEX_MAGIC)
+        for entry in entries:
+            f.write(INDEX_ENTRY.pack(*entry))
+        f.flush()
+        os.fsync(f.fileno())
+    # 索引があるものだけを読むので、本体から先に置く
+    os.replace(f"{data_path}.tmp", data_path)
+    os.replace(f"{index_path}.tmp", index_path)
+    return [tweet_id for tweet_id, _, _ in entries]
+
+
+class ArchivePart:
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self.codec, self.data_path = next(
+            (codec, index_path.with_suffix(f".jsonl{suffix}"))
+            for codec, suffix in CODECS.items()
+            if index_path.with_suffix(f".jsonl{suffix}").is_file()
+        )
+        with open(index_path, "rb") as f:
+            self.index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.index[: len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError(f"アーカイブの索引ではありません: {index_path}")
+        self.count = (len(self.index) - len(INDEX_MAGIC)) // INDEX_ENTRY.size
+        self.min_id = self.entry(0)[0]
+        self.max_id = self.entry(self.count - 1)[0]
+
+    def entry(self, i):
+        return INDEX_ENTRY.unpack_from(self.index, len(INDEX_MAGIC) + i * INDEX_ENTRY.size)
+
+    def locate(self, tweet_id):
+        # 索引だけを二分探索し、tweet_id を含むブロックの (位置, 長さ) を返す
+        if not self.min_id <= tweet_id <= self.max_id:
+            return None
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.entry(mid)[0] < tweet_id:
+                lo = mid + 1
+            else:
+                hi = mid
+        found_id, offset, length = self.entry(lo)
+        return (offset, length) if found_id == tweet_id else None
+
+    def find(self, tweet_id):
+        # ブロックを読んで展開するのは、索引で見つかったときだけ
+        location = self.locate(tweet_id)
+        if location is None:
+            return None
+        offset, length = location
+        with open(self.data_path, "rb") as f:
+            f.seek(offset)
+            block = decompress_block(self.codec, f.read(length))
+        return next(record for record in map(json.loads, block.splitlines()) if record["id"] == tweet_id)
+
+    def records(self):
+        # 全ブロックを先頭から順に展開して読む
+        blocks = sorted({self.entry(i)[1:] for i in range(self.count)})
+        with open(self.data_path, "rb") as f:
+            for offset, length in blocks:
+                f.seek(offset)
+                yield from map(json.loads, decompress_block(self.codec, f.read(length)).splitlines())
+
+
+class Archive:
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.parts = {}
+        # min_id 順に並べたパートと、その min_id のリスト。探すときに二分探索で候補を絞る
+        self._ordered = ([], [])
+        self._lock = threading.Lock()
+        self._mtime = None
+
+    def refresh(self):
+        # ファイルが書き足される・消されるとディレクトリの mtime が変わるので、そのときだけ一覧を読み直す
+        try:
+            mtime = self.directory.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if mtime == self._mtime:
+                return
+            parts = {}
+            for path in sorted(self.directory.glob("tweets-*.idx")):
+                if PART_PATTERN.fullmatch(path.name):
+                    try:
+                        parts[path] = self.parts.get(path) or ArchivePart(path)
+                    except FileNotFoundError:
+                        # 一覧を取ってから開くまでの間に消された
+                        pass
+            ordered = sorted(parts.values(), key=lambda part: part.min_id)
+            self.parts = parts
+            self._ordered = (ordered, [part.min_id for part in ordered])
+            self._mtime = mtime
+
+    def candidates(self, tweet_id):
+        # tweet_id を id の範囲に含むパートだけを返す
+        ordered, min_ids = self._ordered
+        return [part for part in ordered[: bisect_right(min_ids, tweet_id)] if tweet_id <= part.max_id]
+
+    def get(self, tweet_id):
+        for _ in range(2):
+            self.refresh()
+            try:
+                for part in self.candidates(tweet_id):
+                    record = part.find(tweet_id)
+                    if record is not None:
+                        return record
+                return None
+            except FileNotFoundError:
+                # 読んでいる間にパートが書き出し直された。一覧を読み直してもう一度探す
+                continue
+        return None
+
+    def __contains__(self, tweet_id):
+        self.refresh()
+        return any(part.locate(tweet_id) for part in self.candidates(tweet_id))
+
+
+_archives = {}
+
+
+def get_archive():
+    directory = Path(settings.TWEET_ARCHIVE_DIR)
+    if directory not in _archives:
+        _archives[directory] = Archive(directory)
+    return _archives[directory]
+
+
+def get_archived_tweet(tweet_id):
+    record = get_archive().get(tweet_id)
+    return record and from_record(record)
+
+
+def remove_user(user_id):
+    # 退会したユーザーのツイートを含むパートを、そのツイートを除いて新しいパートに書き出し直してから古いパートを消す。
+    # 書き出したファイルは変更しないので、読んでいる途中のパートの中身が入れ替わることはない。消したツイート数を返す
+    archive = get_archive()
+    removed = 0
+    if not archive.directory.is_dir():
+        return removed
+    with locked(archive.directory):
+        archive.refresh()
+        for path, part in list(archive.parts.items()):
+            records = list(part.records())
+            kept = sorted(
+                (record for record in records if record["user_id"] != user_id), key=lambda record: record["id"]
+            )
+            if len(kept) == len(records):
+                continue
+            _write_part(archive.directory, PART_PATTERN.fullmatch(path.name)[1], kept, codec=part.codec)
+            os.remove(part.index_path)
+            os.remove(part.data_path)
+            removed += len(records) - len(kept)
+    return removed
+
+
+def archive_month(start, batch_size=None):
+    # start（月初）から 1 か月分のツイートを新しいパートに書き出し、DB から消してよい id を返す。
+    # 前回の実行が消す前に止まっていても、アーカイブ済みの分は書き直さずに id だけ返す
+    end = (start + timedelta(days=32)).replace(day=1)
+    archive = get_archive()
+    tweets = Tweet.objects.filter(created_at__gte=start, created_at__lt=end).order_by("id")
+    archived = []
+
+    def records():
+        for tweet in tweets.iterator(chunk_size=batch_size or settings.PURGE_BATCH_SIZE):
+            if tweet.id in archive:
+                archived.append(tweet.id)
+            else:
+                yield to_record(tweet)
+
+    written = write_part(settings.TWEET_ARCHIVE_DIR, start.strftime("%Y-%m"), records())
+    return sorted(archived + written)
@@ -0,0 +1,168 @@
+import csv
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from accounts.graph import invalidate_follow_graph
+from accounts.models import FriendShip
+from mysite.conditional import bump_version
+
+from . import tasks
+from .models import Tweet
+from .timeline import fan_out_tweets
+
+User = get_user_model()
+
+
+def read_records(path):
+    # 拡張子が .csv なら CSV（1 行目がヘッダー）、それ以外は 1 行 1 JSON として 1 件ずつ読む
+    with open(path, encoding="utf-8", newline="") as f:
+        if str(path).endswith(".csv"):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+class RecordWriter:
+    def __init__(self, path, fields):
+        self.file = open(path, "w", encoding="utf-8", newline="")
+        self.fields = fields
+        self.csv = None
+        if str(path).endswith(".csv"):
+            self.csv = csv.DictWriter(self.file, fields)
+            self.csv.writeheader()
+
+    def write(self, record):
+        if self.csv:
+            self.csv.writerow(record)
+        else:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def chunked(records, size):
+    records = iter(records)
+    while chunk := list(itertools.islice(records, size)):
+        yield chunk
+
+
+def hash_passwords(passwords, workers=None):
+    # PBKDF2 などは 1 件数百ミリ秒かかるので、プロセスプールで CPU コア数だけ並列に計算する
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(passwords) <= 1:
+        return [make_password(password) for password in passwords]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(make_password, passwords, chunksize=max(1, len(passwords) // (workers * 4))))
+
+
+def _user_ids(usernames):
+    return dict(User.objects.filter(username__in=set(usernames)).values_list("username", "id"))
+
+
+def import_users(records, batch_size=1000, hash=True, workers=None):
+    # password がない行、または hash=False のときはログインできないパスワードにする
+    created = 0
+    for chunk in chunked(records, batch_size):
+        passwords = [record.get("password") or None for record in chunk]
+        if hash:
+            hashed = iter(hash_passwords([password for password in passwords if password], workers))
+            passwords = [next(hashed) if password else make_password(None) for password in passwords]
+        else:
+            passwords = [make_password(None) for _ in passwords]
+        users = [
+            User(username=record["username"], email=record.get("email") or "", password=password)
+            for record, password in zip(chunk, passwords)
+        ]
+        # ignore_conflicts=True の bulk_create は読み飛ばした行も返すので、前後の件数の差を数える
+        existing = User.all_objects.filter(username__in={user.username for user in users})
+        with transaction.atomic():
+            before = existing.count()
+            User.objects.bulk_create(users, ignore_conflicts=True)
+            created += existing.count() - before
+    return created
+
+
+def import_follows(records, batch_size=1000):
+    # シグナルを通さないので、新しく入った組についてだけフォローと同じ後始末（キャッシュの破棄とタイムラインの補完）をする
+    created = 0
+    for chunk in chunked(records, batch_size):
+        ids = _user_ids([name for record in chunk for name in (record["follower"], record["following"])])
+        pairs = {
+            (ids[record["follower"]], ids[record["following"]])
+            for record in chunk
+            if record["follower"] in ids and record["following"] in ids and record["follower"] != record["following"]
+        }
+        with transaction.atomic():
+            existing = set(
+                FriendShip.objects.filter(follower_id__in={follower_id for follower_id, _ in pairs})
+                .filter(following_id__in={following_id for _, following_id in pairs})
+                .values_list("follower_id", "following_id")
+            )
+            pairs -= existing
+            FriendShip.objects.bulk_create(
+                [
+                    FriendShip(follower_id=follower_id, following_id=following_id)
+                    for follower_id, following_id in pairs
+                ],
+                ignore_conflicts=True,
+            )
+            for follower_id, following_id in pairs:
+                invalidate_follow_graph(follower_id, following_id)
+                tasks.sync_timeline.enqueue(follower_id=follower_id, following_id=following_id)
+            bump_version(*{f"user:{user_id}" for pair in pairs for user_id in pair})
+        created += len(pairs)
+    return created
+
+
+def _parse_created_at(value):
+    if not value:
+        return timezone.now()
+    created_at = parse_datetime(value)
+    if created_at is None:
+        raise ValueError(f"日時の形式が不正です: {value}")
+    if timezone.is_naive(created_at):
+        created_at = timezone.make_aware(created_at)
+    return created_at
+
+
+def import_tweets(records, batch_size=1000, fan_out=True):
+    # 140 文字を超える行や存在しないユーザーの行は読み飛ばし、件数だけ返す
+    created = skipped = 0
+    max_length = Tweet._meta.get_field("content").max_length
+    for chunk in chunked(records, batch_size):
+        ids = _user_ids(record["username"] for record in chunk)
+        tweets = []
+        for record in chunk:
+            if record["username"] not in ids or len(record["content"]) > max_length:
+                skipped += 1
+                continue
+            tweets.append(
+                Tweet(
+                    user_id=ids[record["username"]],
+                    content=record["content"],
+                    created_at=_parse_created_at(record.get("created_at")),
+                )
+            )
+        with transaction.atomic():
+            tweets = Tweet.objects.bulk_create(tweets)
+            if fan_out:
+                fan_out_tweets(tweets)
+        created += len(tweets)
+    return created, skipped
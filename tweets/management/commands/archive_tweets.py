@@ -0,0 +1,60 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from tweets import purge
+from tweets.archive import archive_month
+from tweets.dataset import chunked
+from tweets.models import Tweet
+
+
+class Command(BaseCommand):
+    help = (
+        "--days 日（既定は TWEET_ARCHIVE_AFTER_DAYS）より前の月のツイートを、月ごとの圧縮ファイルに書き出して DB から消します。"
+        "書き出したツイートの個別ページはアーカイブから表示されます。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=None)
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--dry-run", action="store_true", help="対象の月と件数を表示するだけで、書き出さない")
+
+    def handle(self, *args, **options):
+        days = settings.TWEET_ARCHIVE_AFTER_DAYS if options["days"] is None else options["days"]
+        # 月の途中で区切らないよう、days 日前を含む月より前の月だけを対象にする
+        boundary = (timezone.localtime() - timedelta(days=days)).replace(
+            day=1, hour=0, minute=0, second=0, microsecond=0
+        )
+        months = (
+            Tweet.objects.filter(created_at__lt=boundary)
+            .annotate(month=TruncMonth("created_at"))
+            .values("month")
+            .annotate(count=Count("id"))
+            .order_by("month")
+        )
+        for row in months:
+            label = row["month"].strftime("%Y-%m")
+            if options["dry_run"]:
+                self.stdout.write(f"{label}: {row['count']} 件")
+                continue
+            tweet_ids = archive_month(row["month"], options["batch_size"])
+            self.stdout.write(f"{label}: {len(tweet_ids)} 件を書き出しました。")
+            self.delete(label, tweet_ids, options["batch_size"] or settings.PURGE_BATCH_SIZE)
+
+    def delete(self, label, tweet_ids, batch_size):
+        # 書き出しが終わってから、purge と同じく短いトランザクションに分けて消す
+        total = Counter()
+        for chunk in chunked(tweet_ids, batch_size):
+            finished = False
+            while not finished:
+                with transaction.atomic():
+                    deleted, finished = purge.purge_archived(chunk, batch_size=batch_size)
+                total.update(deleted)
+            counts = ", ".join(f"{name} {count}" for name, count in total.items())
+            self.stdout.write(f"{label}: {counts}")
@@ -0,0 +1,84 @@
+import bisect
+import itertools
+import random
+from datetime import timedelta
+from pathlib import Path
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tweets.dataset import RecordWriter
+
+WORDS = [
+    "今日", "明日", "ランチ", "コーヒー", "仕事", "勉強", "電車", "天気", "映画", "ラーメン",
+    "猫", "犬", "散歩", "週末", "旅行", "東京", "大阪", "雨", "晴れ", "眠い",
+    "python", "django", "deploy", "bug", "release", "review", "test", "cache", "query", "index",
+]  # fmt: skip
+
+
+class Command(BaseCommand):
+    help = (
+        "負荷試験用に users / follows / tweets のファイルを生成します。"
+        "フォロワー数はべき分布になり、少数の有名ユーザーとロングテールができます。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("output", help="出力先ディレクトリ")
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--tweets", type=int, default=10000, help="ツイートの総数")
+        parser.add_argument("--avg-following", type=int, default=50, help="1 人あたりの平均フォロー数")
+        parser.add_argument(
+            "--alpha", type=float, default=1.0, help="人気度のべき指数。大きいほど有名ユーザーに集中する"
+        )
+        parser.add_argument("--days", type=int, default=30, help="ツイートの投稿日時を散らす日数")
+        parser.add_argument("--password", help="全ユーザー共通のパスワード（省略時はログインできないユーザーになる）")
+        parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+        parser.add_argument("--seed", type=int)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        output = Path(options["output"])
+        output.mkdir(parents=True, exist_ok=True)
+        n = options["users"]
+        usernames = [f"user{i}" for i in range(n)]
+
+        # 人気順位 r のユーザーがフォローされる確率を 1 / r^alpha に比例させる（Zipf 分布）
+        ranked = usernames[:]
+        rng.shuffle(ranked)
+        cum_weights = list(itertools.accumulate(1 / (rank + 1) ** options["alpha"] for rank in range(n)))
+
+        paths = {name: output / f"{name}.{options['format']}" for name in ("users", "follows", "tweets")}
+        with RecordWriter(paths["users"], ["username", "email", "password"]) as writer:
+            for username in usernames:
+                email = f"{username}@example.com"
+                writer.write({"username": username, "email": email, "password": options["password"]})
+
+        follows = 0
+        with RecordWriter(paths["follows"], ["follower", "following"]) as writer:
+            for username in usernames:
+                # フォローする人数もべき分布（平均 avg_following）にする
+                k = min(n - 1, int(rng.paretovariate(1.5) * options["avg_following"] / 3))
+                following = set()
+                for _ in range(k * 2):
+                    target = ranked[bisect.bisect_left(cum_weights, rng.random() * cum_weights[-1])]
+                    if target != username:
+                        following.add(target)
+                    if len(following) >= k:
+                        break
+                for target in following:
+                    writer.write({"follower": username, "following": target})
+                follows += len(following)
+
+        # 投稿数もユーザーごとに偏らせる
+        activity = list(itertools.accumulate(rng.paretovariate(1.2) for _ in range(n)))
+        now = timezone.now()
+        with RecordWriter(paths["tweets"], ["username", "content", "created_at"]) as writer:
+            for _ in range(options["tweets"]):
+                username = usernames[bisect.bisect_left(activity, rng.random() * activity[-1])]
+                content = " ".join(rng.choices(WORDS, k=rng.randint(3, 12)))[:140]
+                created_at = now - timedelta(seconds=rng.uniform(0, options["days"] * 24 * 60 * 60))
+                writer.write({"username": username, "content": content, "created_at": created_at.isoformat()})
+
+        self.stdout.write(
+            f"ユーザー {n} 人、フォロー {follows} 件、ツイート {options['tweets']} 件を {output} に書き出しました。"
+        )
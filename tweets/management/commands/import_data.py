@@ -0,0 +1,49 @@
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from tweets import dataset, search
+
+
+class Command(BaseCommand):
+    help = (
+        "ユーザー・フォロー・ツイートを JSONL / CSV から bulk_create でまとめて取り込みます。"
+        "シグナルを通さないので、最後にカウンタ・タイムライン・検索インデックスを作り直します。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", help="username, email, password の列を持つファイル")
+        parser.add_argument("--follows", help="follower, following（どちらも username）の列を持つファイル")
+        parser.add_argument("--tweets", help="username, content, created_at（ISO 8601、省略可）の列を持つファイル")
+        parser.add_argument("--batch-size", type=int, default=1000, help="1 トランザクションで取り込む行数")
+        parser.add_argument(
+            "--unusable-passwords",
+            action="store_true",
+            help="パスワードをハッシュ化せず、ログインできないユーザーとして取り込む",
+        )
+        parser.add_argument("--workers", type=int, help="パスワードをハッシュ化するプロセス数（既定は CPU コア数）")
+        parser.add_argument("--no-fan-out", action="store_true", help="タイムラインへの配信を行わない")
+        parser.add_argument("--no-search-index", action="store_true", help="検索インデックスを作り直さない")
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if options["users"]:
+            count = dataset.import_users(
+                dataset.read_records(options["users"]),
+                batch_size=batch_size,
+                hash=not options["unusable_passwords"],
+                workers=options["workers"],
+            )
+            self.stdout.write(f"ユーザー: {count} 件")
+        if options["follows"]:
+            count = dataset.import_follows(dataset.read_records(options["follows"]), batch_size=batch_size)
+            self.stdout.write(f"フォロー: {count} 件")
+            # fan-out するかどうかは follower_count で決まるので、ツイートより先に揃えておく
+            call_command("reconcile_counters", batch_size=batch_size, stdout=self.stdout)
+        if options["tweets"]:
+            count, skipped = dataset.import_tweets(
+                dataset.read_records(options["tweets"]), batch_size=batch_size, fan_out=not options["no_fan_out"]
+            )
+            self.stdout.write(f"ツイート: {count} 件（読み飛ばし {skipped} 件）")
+            call_command("reconcile_counters", batch_size=batch_size, stdout=self.stdout)
+            if search.is_available() and not options["no_search_index"]:
+                call_command("rebuild_search_index", batch_size=batch_size, stdout=self.stdout)
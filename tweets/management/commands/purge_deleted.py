@@ -0,0 +1,39 @@
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tweets import purge
+from tweets.models import Tweet
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "論理削除したツイート・ユーザーの関連する行を、タスクを待たずにこの場で最後まで消します。"
+        "--batch-size 行ずつ別のトランザクションで消し、進み具合を表示します。"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None)
+
+    def handle(self, *args, **options):
+        # 退会したユーザーのツイートは purge_user がまとめて消すので、先にユーザーを片付ける
+        users = User.all_objects.filter(is_deleted=True).order_by("deleted_at")
+        for user_id in list(users.values_list("pk", flat=True)):
+            self.purge("ユーザー", user_id, purge.purge_user, options["batch_size"])
+        tweets = Tweet.all_objects.filter(is_deleted=True).order_by("deleted_at")
+        for tweet_id in list(tweets.values_list("pk", flat=True)):
+            self.purge("ツイート", tweet_id, purge.purge_tweet, options["batch_size"])
+
+    def purge(self, label, pk, func, batch_size):
+        total = Counter()
+        finished = False
+        while not finished:
+            with transaction.atomic():
+                deleted, finished = func(pk, batch_size=batch_size)
+            total.update(deleted)
+            counts = ", ".join(f"{name} {count}" for name, count in total.items())
+            self.stdout.write(f"{label} {pk}: {counts}{'' if finished else ' ...'}")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tweets import search
+
+
+class Command(BaseCommand):
+    help = "ツイート検索用の転置インデックスを作り直します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not search.is_available():
+            raise CommandError("検索インデックスは SQLite (FTS5) でのみ利用できます。")
+        search.rebuild_index(batch_size=options["batch_size"])
+        self.stdout.write("検索インデックスを再構築しました。")
@@ -0,0 +1,47 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, Q
+
+from mysite import counters
+from tweets.models import Tweet
+
+User = get_user_model()
+
+# (モデル, カウンタ列, 集計元のリレーション, 集計する行の条件)。tweet_count は論理削除した時点で減らしている
+COUNTERS = [
+    (Tweet, "like_count", "likes", None),
+    (User, "tweet_count", "tweets", Q(tweets__is_deleted=False)),
+    (User, "follower_count", "follower_relations", None),
+    (User, "following_count", "following_relations", None),
+]
+
+
+class Command(BaseCommand):
+    help = "カウンタ列を元テーブルの件数と突き合わせてずれを修正します。"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true")
+
+    def handle(self, *args, **options):
+        counters.buffer.flush()
+        for model, field, relation, condition in COUNTERS:
+            drifted = (
+                model._base_manager.annotate(actual=Count(relation, filter=condition))
+                .exclude(**{field: F("actual")})
+                .values_list("pk", "actual")
+            )
+            fixed = 0
+            batch = []
+            for pk, actual in drifted.iterator(chunk_size=options["batch_size"]):
+                batch.append(model(pk=pk, **{field: actual}))
+                if len(batch) >= options["batch_size"]:
+                    fixed += self.save(model, field, batch, options["dry_run"])
+                    batch = []
+            fixed += self.save(model, field, batch, options["dry_run"])
+            self.stdout.write(f"{model._meta.label}.{field}: {fixed} 件修正")
+
+    def save(self, model, field, batch, dry_run):
+        if batch and not dry_run:
+            model._base_manager.bulk_update(batch, [field])
+        return len(batch)
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="tweet",
+            index=models.Index(fields=["-created_at", "-id"], name="tweet_created_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="tweet",
+            index=models.Index(fields=["user", "-created_at", "-id"], name="tweet_user_created_idx"),
+        ),
+    ]
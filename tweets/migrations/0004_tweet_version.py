@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0003_tweet_like_count_like_like_unique_like"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="tweet",
+            name="version",
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
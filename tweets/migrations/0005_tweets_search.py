@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:40
+
+from django.db import migrations
+
+
+def create_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS tweets_search USING fts5(tokens, tokenize = 'unicode61')")
+
+
+def drop_search_table(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute("DROP TABLE IF EXISTS tweets_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0004_tweet_version"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_table, drop_search_table),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 14:52
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0005_tweets_search"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="tweet",
+            name="created_at",
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
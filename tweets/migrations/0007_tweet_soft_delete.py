@@ -0,0 +1,63 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:20
+
+from django.db import migrations, models
+import django.db.models.manager
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0006_alter_tweet_created_at"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="tweet",
+            options={"base_manager_name": "all_objects", "ordering": ["-created_at", "-id"]},
+        ),
+        migrations.AlterModelManagers(
+            name="tweet",
+            managers=[
+                ("objects", django.db.models.manager.Manager()),
+                ("all_objects", django.db.models.manager.Manager()),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name="tweet",
+            name="tweet_created_idx",
+        ),
+        migrations.RemoveIndex(
+            model_name="tweet",
+            name="tweet_user_created_idx",
+        ),
+        migrations.AddField(
+            model_name="tweet",
+            name="deleted_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="tweet",
+            name="is_deleted",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name="tweet",
+            index=models.Index(
+                condition=models.Q(("is_deleted", False)), fields=["-created_at", "-id"], name="tweet_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="tweet",
+            index=models.Index(
+                condition=models.Q(("is_deleted", False)),
+                fields=["user", "-created_at", "-id"],
+                name="tweet_user_created_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="tweet",
+            index=models.Index(
+                condition=models.Q(("is_deleted", True)), fields=["deleted_at"], name="tweet_deleted_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:10
+
+import unicodedata
+
+from django.db import migrations
+
+
+def tokenize(text):
+    # このマイグレーションを書いた時点の tweets.search.tokenize の写し。後でトークナイザを変えても、ここは変えない
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    run = []
+
+    def flush():
+        tokens.extend(a + b for a, b in zip(run, run[1:]))
+        if run:
+            tokens.append(run[-1])
+        run.clear()
+
+    word = []
+    for char in text + " ":
+        if char.isascii() and char.isalnum():
+            flush()
+            word.append(char)
+            continue
+        if word:
+            tokens.append("".join(word))
+            word.clear()
+        if char.isalnum():
+            run.append(char)
+        else:
+            flush()
+    return tokens
+
+
+def retokenize(apps, schema_editor):
+    # 文字の連続の末尾 1 文字もトークンに入れるようになったので、索引済みのツイートを分割し直す
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    Tweet = apps.get_model("tweets", "Tweet")
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT rowid FROM tweets_search")
+        ids = [row[0] for row in cursor.fetchall()]
+        for start in range(0, len(ids), 1000):
+            rows = Tweet._base_manager.filter(pk__in=ids[start : start + 1000]).values_list("pk", "content")
+            cursor.executemany(
+                "UPDATE tweets_search SET tokens = %s WHERE rowid = %s",
+                [(" ".join(tokenize(content)), pk) for pk, content in rows],
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tweets", "0007_tweet_soft_delete"),
+    ]
+
+    operations = [
+        migrations.RunPython(retokenize, migrations.RunPython.noop),
+    ]
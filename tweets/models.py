@@ -1,4 +1,79 @@
-# from django.db import models
+from django.conf import settings
+from django.db import models
+from django.utils import timezone
 
 
-# class Tweet(models.Model):
+class TweetManager(models.Manager):
+    # 論理削除したツイートは、Tweet.all_objects で明示しない限り見えない
+    def get_queryset(self):
+        return super().get_queryset().filter(is_deleted=False)
+
+
+class Tweet(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="tweets")
+    content = models.CharField(max_length=140)
+    # インポート時に元の投稿日時を入れられるよう auto_now_add ではなく default にしている
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+    like_count = models.PositiveIntegerField(default=0)
+    version = models.PositiveIntegerField(default=1)
+    # 削除はまずこのフラグを立てて隠すだけにし、いいね・タイムラインなどの行は tweets.purge で少しずつ消す
+    is_deleted = models.BooleanField(default=False)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = TweetManager()
+    all_objects = models.Manager()
+
+    # アーカイブから読み込んだ（DB に行がない）ツイートなら True。tweets.archive を参照
+    is_archived = False
+
+    class Meta:
+        ordering = ["-created_at", "-id"]
+        # 外部キーからたどったときは削除済みでも読めるようにする（削除待ちの行の後始末で使う）
+        base_manager_name = "all_objects"
+        # 読み込みは常に is_deleted=False で絞るので、一覧の索引には削除済みの行を入れない
+        indexes = [
+            models.Index(
+                fields=["-created_at", "-id"], name="tweet_created_idx", condition=models.Q(is_deleted=False)
+            ),
+            models.Index(
+                fields=["user", "-created_at", "-id"],
+                name="tweet_user_created_idx",
+                condition=models.Q(is_deleted=False),
+            ),
+            models.Index(fields=["deleted_at"], name="tweet_deleted_idx", condition=models.Q(is_deleted=True)),
+        ]
+
+    def __str__(self):
+        return self.content
+
+    def soft_delete(self):
+        self.is_deleted = True
+        self.deleted_at = timezone.now()
+        # version は pre_save の bump_version_on_edit で上がる
+        self.save(update_fields=["is_deleted", "deleted_at", "version"])
+
+
+class TimelineEntry(models.Model):
+    # created_at は tweet.created_at のコピー。ホーム画面は owner 単位の範囲スキャンだけで読めるようにする
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="timeline_entries")
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="timeline_entries")
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["owner", "tweet"], name="unique_timeline_entry"),
+        ]
+        indexes = [
+            models.Index(fields=["owner", "-created_at", "-tweet"], name="timeline_owner_created_idx"),
+        ]
+
+
+class Like(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="likes")
+    tweet = models.ForeignKey(Tweet, on_delete=models.CASCADE, related_name="likes")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "tweet"], name="unique_like"),
+        ]
@@ -0,0 +1,171 @@
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections, router
+from django.utils import timezone
+
+from accounts.graph import invalidate_follow_graph
+from accounts.models import FriendShip
+from mysite import counters
+from mysite.conditional import bump_version
+
+from . import archive, search
+from .models import Like, TimelineEntry, Tweet
+from .timeline import invalidate_celebrity_tweets
+
+User = get_user_model()
+
+# 論理削除したツイート・ユーザーに付いている行を PURGE_BATCH_SIZE 行ずつ消す。
+# 1 回の実行は PURGE_TIME_LIMIT 秒で切り上げて続きは次のタスクに回すので、長いトランザクションでロックを握り続けない。
+# どこで止まっても、次の実行は残っている行を消し直すだけでよい
+
+
+def delete_batch(queryset, batch_size, *fields):
+    # queryset の行を最大 batch_size 行、シグナルもカスケードも通さずに主キーで消す。
+    # 子の行は先に消しておくこと。消した行の (pk, *fields) を返す
+    model = queryset.model
+    db = router.db_for_write(model)
+    rows = list(queryset.using(db).order_by().values_list("pk", *fields)[:batch_size])
+    if rows:
+        quote_name = connections[db].ops.quote_name
+        placeholders = ", ".join(["%s"] * len(rows))
+        with connections[db].cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {quote_name(model._meta.db_table)} "
+                f"WHERE {quote_name(model._meta.pk.column)} IN ({placeholders})",
+                [row[0] for row in rows],
+            )
+    return rows
+
+
+def run_steps(steps, batch_size=None, time_limit=None):
+    # steps は (名前, QuerySet, 読む列, 消した行を受け取る関数) のリスト。前から順に、空になるまで消す。
+    # time_limit 秒を過ぎたらそこで止め、(名前ごとの消した行数, 最後まで消せたか) を返す
+    batch_size = batch_size or settings.PURGE_BATCH_SIZE
+    time_limit = settings.PURGE_TIME_LIMIT if time_limit is None else time_limit
+    deadline = time.monotonic() + time_limit
+    deleted = Counter()
+    for name, queryset, fields, on_deleted in steps:
+        while True:
+            rows = delete_batch(queryset, batch_size, *fields)
+            if rows:
+                deleted[name] += len(rows)
+                if on_deleted:
+                    on_deleted(rows)
+            if len(rows) < batch_size:
+                break
+            if time.monotonic() >= deadline:
+                return deleted, False
+    return deleted, True
+
+
+def _remove_from_search(rows):
+    if search.is_available():
+        search.remove_tweets([row[0] for row in rows])
+
+
+def _decr_like_counts(rows):
+    for _, tweet_id in rows:
+        counters.buffer.decr(Tweet, tweet_id, "like_count")
+
+
+def _remove_followings(user_id):
+    def on_deleted(rows):
+        for _, following_id in rows:
+            counters.buffer.decr(User, following_id, "follower_count")
+            invalidate_follow_graph(user_id, following_id)
+        bump_version(*[f"user:{following_id}" for _, following_id in rows])
+
+    return on_deleted
+
+
+def _remove_followers(user_id):
+    def on_deleted(rows):
+        for _, follower_id in rows:
+            counters.buffer.decr(User, follower_id, "following_count")
+            invalidate_follow_graph(follower_id, user_id)
+        bump_version(*[f"user:{follower_id}" for _, follower_id in rows])
+
+    return on_deleted
+
+
+def _remove_archived(rows):
+    _remove_from_search(rows)
+    for _, user_id in rows:
+        counters.buffer.decr(User, user_id, "tweet_count")
+
+
+def purge_tweet(tweet_id, batch_size=None, time_limit=None):
+    tweets = Tweet.all_objects.filter(pk=tweet_id, is_deleted=True)
+    steps = [
+        ("timeline_entries", TimelineEntry.objects.filter(tweet__in=tweets), (), None),
+        ("likes", Like.objects.filter(tweet__in=tweets), (), None),
+        ("tweets", tweets, (), _remove_from_search),
+    ]
+    return run_steps(steps, batch_size, time_limit)
+
+
+def hide_tweets(user_id, batch_size=None, time_limit=None):
+    # 退会したユーザーのツイートを batch_size 件ずつ論理削除し、関連行を消すより先にタイムラインなどから隠す。
+    # (隠した件数, 最後まで隠せたか) を返す
+    batch_size = batch_size or settings.PURGE_BATCH_SIZE
+    time_limit = settings.PURGE_TIME_LIMIT if time_limit is None else time_limit
+    deadline = time.monotonic() + time_limit
+    tweets = Tweet.objects.filter(user_id=user_id, user__is_deleted=True)
+    hidden = 0
+    while True:
+        ids = list(tweets.order_by().values_list("pk", flat=True)[:batch_size])
+        if ids:
+            hidden += Tweet.all_objects.filter(pk__in=ids).update(is_deleted=True, deleted_at=timezone.now())
+            invalidate_celebrity_tweets(user_id)
+        if len(ids) < batch_size:
+            return hidden, True
+        if time.monotonic() >= deadline:
+            return hidden, False
+
+
+def purge_user(user_id, batch_size=None, time_limit=None):
+    time_limit = settings.PURGE_TIME_LIMIT if time_limit is None else time_limit
+    start = time.monotonic()
+    hidden, finished = hide_tweets(user_id, batch_size, time_limit)
+    if not finished:
+        return Counter(hidden_tweets=hidden), False
+
+    users = User.all_objects.filter(pk=user_id, is_deleted=True)
+    tweets = Tweet.all_objects.filter(user__in=users)
+    steps = [
+        ("timeline_entries", TimelineEntry.objects.filter(owner__in=users), (), None),
+        ("timeline_entries", TimelineEntry.objects.filter(tweet__in=tweets), (), None),
+        ("likes", Like.objects.filter(tweet__in=tweets), (), None),
+        ("likes", Like.objects.filter(user__in=users), ("tweet_id",), _decr_like_counts),
+        ("follows", FriendShip.objects.filter(follower__in=users), ("following_id",), _remove_followings(user_id)),
+        ("follows", FriendShip.objects.filter(following__in=users), ("follower_id",), _remove_followers(user_id)),
+        ("tweets", tweets, (), _remove_from_search),
+    ]
+    deleted, finished = run_steps(steps, batch_size, max(0, time_limit - (time.monotonic() - start)))
+    if hidden:
+        deleted["hidden_tweets"] += hidden
+    counters.buffer.flush_on_commit()
+    if finished:
+        # アーカイブに移したツイートも書き出し直して消す
+        removed = archive.remove_user(user_id)
+        if removed:
+            deleted["archived_tweets"] += removed
+        # 管理画面の操作履歴や権限など、ここで数えていない行はカスケードに任せる。残りは少ないので一度に消してよい
+        deleted["users"] = users.delete()[1].get(User._meta.label, 0)
+    return deleted, finished
+
+
+def purge_archived(tweet_ids, batch_size=None, time_limit=None):
+    # アーカイブに書き出したツイートを DB から消す（tweets.archive）。投稿数は DB に残っているツイートだけを数える
+    tweets = Tweet.objects.filter(pk__in=tweet_ids)
+    steps = [
+        ("timeline_entries", TimelineEntry.objects.filter(tweet__in=tweets), (), None),
+        ("likes", Like.objects.filter(tweet__in=tweets), (), None),
+        ("tweets", tweets, ("user_id",), _remove_archived),
+    ]
+    deleted, finished = run_steps(steps, batch_size, time_limit)
+    counters.buffer.flush_on_commit()
+    return deleted, finished
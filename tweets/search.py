@@ -0,0 +1,132 @@
+import base64
+import unicodedata
+
+from django.conf import settings
+from django.db import connection
+
+from mysite.pagination import CursorPage, CursorPaginator, InvalidCursor
+
+from .models import Tweet
+
+TABLE = "tweets_search"
+
+
+def tokenize(text):
+    # 英数字の連続は単語のまま、それ以外（日本語など分かち書きされない文字）は文字 bigram に分割する。
+    # 末尾の 1 文字はどの bigram の先頭にもならないので、1 文字の検索語で見つかるよう単独でも入れる
+    text = unicodedata.normalize("NFKC", text).lower()
+    tokens = []
+    run = []
+
+    def flush():
+        tokens.extend(a + b for a, b in zip(run, run[1:]))
+        if run:
+            tokens.append(run[-1])
+        run.clear()
+
+    word = []
+    for char in text + " ":
+        if char.isascii() and char.isalnum():
+            flush()
+            word.append(char)
+            continue
+        if word:
+            tokens.append("".join(word))
+            word.clear()
+        if char.isalnum():
+            run.append(char)
+        else:
+            flush()
+    return tokens
+
+
+def is_available():
+    return connection.vendor == "sqlite"
+
+
+def index_tweet(tweet_id):
+    tweet = Tweet.objects.filter(pk=tweet_id).values_list("content", flat=True).first()
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE} WHERE rowid = %s", [tweet_id])
+        if tweet is not None:
+            cursor.execute(
+                f"INSERT INTO {TABLE} (rowid, tokens) VALUES (%s, %s)", [tweet_id, " ".join(tokenize(tweet))]
+            )
+
+
+def remove_tweets(tweet_ids):
+    if tweet_ids:
+        placeholders = ", ".join(["%s"] * len(tweet_ids))
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TABLE} WHERE rowid IN ({placeholders})", list(tweet_ids))
+
+
+def rebuild_index(batch_size=1000):
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABLE}")
+        rows = Tweet.objects.order_by("pk").values_list("pk", "content")
+        batch = []
+        for pk, content in rows.iterator(chunk_size=batch_size):
+            batch.append((pk, " ".join(tokenize(content))))
+            if len(batch) >= batch_size:
+                cursor.executemany(f"INSERT INTO {TABLE} (rowid, tokens) VALUES (%s, %s)", batch)
+                batch = []
+        if batch:
+            cursor.executemany(f"INSERT INTO {TABLE} (rowid, tokens) VALUES (%s, %s)", batch)
+
+
+def _match_expression(query):
+    terms = []
+    for token in dict.fromkeys(tokenize(query)):
+        term = '"{}"'.format(token.replace('"', '""'))
+        # 1 文字だけの検索語は、その文字で始まる bigram と末尾の 1 文字に前方一致させる
+        terms.append(term + "*" if len(token) == 1 and not token.isascii() else term)
+    return " AND ".join(terms)
+
+
+def _encode(score, pk):
+    return base64.urlsafe_b64encode(f"{score!r}|{pk}".encode()).decode().rstrip("=")
+
+
+def _decode(cursor):
+    try:
+        score, pk = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split("|")
+        return float(score), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        raise InvalidCursor("不正なカーソルです。")
+
+
+def search_tweets(query, cursor=None, per_page=None):
+    per_page = per_page or settings.TIMELINE_PAGE_SIZE
+    expression = _match_expression(query)
+    if not expression:
+        return CursorPage([])
+    if not is_available():
+        # FTS5 が使えない DB では部分一致・新着順で代用する
+        queryset = Tweet.objects.filter(content__icontains=query).select_related("user")
+        return CursorPaginator(queryset, per_page).page(cursor)
+
+    # bm25 は小さいほど関連度が高い。(score, rowid) の組でキーセットページングする
+    sql = f"SELECT rowid, bm25({TABLE}) AS score FROM {TABLE} WHERE {TABLE} MATCH %s"
+    params = [expression]
+    if cursor:
+        score, pk = _decode(cursor)
+        sql = f"SELECT rowid, score FROM ({sql}) WHERE score > %s OR (score = %s AND rowid < %s)"
+        params += [score, score, pk]
+    sql += " ORDER BY score, rowid DESC LIMIT %s"
+    params.append(per_page + 1)
+    with connection.cursor() as db_cursor:
+        db_cursor.execute(sql, params)
+        ranked = db_cursor.fetchall()
+
+    tweets = Tweet.objects.select_related("user").in_bulk([pk for pk, score in ranked])
+    results = []
+    for pk, score in ranked:
+        if pk in tweets:
+            tweets[pk].search_score = score
+            results.append(tweets[pk])
+    page = CursorPage(results[:per_page])
+    if len(ranked) > per_page:
+        pk, score = ranked[per_page - 1]
+        page.next_cursor = _encode(score, pk)
+    return page
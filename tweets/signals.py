@@ -0,0 +1,117 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.signals import request_finished
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from accounts.models import FriendShip
+from mysite import counters
+from mysite.conditional import bump_version
+
+from . import search
+from .models import Like, Tweet
+from .tasks import fan_out, index_search, purge_tweet, purge_user, sync_timeline
+from .templatetags.tweet_tags import fragment_key
+from .timeline import invalidate_celebrity_tweets
+
+User = get_user_model()
+
+request_finished.connect(counters.buffer.flush_if_due, dispatch_uid="flush_counters")
+
+
+@receiver(pre_save, sender=Tweet)
+def bump_version_on_edit(sender, instance, raw, **kwargs):
+    if instance.pk and not raw and not instance._state.adding:
+        caches[settings.TWEET_FRAGMENT_CACHE].delete(
+            fragment_key(instance.pk, instance.version, instance.user.username)
+        )
+        instance.version += 1
+
+
+@receiver(post_delete, sender=Tweet)
+def invalidate_caches_on_delete(sender, instance, **kwargs):
+    caches[settings.TWEET_FRAGMENT_CACHE].delete(fragment_key(instance.pk, instance.version, instance.user.username))
+    invalidate_celebrity_tweets(instance.user_id)
+
+
+@receiver(post_save, sender=Tweet)
+def fan_out_on_create(sender, instance, created, **kwargs):
+    if created:
+        fan_out.enqueue(tweet_id=instance.pk)
+        counters.buffer.incr(User, instance.user_id, "tweet_count")
+
+
+@receiver(post_delete, sender=Tweet)
+def decr_tweet_count(sender, instance, **kwargs):
+    # 論理削除した時点で減らしてある
+    if not instance.is_deleted:
+        counters.buffer.decr(User, instance.user_id, "tweet_count")
+
+
+def is_soft_delete(instance, update_fields):
+    return instance.is_deleted and update_fields is not None and "is_deleted" in update_fields
+
+
+@receiver(post_save, sender=Tweet)
+def purge_on_soft_delete(sender, instance, update_fields, **kwargs):
+    # ツイートはフラグで隠れるので、ここでは数と有名ユーザーのキャッシュだけ直し、関連行はタスクで消す
+    if is_soft_delete(instance, update_fields):
+        counters.buffer.decr(User, instance.user_id, "tweet_count")
+        invalidate_celebrity_tweets(instance.user_id)
+        purge_tweet.enqueue(tweet_id=instance.pk)
+
+
+@receiver(post_save, sender=User)
+def purge_on_account_delete(sender, instance, update_fields, **kwargs):
+    # ツイートを隠すのも含めて、行数の読めない処理はすべてタスクで少しずつ行う（tweets.purge.purge_user）
+    if is_soft_delete(instance, update_fields):
+        invalidate_celebrity_tweets(instance.pk)
+        purge_user.enqueue(user_id=instance.pk)
+
+
+@receiver(post_save, sender=Like)
+def incr_like_count(sender, instance, created, **kwargs):
+    if created:
+        counters.buffer.incr(Tweet, instance.tweet_id, "like_count")
+
+
+@receiver(post_delete, sender=Like)
+def decr_like_count(sender, instance, **kwargs):
+    counters.buffer.decr(Tweet, instance.tweet_id, "like_count")
+
+
+@receiver(post_save, sender=FriendShip)
+def backfill_on_follow(sender, instance, created, **kwargs):
+    if created:
+        sync_timeline.enqueue(follower_id=instance.follower_id, following_id=instance.following_id)
+
+
+@receiver(post_delete, sender=FriendShip)
+def remove_on_unfollow(sender, instance, **kwargs):
+    sync_timeline.enqueue(follower_id=instance.follower_id, following_id=instance.following_id)
+
+
+@receiver(post_save, sender=Tweet)
+def index_on_save(sender, instance, **kwargs):
+    if search.is_available():
+        index_search.enqueue(tweet_id=instance.pk)
+
+
+@receiver(post_delete, sender=Tweet)
+def unindex_on_delete(sender, instance, **kwargs):
+    if search.is_available():
+        index_search.enqueue(tweet_id=instance.pk)
+
+
+@receiver(post_save, sender=Tweet)
+@receiver(post_delete, sender=Tweet)
+def bump_author_version(sender, instance, created=False, **kwargs):
+    # 削除は invalidate_celebrity_tweets で、編集はここで全員のホームの ETag を変える
+    bump_version(f"user:{instance.user_id}", *([] if created else ["timeline"]))
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+def bump_liker_version(sender, instance, **kwargs):
+    bump_version(f"user:{instance.user_id}")
@@ -0,0 +1,65 @@
+import logging
+
+from accounts.models import FriendShip
+from tasks.queue import task
+
+from . import purge, search
+from .models import Tweet
+from .timeline import backfill_timeline, fan_out_tweets, remove_from_timeline
+
+logger = logging.getLogger("tasks")
+
+
+@task(name="tweets.fan_out", batch=True)
+def fan_out(payloads):
+    # 実行までに削除されたツイートは配信しない
+    tweets = Tweet.objects.filter(pk__in={payload["tweet_id"] for payload in payloads})
+    fan_out_tweets(list(tweets))
+
+
+@task(name="tweets.sync_timeline", batch=True)
+def sync_timeline(payloads):
+    # フォロー・フォロー解除のどちらで積まれたかではなく、実行時点の関係に合わせる。
+    # 順番が入れ替わったり、同じ組が何度積まれたりしても結果は同じになる
+    pairs = {(payload["follower_id"], payload["following_id"]) for payload in payloads}
+    following = set(
+        FriendShip.objects.filter(follower_id__in={follower_id for follower_id, _ in pairs})
+        .filter(following_id__in={following_id for _, following_id in pairs})
+        .values_list("follower_id", "following_id")
+    )
+    for follower_id, following_id in pairs:
+        if (follower_id, following_id) in following:
+            backfill_timeline(follower_id, following_id)
+        else:
+            remove_from_timeline(follower_id, following_id)
+
+
+@task(name="tweets.index_search", batch=True)
+def index_search(payloads):
+    # index_tweet は削除済みのツイートをインデックスから消すだけなので、追加・更新・削除を区別しない
+    for tweet_id in {payload["tweet_id"] for payload in payloads}:
+        search.index_tweet(tweet_id)
+
+
+def log_purge_progress(label, pk, deleted, finished):
+    counts = ", ".join(f"{name} {count}" for name, count in deleted.items())
+    logger.info(
+        "%s %s の関連行を削除しました（%s）%s", label, pk, counts, "" if finished else "。続きは次のタスクで消します"
+    )
+
+
+@task(name="tweets.purge_tweet")
+def purge_tweet(tweet_id):
+    # PURGE_TIME_LIMIT 秒で消しきれなければ自分を積み直す。1 回ごとに別のトランザクションになる
+    deleted, finished = purge.purge_tweet(tweet_id)
+    log_purge_progress("ツイート", tweet_id, deleted, finished)
+    if not finished:
+        purge_tweet.enqueue(tweet_id=tweet_id)
+
+
+@task(name="tweets.purge_user")
+def purge_user(user_id):
+    deleted, finished = purge.purge_user(user_id)
+    log_purge_progress("ユーザー", user_id, deleted, finished)
+    if not finished:
+        purge_user.enqueue(user_id=user_id)
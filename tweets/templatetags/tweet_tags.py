@@ -0,0 +1,27 @@
+from django import template
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from mysite.instrumentation import record_cache_access
+
+register = template.Library()
+
+
+def fragment_key(tweet_id, version, username):
+    # 断片には投稿者名とプロフィールへのリンクも入るので、ユーザー名が変わったら別のキーにする
+    return f"tweet-fragment:{tweet_id}:{version}:{username}"
+
+
+@register.simple_tag
+def tweet_body(tweet):
+    # いいねボタンなど閲覧者ごとに変わる部分はキャッシュに含めない
+    cache = caches[settings.TWEET_FRAGMENT_CACHE]
+    key = fragment_key(tweet.pk, tweet.version, tweet.user.username)
+    html = cache.get(key)
+    record_cache_access(hit=html is not None)
+    if html is None:
+        html = render_to_string("tweets/_tweet_body.html", {"tweet": tweet})
+        cache.set(key, html, settings.TWEET_FRAGMENT_TIMEOUT)
+    return mark_safe(html)
@@ -1,6 +1,35 @@
+import gzip
+import json
+import threading
+import unittest
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import FriendShip
+from mysite import counters
+from tasks.models import Task
+
+from . import archive, purge
+from .dataset import import_follows, import_users, read_records
+from .models import Like, TimelineEntry, Tweet
+from .search import tokenize
+from .templatetags.tweet_tags import fragment_key
+from .timeline import get_home_timeline
+from .viewer_state import attach_viewer_state
 
 User = get_user_model()
 
@@ -15,6 +44,326 @@ class TestHomeView(TestCase):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 200)
 
+    async def test_success_get_with_async_client(self):
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "tweets/home.html")
+
+    def test_failure_get_with_anonymous_user(self):
+        self.client.logout()
+        response = self.client.get(self.url)
+        self.assertRedirects(response, f"{reverse('accounts:login')}?next={self.url}")
+
+    def test_success_get_with_following_tweets(self):
+        author = User.objects.create_user(username="author", password="testpassword")
+        FriendShip.objects.create(follower=self.user, following=author)
+        tweet = Tweet.objects.create(user=author, content="hello")
+
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context["tweet_list"]), [tweet])
+
+    @override_settings(TIMELINE_PAGE_SIZE=2)
+    def test_success_get_with_cursor(self):
+        tweets = [Tweet.objects.create(user=self.user, content=f"tweet{i}") for i in range(3)]
+
+        response = self.client.get(self.url)
+        page = response.context["page_obj"]
+        self.assertEqual(page.object_list, [tweets[2], tweets[1]])
+        self.assertTrue(page.has_next)
+
+        response = self.client.get(self.url, {"cursor": page.next_cursor})
+        page = response.context["page_obj"]
+        self.assertEqual(page.object_list, [tweets[0]])
+        self.assertFalse(page.has_next)
+
+    def test_failure_get_with_invalid_cursor(self):
+        response = self.client.get(self.url, {"cursor": "invalid"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_not_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.assertTrue(etag.startswith("W/"))
+        with self.assertTemplateNotUsed("tweets/home.html"):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(WEB_CONCURRENCY=2)
+    def test_no_etag_when_versions_are_process_local(self):
+        self.assertNotIn("ETag", self.client.get(self.url))
+
+    def test_etag_changes_on_new_tweet_and_like(self):
+        author = User.objects.create_user(username="author", password="testpassword")
+        FriendShip.objects.create(follower=self.user, following=author)
+        etag = self.client.get(self.url)["ETag"]
+        tweet = Tweet.objects.create(user=author, content="hello")
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        Like.objects.create(user=self.user, tweet=tweet)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200)
+
+
+class TestHomeUpdatesView(TestCase):
+    def setUp(self):
+        caches[settings.TIMELINE_CACHE].clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.author = User.objects.create_user(username="author", password="testpassword")
+        FriendShip.objects.create(follower=self.user, following=self.author)
+        self.client.force_login(self.user)
+        self.url = reverse("tweets:home_updates")
+
+    def test_success_get_with_since_id(self):
+        old = Tweet.objects.create(user=self.author, content="old")
+        new = Tweet.objects.create(user=self.author, content="new")
+
+        response = self.client.get(self.url, {"since_id": old.id})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["count"], 1)
+        self.assertEqual(data["latest_id"], new.id)
+        self.assertEqual([tweet["id"] for tweet in data["tweets"]], [new.id])
+        self.assertEqual(data["tweets"][0]["username"], "author")
+
+    def test_success_get_without_updates(self):
+        tweet = Tweet.objects.create(user=self.author, content="hello")
+        data = self.client.get(self.url, {"since_id": tweet.id}).json()
+        self.assertEqual(data, {"count": 0, "latest_id": tweet.id, "tweets": []})
+
+    def test_success_get_count_only(self):
+        tweets = [Tweet.objects.create(user=self.author, content=f"tweet{i}") for i in range(3)]
+        data = self.client.get(self.url, {"since_id": tweets[0].id, "count": 1}).json()
+        self.assertEqual(data, {"count": 2, "latest_id": tweets[2].id})
+
+    @override_settings(TIMELINE_FANOUT_THRESHOLD=1)
+    def test_success_get_with_celebrity_tweets(self):
+        counters.buffer.flush()
+        tweet = Tweet.objects.create(user=self.author, content="hello")
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user, tweet=tweet).exists())
+        data = self.client.get(self.url, {"since_id": 0, "count": 1}).json()
+        self.assertEqual(data, {"count": 1, "latest_id": tweet.id})
+
+    def test_failure_get_with_invalid_since_id(self):
+        response = self.client.get(self.url, {"since_id": "invalid"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_failure_get_with_anonymous_user(self):
+        self.client.logout()
+        response = self.client.get(self.url)
+        self.assertRedirects(response, f"{reverse('accounts:login')}?next={self.url}")
+
+    @override_settings(TIMELINE_POLL_INTERVAL=0.01, TIMELINE_POLL_TIMEOUT=0.05)
+    def test_long_polling_returns_after_timeout(self):
+        tweet = Tweet.objects.create(user=self.author, content="hello")
+        data = self.client.get(self.url, {"since_id": tweet.id, "wait": 10, "count": 1}).json()
+        self.assertEqual(data, {"count": 0, "latest_id": tweet.id})
+
+    @override_settings(TIMELINE_POLL_INTERVAL=0.01, TIMELINE_STREAM_TIMEOUT=0.05)
+    async def test_event_stream(self):
+        tweet = await Tweet.objects.acreate(user=self.author, content="hello")
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get(
+            self.url, headers={"Accept": "text/event-stream", "Last-Event-ID": str(tweet.id - 1)}
+        )
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        events = [chunk async for chunk in response.streaming_content]
+        self.assertTrue(events[0].startswith(b"retry: "))
+        self.assertEqual(
+            events[1], f'id: {tweet.id}\nevent: tweets\ndata: {{"count": 1, "latest_id": {tweet.id}}}\n\n'.encode()
+        )
+        self.assertEqual(events[2], b": keep-alive\n\n")
+
+
+class TestViewerState(TestCase):
+    def setUp(self):
+        caches[settings.FOLLOW_GRAPH_CACHE].clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+
+    def create_tweets(self, n):
+        start = User.objects.count()
+        for i in range(start, start + n):
+            author = User.objects.create_user(username=f"author{i}", password="testpassword")
+            FriendShip.objects.create(follower=self.user, following=author)
+            tweet = Tweet.objects.create(user=author, content="hello")
+            Like.objects.create(user=self.user, tweet=tweet)
+
+    def count_queries(self, url):
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_attach_viewer_state(self):
+        self.create_tweets(2)
+        unliked = Tweet.objects.create(user=self.user, content="mine")
+        tweets = list(Tweet.objects.select_related("user"))
+        attach_viewer_state(tweets, self.user)
+        # 2 回目以降はフォロー中の id 配列をキャッシュから読む
+        with self.assertNumQueries(1):
+            tweets = attach_viewer_state(tweets, self.user)
+        for tweet in tweets:
+            self.assertEqual(tweet.liked_by_viewer, tweet != unliked)
+            self.assertEqual(tweet.user_followed_by_viewer, tweet != unliked)
+
+    def test_home_query_count_does_not_grow(self):
+        self.create_tweets(1)
+        expected = self.count_queries(reverse("tweets:home"))
+        self.create_tweets(5)
+        self.assertEqual(self.count_queries(reverse("tweets:home")), expected)
+
+    def test_profile_query_count_does_not_grow(self):
+        url = reverse("accounts:user_profile", kwargs={"username": self.user.username})
+        Tweet.objects.create(user=self.user, content="hello")
+        expected = self.count_queries(url)
+        for i in range(5):
+            Tweet.objects.create(user=self.user, content="hello")
+        self.assertEqual(self.count_queries(url), expected)
+
+
+class TestTweetFragmentCache(TestCase):
+    def setUp(self):
+        self.cache = caches[settings.TWEET_FRAGMENT_CACHE]
+        self.cache.clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        self.tweet = Tweet.objects.create(user=self.user, content="hello")
+
+    def test_fragment_is_cached_without_viewer_state(self):
+        Like.objects.create(user=self.user, tweet=self.tweet)
+        response = self.client.get(reverse("tweets:home"))
+        self.assertContains(response, "いいね解除")
+
+        html = self.cache.get(fragment_key(self.tweet.pk, self.tweet.version, self.user.username))
+        self.assertIn("hello", html)
+        self.assertNotIn("いいね", html)
+
+    def test_version_is_bumped_on_edit(self):
+        self.client.get(reverse("tweets:home"))
+        self.tweet.content = "edited"
+        self.tweet.save()
+
+        self.assertEqual(self.tweet.version, 2)
+        self.assertIsNone(self.cache.get(fragment_key(self.tweet.pk, 1, self.user.username)))
+        self.assertContains(self.client.get(reverse("tweets:home")), "edited")
+
+    def test_fragment_is_invalidated_on_delete(self):
+        self.client.get(reverse("tweets:home"))
+        key = fragment_key(self.tweet.pk, self.tweet.version, self.user.username)
+        self.tweet.delete()
+        self.assertIsNone(self.cache.get(key))
+
+    def test_fragment_is_not_reused_after_rename(self):
+        self.client.get(reverse("tweets:home"))
+        self.user.username = "renamed"
+        self.user.save()
+
+        response = self.client.get(reverse("tweets:home"))
+        self.assertContains(response, reverse("accounts:user_profile", kwargs={"username": "renamed"}))
+        self.assertNotContains(response, reverse("accounts:user_profile", kwargs={"username": "testuser"}))
+
+
+class TestSearchView(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        self.url = reverse("tweets:search")
+
+    def create_tweet(self, content):
+        return Tweet.objects.create(user=self.user, content=content)
+
+    def test_tokenize(self):
+        self.assertEqual(tokenize("東京タワー Hello"), ["東京", "京タ", "タワ", "ワー", "ー", "hello"])
+
+    def test_success_get_with_japanese_query(self):
+        tower = self.create_tweet("東京タワーに行きました")
+        self.create_tweet("京都タワーに行きました")
+
+        response = self.client.get(self.url, {"q": "東京"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context["tweet_list"]), [tower])
+
+    def test_success_get_with_last_character(self):
+        world = self.create_tweet("こんにちは世界")
+        response = self.client.get(self.url, {"q": "界"})
+        self.assertEqual(list(response.context["tweet_list"]), [world])
+
+    def test_results_are_ranked(self):
+        once = self.create_tweet("東京に行きました")
+        twice = self.create_tweet("東京 東京 東京")
+        response = self.client.get(self.url, {"q": "東京"})
+        self.assertEqual(list(response.context["tweet_list"]), [twice, once])
+
+    @override_settings(TIMELINE_PAGE_SIZE=1)
+    def test_success_get_with_cursor(self):
+        tweets = {self.create_tweet("東京"), self.create_tweet("東京")}
+        response = self.client.get(self.url, {"q": "東京"})
+        first = response.context["tweet_list"]
+        response = self.client.get(self.url, {"q": "東京", "cursor": response.context["page_obj"].next_cursor})
+        self.assertEqual(set(first + response.context["tweet_list"]), tweets)
+        self.assertFalse(response.context["page_obj"].has_next)
+
+    def test_index_is_updated_on_edit_and_delete(self):
+        tweet = self.create_tweet("東京")
+        tweet.content = "大阪"
+        tweet.save()
+        self.assertEqual(list(self.client.get(self.url, {"q": "東京"}).context["tweet_list"]), [])
+        self.assertEqual(list(self.client.get(self.url, {"q": "大阪"}).context["tweet_list"]), [tweet])
+
+        tweet.delete()
+        self.assertEqual(list(self.client.get(self.url, {"q": "大阪"}).context["tweet_list"]), [])
+
+
+class TestHomeTimeline(TestCase):
+    def setUp(self):
+        caches[settings.TIMELINE_CACHE].clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.author = User.objects.create_user(username="author", password="testpassword")
+        FriendShip.objects.create(follower=self.user, following=self.author)
+
+    def test_fan_out_on_write(self):
+        tweet = Tweet.objects.create(user=self.author, content="hello")
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.user, tweet=tweet).exists())
+        self.assertTrue(TimelineEntry.objects.filter(owner=self.author, tweet=tweet).exists())
+        self.assertEqual(get_home_timeline(self.user).object_list, [tweet])
+
+    def test_timeline_is_ordered_by_newest(self):
+        first = Tweet.objects.create(user=self.author, content="first")
+        second = Tweet.objects.create(user=self.user, content="second")
+        self.assertEqual(get_home_timeline(self.user).object_list, [second, first])
+
+    @override_settings(TIMELINE_FANOUT_THRESHOLD=1)
+    def test_fan_out_on_read_for_celebrity(self):
+        counters.buffer.flush()
+        tweet = Tweet.objects.create(user=self.author, content="hello")
+        self.assertFalse(TimelineEntry.objects.filter(owner=self.user, tweet=tweet).exists())
+        self.assertEqual(get_home_timeline(self.user).object_list, [tweet])
+
+        newer = Tweet.objects.create(user=self.author, content="newer")
+        self.assertEqual(get_home_timeline(self.user).object_list, [newer, tweet])
+
+    @override_settings(TIMELINE_FANOUT_THRESHOLD=1)
+    def test_celebrity_tweets_are_invalidated_for_any_page_size(self):
+        counters.buffer.flush()
+        tweet = Tweet.objects.create(user=self.author, content="hello")
+        self.assertEqual(get_home_timeline(self.user, per_page=5).object_list, [tweet])
+
+        newer = Tweet.objects.create(user=self.author, content="newer")
+        self.assertEqual(get_home_timeline(self.user, per_page=5).object_list, [newer, tweet])
+
+    def test_backfill_on_follow(self):
+        other = User.objects.create_user(username="other", password="testpassword")
+        tweet = Tweet.objects.create(user=other, content="hello")
+        FriendShip.objects.create(follower=self.user, following=other)
+        self.assertEqual(get_home_timeline(self.user).object_list, [tweet])
+
+    def test_remove_on_unfollow(self):
+        Tweet.objects.create(user=self.author, content="hello")
+        FriendShip.objects.filter(follower=self.user, following=self.author).delete()
+        self.assertEqual(get_home_timeline(self.user).object_list, [])
+
 
 # class TestTweetCreateView(TestCase):
 #     def test_success_get(self):
@@ -26,30 +375,487 @@ class TestHomeView(TestCase):
 #     def test_failure_post_with_too_long_content(self):
 
 
-# class TestTweetDetailView(TestCase):
-#     def test_success_get(self):
+class TestTweetDetailView(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        self.tweet = Tweet.objects.create(user=self.user, content="hello")
 
+    def test_success_get(self):
+        Like.objects.create(user=self.user, tweet=self.tweet)
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": self.tweet.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context["tweet"], self.tweet)
+        self.assertTrue(response.context["tweet"].liked_by_viewer)
 
-# class TestTweetDeleteView(TestCase):
-#     def test_success_post(self):
 
-#     def test_failure_post_with_not_exist_tweet(self):
+class TestTweetDeleteView(TestCase):
+    def setUp(self):
+        counters.buffer.clear()
+        caches[settings.TIMELINE_CACHE].clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.other = User.objects.create_user(username="other", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        FriendShip.objects.create(follower=self.other, following=self.user)
+        self.tweet = Tweet.objects.create(user=self.user, content="hello")
+        Like.objects.create(user=self.other, tweet=self.tweet)
 
-#     def test_failure_post_with_incorrect_user(self):
+    def test_success_post(self):
+        response = self.client.post(reverse("tweets:delete", kwargs={"pk": self.tweet.pk}))
+        self.assertRedirects(response, reverse("tweets:home"))
+        # テストでは purge_tweet タスクもその場で実行される
+        self.assertFalse(Tweet.all_objects.filter(pk=self.tweet.pk).exists())
+        self.assertFalse(Like.objects.exists())
+        self.assertFalse(TimelineEntry.objects.exists())
+        counters.buffer.flush()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.tweet_count, 0)
 
+    def test_failure_post_with_not_exist_tweet(self):
+        response = self.client.post(reverse("tweets:delete", kwargs={"pk": self.tweet.pk + 1}))
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(Tweet.objects.filter(pk=self.tweet.pk).exists())
+
+    def test_failure_post_with_incorrect_user(self):
+        tweet = Tweet.objects.create(user=self.other, content="other")
+        response = self.client.post(reverse("tweets:delete", kwargs={"pk": tweet.pk}))
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(Tweet.objects.filter(pk=tweet.pk).exists())
 
-# class TestLikeView(TestCase):
-#     def test_success_post(self):
 
-#     def test_failure_post_with_not_exist_tweet(self):
+class TestPurge(TestCase):
+    def setUp(self):
+        counters.buffer.clear()
+        caches[settings.TIMELINE_CACHE].clear()
+        caches[settings.FOLLOW_GRAPH_CACHE].clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.author = User.objects.create_user(username="author", password="testpassword")
+        FriendShip.objects.create(follower=self.user, following=self.author)
+        self.tweet = Tweet.objects.create(user=self.author, content="hello")
+        Like.objects.create(user=self.user, tweet=self.tweet)
 
-#     def test_failure_post_with_liked_tweet(self):
+    def test_soft_deleted_tweet_is_hidden_until_purged(self):
+        with self.settings(TASKS_EAGER=False):
+            self.tweet.soft_delete()
+        self.assertFalse(Tweet.objects.filter(pk=self.tweet.pk).exists())
+        self.assertEqual(get_home_timeline(self.user).object_list, [])
+        self.assertTrue(Like.objects.exists())
+        self.assertEqual(Task.objects.get(name="tweets.purge_tweet").payload, {"tweet_id": self.tweet.pk})
 
+        deleted, finished = purge.purge_tweet(self.tweet.pk)
+        self.assertTrue(finished)
+        self.assertEqual(deleted, {"timeline_entries": 2, "likes": 1, "tweets": 1})
+        self.assertFalse(Tweet.all_objects.filter(pk=self.tweet.pk).exists())
 
-# class TestUnLikeView(TestCase):
+    def test_purge_stops_at_time_limit(self):
+        with self.settings(TASKS_EAGER=False):
+            self.tweet.soft_delete()
+        runs = 1
+        deleted, finished = purge.purge_tweet(self.tweet.pk, batch_size=1, time_limit=0)
+        self.assertFalse(finished)
+        self.assertEqual(deleted, {"timeline_entries": 1})
+        while not finished:
+            runs += 1
+            deleted, finished = purge.purge_tweet(self.tweet.pk, batch_size=1, time_limit=0)
+        self.assertEqual(runs, 5)
+        self.assertFalse(Tweet.all_objects.exists())
+
+    def test_account_tweets_are_hidden_in_batches(self):
+        Tweet.objects.create(user=self.author, content="second")
+        with self.settings(TASKS_EAGER=False):
+            self.author.soft_delete()
+        self.assertEqual(Tweet.objects.filter(user=self.author).count(), 2)
+
+        deleted, finished = purge.purge_user(self.author.pk, batch_size=1, time_limit=0)
+        self.assertEqual((deleted, finished), ({"hidden_tweets": 1}, False))
+        self.assertEqual(Tweet.objects.filter(user=self.author).count(), 1)
+        while not finished:
+            deleted, finished = purge.purge_user(self.author.pk, batch_size=1, time_limit=0)
+        self.assertFalse(Tweet.all_objects.filter(user=self.author).exists())
+
+    def test_live_tweet_is_not_purged(self):
+        deleted, finished = purge.purge_tweet(self.tweet.pk)
+        self.assertEqual(deleted, {})
+        self.assertTrue(Like.objects.exists())
+
+    def test_partial_index_is_used(self):
+        queries = [
+            (Tweet.objects.filter(user=self.author), "tweet_user_created_idx"),
+            (Tweet.all_objects.filter(is_deleted=True).order_by("deleted_at"), "tweet_deleted_idx"),
+        ]
+        for queryset, index in queries:
+            sql, params = queryset.query.sql_with_params()
+            plan = connection.cursor().execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+            self.assertIn(index, str(plan))
+
+    def test_purge_user(self):
+        own = Tweet.objects.create(user=self.user, content="own")
+        Like.objects.create(user=self.author, tweet=own)
+        FriendShip.objects.create(follower=self.author, following=self.user)
+        self.author.soft_delete()
+        counters.buffer.flush()
+
+        self.assertFalse(User.all_objects.filter(pk=self.author.pk).exists())
+        self.assertFalse(Tweet.all_objects.filter(user=self.author).exists())
+        self.assertEqual(list(TimelineEntry.objects.values_list("tweet_id", flat=True)), [own.pk])
+        self.assertEqual(list(Like.objects.all()), [])
+        self.assertFalse(FriendShip.objects.exists())
+        own.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(own.like_count, 0)
+        self.assertEqual(self.user.follower_count, 0)
+        self.assertEqual(self.user.following_count, 0)
+
+    def test_purge_deleted_command(self):
+        with self.settings(TASKS_EAGER=False):
+            self.tweet.soft_delete()
+        out = StringIO()
+        call_command("purge_deleted", batch_size=1, stdout=out)
+        self.assertFalse(Tweet.all_objects.exists())
+        self.assertIn(f"ツイート {self.tweet.pk}: timeline_entries 2, likes 1, tweets 1\n", out.getvalue())
+
+
+class TestLikeView(TestCase):
+    def setUp(self):
+        counters.buffer.clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        self.tweet = Tweet.objects.create(user=self.user, content="hello")
+        self.url = reverse("tweets:like", kwargs={"pk": self.tweet.pk})
+
+    def test_success_post(self):
+        response = self.client.post(self.url, HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"liked": True, "like_count": 1})
+        self.assertTrue(Like.objects.filter(user=self.user, tweet=self.tweet).exists())
+
+    def test_form_post_redirects_back(self):
+        home = reverse("tweets:home")
+        response = self.client.post(self.url, HTTP_REFERER=f"http://testserver{home}")
+        self.assertRedirects(response, f"http://testserver{home}", fetch_redirect_response=False)
+        self.assertTrue(Like.objects.filter(user=self.user, tweet=self.tweet).exists())
+        # 他のサイトの Referer には戻さず、ツイートのページに戻す
+        response = self.client.post(self.url, HTTP_REFERER="https://example.com/")
+        self.assertRedirects(
+            response, reverse("tweets:detail", kwargs={"pk": self.tweet.pk}), fetch_redirect_response=False
+        )
+
+    def test_failure_post_with_not_exist_tweet(self):
+        response = self.client.post(reverse("tweets:like", kwargs={"pk": self.tweet.pk + 1}))
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Like.objects.exists())
+
+    def test_failure_post_with_liked_tweet(self):
+        Like.objects.create(user=self.user, tweet=self.tweet)
+        response = self.client.post(self.url, HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Like.objects.filter(user=self.user, tweet=self.tweet).count(), 1)
+        self.assertEqual(response.json()["like_count"], 1)
+
+
+class TestUnLikeView(TestCase):
+    def setUp(self):
+        counters.buffer.clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        self.tweet = Tweet.objects.create(user=self.user, content="hello")
+        self.url = reverse("tweets:unlike", kwargs={"pk": self.tweet.pk})
+
+    def test_success_post(self):
+        Like.objects.create(user=self.user, tweet=self.tweet)
+        response = self.client.post(self.url, HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"liked": False, "like_count": 0})
+        self.assertFalse(Like.objects.filter(user=self.user, tweet=self.tweet).exists())
+
+    def test_form_post_redirects_back(self):
+        Like.objects.create(user=self.user, tweet=self.tweet)
+        response = self.client.post(self.url)
+        self.assertRedirects(
+            response, reverse("tweets:detail", kwargs={"pk": self.tweet.pk}), fetch_redirect_response=False
+        )
+        self.assertFalse(Like.objects.filter(user=self.user, tweet=self.tweet).exists())
+
+    def test_failure_post_with_not_exist_tweet(self):
+        response = self.client.post(reverse("tweets:unlike", kwargs={"pk": self.tweet.pk + 1}))
+        self.assertEqual(response.status_code, 404)
+
+    def test_failure_post_with_unliked_tweet(self):
+        response = self.client.post(self.url, HTTP_ACCEPT="application/json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["like_count"], 0)
 
-#     def test_success_post(self):
 
-#     def test_failure_post_with_not_exist_tweet(self):
+@override_settings(COUNTER_FLUSH_SIZE=100, COUNTER_FLUSH_INTERVAL=60)
+class TestCounters(TestCase):
+    def setUp(self):
+        counters.buffer.clear()
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.other = User.objects.create_user(username="other", password="testpassword")
+
+    def test_counts_are_buffered_until_flush(self):
+        tweet = Tweet.objects.create(user=self.user, content="hello")
+        Like.objects.create(user=self.other, tweet=tweet)
+        FriendShip.objects.create(follower=self.other, following=self.user)
+        self.assertEqual(Tweet.objects.get(pk=tweet.pk).like_count, 0)
+
+        counters.buffer.flush()
+        tweet.refresh_from_db()
+        self.user.refresh_from_db()
+        self.other.refresh_from_db()
+        self.assertEqual(tweet.like_count, 1)
+        self.assertEqual(self.user.tweet_count, 1)
+        self.assertEqual(self.user.follower_count, 1)
+        self.assertEqual(self.other.following_count, 1)
+
+    def test_flush_batches_updates(self):
+        tweets = [Tweet.objects.create(user=self.user, content=f"tweet{i}") for i in range(3)]
+        for tweet in tweets:
+            Like.objects.create(user=self.other, tweet=tweet)
+        with CaptureQueriesContext(connection) as context:
+            counters.buffer.flush()
+        updates = [query["sql"] for query in context.captured_queries if query["sql"].startswith("UPDATE")]
+        self.assertEqual(len(updates), 2)
+
+    def test_flush_does_not_go_below_zero(self):
+        tweet = Tweet.objects.create(user=self.user, content="hello")
+        counters.buffer.decr(Tweet, tweet.pk, "like_count")
+        counters.buffer.flush()
+        tweet.refresh_from_db()
+        self.assertEqual(tweet.like_count, 0)
+
+    def test_failed_update_is_kept_for_next_flush(self):
+        missing = mock.Mock(**{"_meta.label": "tweets.Missing"})
+        counters.buffer.incr(missing, 1, "count")
+        Tweet.objects.create(user=self.user, content="hello")
+        with self.assertLogs("mysite.counters", "ERROR"):
+            counters.buffer.flush()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.tweet_count, 1)
+        self.assertEqual(counters.buffer.pending(missing, 1, "count"), 1)
+
+    @override_settings(COUNTER_FLUSH_SIZE=1)
+    def test_flush_waits_for_commit(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            Tweet.objects.create(user=self.user, content="hello")
+            self.assertEqual(User.objects.get(pk=self.user.pk).tweet_count, 0)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(User.objects.get(pk=self.user.pk).tweet_count, 1)
+
+    def test_reconcile_counters(self):
+        tweet = Tweet.objects.create(user=self.user, content="hello")
+        Like.objects.create(user=self.other, tweet=tweet)
+        counters.buffer.flush()
+        Tweet.objects.filter(pk=tweet.pk).update(like_count=10)
+        User.objects.filter(pk=self.user.pk).update(tweet_count=0)
+
+        call_command("reconcile_counters", stdout=StringIO())
+        tweet.refresh_from_db()
+        self.user.refresh_from_db()
+        self.assertEqual(tweet.like_count, 1)
+        self.assertEqual(self.user.tweet_count, 1)
+
+
+@override_settings(TIMELINE_FANOUT_THRESHOLD=20)
+class TestImportData(TestCase):
+    def setUp(self):
+        counters.buffer.clear()
+        self.tmpdir = TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        self.path = Path(self.tmpdir.name)
+
+    def test_generate_and_import(self):
+        call_command("generate_data", self.path, users=50, tweets=300, avg_following=10, seed=1, stdout=StringIO())
+        follows = sum(1 for _ in read_records(self.path / "follows.jsonl"))
+        call_command(
+            "import_data",
+            users=self.path / "users.jsonl",
+            follows=self.path / "follows.jsonl",
+            tweets=self.path / "tweets.jsonl",
+            unusable_passwords=True,
+            stdout=StringIO(),
+        )
+        self.assertEqual(User.objects.count(), 50)
+        self.assertEqual(FriendShip.objects.count(), follows)
+        self.assertEqual(Tweet.objects.count(), 300)
+        self.assertFalse(User.objects.first().has_usable_password())
+
+        # フォロワー数はロングテールになる
+        follower_counts = sorted(User.objects.values_list("follower_count", flat=True))
+        self.assertGreater(follower_counts[-1], follower_counts[len(follower_counts) // 2] * 3)
+
+        # fan-out 対象のユーザーのツイートはフォロワーのタイムラインに入っている
+        relation = FriendShip.objects.filter(following__follower_count__lt=20, following__tweet_count__gt=0).first()
+        tweet = Tweet.objects.filter(user_id=relation.following_id).first()
+        self.assertTrue(TimelineEntry.objects.filter(owner_id=relation.follower_id, tweet=tweet).exists())
+        self.assertIn(tweet, get_home_timeline(relation.follower, per_page=300).object_list)
+
+    def test_import_counts_only_new_rows(self):
+        alice = User.objects.create_user(username="alice", password="testpassword")
+        bob = User.objects.create_user(username="bob", password="testpassword")
+        tweet = Tweet.objects.create(user=bob, content="hello")
+        FriendShip.objects.create(follower=bob, following=alice)
+        users = [{"username": "alice"}, {"username": "bob"}, {"username": "carol"}]
+        self.assertEqual(import_users(users, hash=False), 1)
+
+        follows = [{"follower": "bob", "following": "alice"}, {"follower": "alice", "following": "bob"}]
+        self.assertEqual(import_follows(follows), 1)
+        # シグナルを通さなくても、フォローしたユーザーの過去のツイートがタイムラインに入る
+        self.assertTrue(TimelineEntry.objects.filter(owner=alice, tweet=tweet).exists())
+
+    def test_import_users_from_csv_with_hashed_passwords(self):
+        with open(self.path / "users.csv", "w", encoding="utf-8", newline="") as f:
+            f.write("username,email,password\nalice,alice@example.com,testpassword\nbob,,\n")
+        call_command("import_data", users=self.path / "users.csv", workers=2, stdout=StringIO())
+        self.assertTrue(User.objects.get(username="alice").check_password("testpassword"))
+        self.assertFalse(User.objects.get(username="bob").has_usable_password())
+
+    def test_import_tweets_skips_invalid_rows(self):
+        User.objects.create_user(username="alice", password="testpassword")
+        with open(self.path / "tweets.jsonl", "w", encoding="utf-8") as f:
+            f.write('{"username": "alice", "content": "hello", "created_at": "2020-06-01T12:00:00"}\n')
+            f.write('{"username": "alice", "content": "%s"}\n' % ("a" * 141))
+            f.write('{"username": "nobody", "content": "hello"}\n')
+        out = StringIO()
+        call_command("import_data", tweets=self.path / "tweets.jsonl", stdout=out)
+        tweet = Tweet.objects.get()
+        self.assertEqual(tweet.created_at.year, 2020)
+        self.assertIn("読み飛ばし 2 件", out.getvalue())
+        self.assertEqual(User.objects.get(username="alice").tweet_count, 1)
+
+
+class TestArchive(TestCase):
+    def setUp(self):
+        counters.buffer.clear()
+        tmpdir = TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = Path(tmpdir.name)
+        override = override_settings(TWEET_ARCHIVE_DIR=self.path, TWEET_ARCHIVE_AFTER_DAYS=30)
+        override.enable()
+        self.addCleanup(override.disable)
+
+        self.user = User.objects.create_user(username="testuser", password="testpassword")
+        self.client.login(username="testuser", password="testpassword")
+        now = timezone.localtime()
+        self.old = [
+            Tweet.objects.create(user=self.user, content=f"old{i}", created_at=now - timedelta(days=400 + i))
+            for i in range(3)
+        ]
+        self.older = Tweet.objects.create(user=self.user, content="older", created_at=now - timedelta(days=500))
+        self.recent = Tweet.objects.create(user=self.user, content="recent")
+        Like.objects.create(user=self.user, tweet=self.old[0])
+
+    def test_archive_old_months(self):
+        call_command("archive_tweets", stdout=StringIO())
+        self.assertEqual(list(Tweet.all_objects.all()), [self.recent])
+        self.assertFalse(Like.objects.exists())
+        self.assertEqual(list(TimelineEntry.objects.values_list("tweet_id", flat=True)), [self.recent.pk])
+        counters.buffer.flush()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.tweet_count, 1)
+
+        # 本体は zcat でそのまま JSONL として読める
+        parts = sorted(self.path.glob("*.jsonl.gz"))
+        month = timezone.localtime(self.older.created_at).strftime("%Y-%m")
+        self.assertEqual(parts[0].name, f"tweets-{month}.0.jsonl.gz")
+        with gzip.open(parts[0], "rt", encoding="utf-8") as f:
+            self.assertEqual([json.loads(line)["content"] for line in f], ["older"])
+        for tweet in [*self.old, self.older]:
+            self.assertEqual(archive.get_archive().get(tweet.pk)["content"], tweet.content)
+        self.assertIsNone(archive.get_archive().get(self.recent.pk))
+
+    def test_dry_run(self):
+        out = StringIO()
+        call_command("archive_tweets", dry_run=True, stdout=out)
+        self.assertEqual(Tweet.objects.count(), 5)
+        self.assertEqual(list(self.path.iterdir()), [])
+        self.assertIn("1 件", out.getvalue())
+
+    def test_rerun_writes_new_part_and_skips_archived_tweets(self):
+        call_command("archive_tweets", stdout=StringIO())
+        late = Tweet.objects.create(user=self.user, content="late", created_at=self.older.created_at)
+        call_command("archive_tweets", stdout=StringIO())
+        month = timezone.localtime(self.older.created_at).strftime("%Y-%m")
+        self.assertTrue((self.path / f"tweets-{month}.1.idx").exists())
+        self.assertEqual(archive.get_archive().get(late.pk)["content"], "late")
+        self.assertFalse(Tweet.all_objects.filter(pk=late.pk).exists())
+
+        # 書き出した後に消す前で止まっていた分は、書き直さずに消すだけ
+        remaining = Tweet.objects.create(user=self.user, content="remaining", created_at=self.older.created_at)
+        archive.write_part(self.path, month, [archive.to_record(remaining)])
+        self.assertEqual(
+            archive.archive_month(timezone.localtime(self.older.created_at).replace(day=1)), [remaining.pk]
+        )
+        self.assertFalse((self.path / f"tweets-{month}.3.idx").exists())
+
+    def test_deleted_account_is_removed_from_archive(self):
+        other = User.objects.create_user(username="other", password="testpassword")
+        kept = Tweet.objects.create(user=other, content="kept", created_at=self.older.created_at)
+        call_command("archive_tweets", stdout=StringIO())
+        self.user.soft_delete()
+
+        for tweet in [*self.old, self.older]:
+            self.assertIsNone(archive.get_archive().get(tweet.pk))
+        self.assertEqual(archive.get_archive().get(kept.pk)["content"], "kept")
+        # 他のユーザーのツイートが残らないパートは消える
+        self.assertEqual(len(list(self.path.glob("*.idx"))), 1)
+
+    def test_lookup_across_blocks(self):
+        records = [{**archive.to_record(self.recent), "id": tweet_id} for tweet_id in range(10, 30, 2)]
+        archive.write_part(self.path, "2000-01", records, block_size=3)
+        part = archive.ArchivePart(self.path / "tweets-2000-01.0.idx")
+        self.assertEqual(part.count, 10)
+        for tweet_id in range(8, 32):
+            record = part.find(tweet_id)
+            self.assertEqual(record and record["id"], tweet_id if tweet_id in range(10, 30, 2) else None)
+
+    def test_concurrent_writes_use_separate_parts(self):
+        barrier = threading.Barrier(8)
+        record = archive.to_record(self.recent)
+
+        def write(tweet_id):
+            barrier.wait()
+            archive.write_part(self.path, "2000-01", [{**record, "id": tweet_id}])
+
+        workers = [threading.Thread(target=write, args=[tweet_id]) for tweet_id in range(100, 108)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(len(list(self.path.glob("tweets-2000-01.*.idx"))), 8)
+        for tweet_id in range(100, 108):
+            self.assertEqual(archive.get_archive().get(tweet_id)["id"], tweet_id)
+
+    def test_candidates_by_id_range(self):
+        record = archive.to_record(self.recent)
+        for month, ids in [("2000-01", [10, 20]), ("2000-02", [30, 40]), ("2000-03", [15, 35])]:
+            archive.write_part(self.path, month, [{**record, "id": tweet_id} for tweet_id in ids])
+        tweet_archive = archive.get_archive()
+        tweet_archive.refresh()
+
+        def candidates(tweet_id):
+            return sorted(part.index_path.name for part in tweet_archive.candidates(tweet_id))
+
+        self.assertEqual(candidates(12), ["tweets-2000-01.0.idx"])
+        self.assertEqual(candidates(25), ["tweets-2000-03.0.idx"])
+        self.assertEqual(candidates(32), ["tweets-2000-02.0.idx", "tweets-2000-03.0.idx"])
+        self.assertEqual(candidates(50), [])
+        self.assertIn(35, tweet_archive)
+        self.assertNotIn(36, tweet_archive)
+
+    @unittest.skipUnless(archive.zstandard, "zstandard がインストールされていません")
+    def test_zstd(self):
+        archive.write_part(self.path, "2000-01", [archive.to_record(self.recent)], codec="zstd")
+        self.assertEqual(archive.get_archive().get(self.recent.pk)["content"], "recent")
+
+    def test_detail_view_reads_archive(self):
+        call_command("archive_tweets", stdout=StringIO())
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": self.older.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "older")
+        self.assertContains(response, "アーカイブされたツイートです。")
+        self.assertNotContains(response, reverse("tweets:like", kwargs={"pk": self.older.pk}))
 
-#     def test_failure_post_with_unliked_tweet(self):
+        response = self.client.get(reverse("tweets:detail", kwargs={"pk": self.recent.pk + 1}))
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,163 @@
+import asyncio
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+
+from accounts.models import FriendShip
+from mysite.async_utils import alist
+from mysite.caches import also_on_commit, get_or_set
+from mysite.conditional import bump_version
+from mysite.pagination import CursorPage, decode_cursor, keyset_filter
+
+from .models import TimelineEntry, Tweet
+
+User = get_user_model()
+
+
+def get_celebrity_ids(user_ids):
+    # フォロワー数が閾値以上のユーザーは fan-out せず、読み込み時にツイートを取りにいく
+    celebrities = User.objects.filter(id__in=user_ids, follower_count__gte=settings.TIMELINE_FANOUT_THRESHOLD)
+    return set(celebrities.values_list("id", flat=True))
+
+
+# 有名ユーザーごとにキャッシュする先頭のツイート数。ページの大きさによらず 1 キーにして、消し漏れを作らない
+CELEBRITY_TWEETS_CACHED = 100
+
+
+def celebrity_tweets_key(user_id):
+    return f"celebrity-tweets:{user_id}"
+
+
+def get_celebrity_tweets(user_id, per_page):
+    tweets = Tweet.objects.filter(user_id=user_id).select_related("user")
+    if per_page >= CELEBRITY_TWEETS_CACHED:
+        return list(tweets[: per_page + 1])
+    # 多くのフォロワーが同時に読む先頭ページはキャッシュし、期限切れ時の再計算の集中を避ける
+    cached = get_or_set(
+        celebrity_tweets_key(user_id),
+        lambda: list(tweets[:CELEBRITY_TWEETS_CACHED]),
+        alias=settings.TIMELINE_CACHE,
+    )
+    return cached[: per_page + 1]
+
+
+@also_on_commit
+def invalidate_celebrity_tweets(user_id):
+    caches[settings.TIMELINE_CACHE].delete(celebrity_tweets_key(user_id))
+    # 有名ユーザーのツイートはフォロワーの TimelineEntry に入らないので、ホームの ETag を全員分まとめて変える
+    bump_version("timeline")
+
+
+def is_fan_out_on_read(user_id):
+    return user_id in get_celebrity_ids([user_id])
+
+
+def _bulk_insert(entries):
+    TimelineEntry.objects.bulk_create(entries, batch_size=settings.TIMELINE_FANOUT_BATCH_SIZE, ignore_conflicts=True)
+
+
+def fan_out_tweets(tweets):
+    # 投稿者本人と、有名ユーザー以外の投稿者のフォロワーのタイムラインにまとめて書き込む
+    author_ids = {tweet.user_id for tweet in tweets}
+    celebrity_ids = get_celebrity_ids(author_ids)
+    for user_id in celebrity_ids:
+        invalidate_celebrity_tweets(user_id)
+    pushed = author_ids - celebrity_ids
+    followers = defaultdict(list)
+    relations = FriendShip.objects.filter(following_id__in=pushed).values_list("following_id", "follower_id")
+    for following_id, follower_id in relations.iterator():
+        followers[following_id].append(follower_id)
+
+    entries = []
+    for tweet in tweets:
+        for owner_id in [tweet.user_id, *followers.get(tweet.user_id, [])]:
+            entries.append(TimelineEntry(owner_id=owner_id, tweet_id=tweet.id, created_at=tweet.created_at))
+            if len(entries) >= settings.TIMELINE_FANOUT_BATCH_SIZE:
+                _bulk_insert(entries)
+                entries = []
+    _bulk_insert(entries)
+
+
+def backfill_timeline(follower_id, following_id):
+    if is_fan_out_on_read(following_id):
+        return
+    tweets = Tweet.objects.filter(user_id=following_id)[: settings.TIMELINE_BACKFILL_SIZE]
+    _bulk_insert(
+        [TimelineEntry(owner_id=follower_id, tweet_id=tweet.id, created_at=tweet.created_at) for tweet in tweets]
+    )
+
+
+def remove_from_timeline(follower_id, following_id):
+    TimelineEntry.objects.filter(owner_id=follower_id, tweet__user_id=following_id).delete()
+
+
+def _timeline_entries(user, position, per_page):
+    # 論理削除したツイートの行は purge で消えるまで残っているので、結合したツイートの側で除く
+    entries = TimelineEntry.objects.filter(owner=user, tweet__is_deleted=False).select_related("tweet__user")
+    if position:
+        entries = entries.filter(keyset_filter(("created_at", "tweet_id"), position))
+    return entries.order_by("-created_at", "-tweet_id")[: per_page + 1]
+
+
+def _following_celebrity_ids(user):
+    celebrities = User.objects.filter(
+        follower_relations__follower=user, follower_count__gte=settings.TIMELINE_FANOUT_THRESHOLD
+    )
+    return celebrities.values_list("id", flat=True)
+
+
+def _pulled_tweets(celebrity_ids, position, per_page):
+    if not celebrity_ids:
+        return []
+    if position:
+        pulled = Tweet.objects.filter(user_id__in=celebrity_ids).select_related("user")
+        return list(pulled.filter(keyset_filter(("created_at", "id"), position))[: per_page + 1])
+    return [tweet for user_id in celebrity_ids for tweet in get_celebrity_tweets(user_id, per_page)]
+
+
+def _merge_page(tweets, pulled, per_page):
+    if pulled:
+        merged = {tweet.id: tweet for tweet in tweets}
+        for tweet in pulled:
+            merged.setdefault(tweet.id, tweet)
+        tweets = sorted(merged.values(), key=lambda tweet: (tweet.created_at, tweet.id), reverse=True)
+    return CursorPage.from_items(tweets[: per_page + 1], per_page, key=lambda tweet: (tweet.created_at, tweet.id))
+
+
+def get_home_timeline(user, cursor=None, per_page=None):
+    per_page = per_page or settings.TIMELINE_PAGE_SIZE
+    position = decode_cursor(cursor) if cursor else None
+    tweets = [entry.tweet for entry in _timeline_entries(user, position, per_page)]
+    celebrity_ids = set(_following_celebrity_ids(user))
+    return _merge_page(tweets, _pulled_tweets(celebrity_ids, position, per_page), per_page)
+
+
+def get_new_tweet_ids(user, since_id, limit=None):
+    # since_id より新しいツイートの id を新しい順に返す。ポーリング用なので本文は読まない
+    limit = limit or settings.TIMELINE_POLL_MAX
+    entries = TimelineEntry.objects.filter(owner=user, tweet_id__gt=since_id, tweet__is_deleted=False)
+    entries = entries.order_by("-tweet_id")
+    ids = list(entries.values_list("tweet_id", flat=True)[:limit])
+    for user_id in _following_celebrity_ids(user):
+        ids += [
+            tweet.id for tweet in get_celebrity_tweets(user_id, settings.TIMELINE_PAGE_SIZE) if tweet.id > since_id
+        ]
+    return sorted(set(ids), reverse=True)[:limit]
+
+
+async def aget_home_timeline(user, cursor=None, per_page=None):
+    per_page = per_page or settings.TIMELINE_PAGE_SIZE
+    position = decode_cursor(cursor) if cursor else None
+    entries, celebrity_ids = await asyncio.gather(
+        alist(_timeline_entries(user, position, per_page)),
+        alist(_following_celebrity_ids(user)),
+    )
+    pulled = await sync_to_async(_pulled_tweets)(set(celebrity_ids), position, per_page)
+    return _merge_page([entry.tweet for entry in entries], pulled, per_page)
+
+
+async def aget_new_tweet_ids(user, since_id, limit=None):
+    return await sync_to_async(get_new_tweet_ids)(user, since_id, limit)
@@ -0,0 +1,39 @@
+import asyncio
+
+from asgiref.sync import sync_to_async
+
+from accounts.graph import contains, get_following_ids
+from mysite.async_utils import alist
+
+from .models import Like
+
+
+def _liked_ids(tweets, viewer):
+    return Like.objects.filter(user=viewer, tweet_id__in=[tweet.id for tweet in tweets]).values_list(
+        "tweet_id", flat=True
+    )
+
+
+def _attach(tweets, liked_ids, following_ids):
+    for tweet in tweets:
+        tweet.liked_by_viewer = tweet.id in liked_ids
+        tweet.user_followed_by_viewer = contains(following_ids, tweet.user_id)
+    return tweets
+
+
+def attach_viewer_state(tweets, viewer):
+    # 1 ページ分のツイートに対して「いいね済み」を IN 句 1 回で引き、「フォロー中」はキャッシュした id 配列で判定する
+    tweets = list(tweets)
+    if not (viewer.is_authenticated and tweets):
+        return _attach(tweets, set(), [])
+    return _attach(tweets, set(_liked_ids(tweets, viewer)), get_following_ids(viewer.id))
+
+
+async def aattach_viewer_state(tweets, viewer):
+    tweets = list(tweets)
+    if not (viewer.is_authenticated and tweets):
+        return _attach(tweets, set(), [])
+    liked_ids, following_ids = await asyncio.gather(
+        alist(_liked_ids(tweets, viewer)), sync_to_async(get_following_ids)(viewer.id)
+    )
+    return _attach(tweets, set(liked_ids), following_ids)
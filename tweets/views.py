@@ -1,6 +1,186 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.views.generic import TemplateView
+from django.http import Http404, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, redirect
+from django.urls import reverse
+from django.utils.http import url_has_allowed_host_and_scheme
+from django.views import View
+from django.views.generic import DetailView, TemplateView
+
+from accounts.mixins import AsyncLoginRequiredMixin
+from mysite import counters
+from mysite.conditional import ConditionalGetMixin, get_versions, make_etag
+from mysite.pagination import InvalidCursor
+from mysite.ratelimit import ratelimit
+
+from .archive import get_archived_tweet
+from .models import Like, TimelineEntry, Tweet
+from .search import search_tweets
+from .timeline import aget_home_timeline, aget_new_tweet_ids
+from .viewer_state import aattach_viewer_state, attach_viewer_state
+
+User = get_user_model()
 
 
-class HomeView(LoginRequiredMixin, TemplateView):
+class HomeView(AsyncLoginRequiredMixin, ConditionalGetMixin, TemplateView):
     template_name = "tweets/home.html"
+
+    def get_etag(self, request, *args, **kwargs):
+        # 新着は自分のタイムラインの先頭、いいね・フォローは自分の版、有名ユーザーの投稿と削除は全体の版で検知する
+        latest = TimelineEntry.objects.filter(owner=request.user).order_by("-created_at", "-tweet_id")
+        latest = latest.values_list("tweet_id", flat=True).first()
+        versions = get_versions(f"user:{request.user.pk}", "timeline")
+        return make_etag("home", request.user.pk, latest, *versions, request.GET.get("cursor"))
+
+    async def get(self, request, *args, **kwargs):
+        try:
+            page = await aget_home_timeline(request.user, cursor=request.GET.get("cursor"))
+        except InvalidCursor:
+            raise Http404
+        tweet_list = await aattach_viewer_state(page.object_list, request.user)
+        return self.render_to_response(self.get_context_data(page_obj=page, tweet_list=tweet_list, **kwargs))
+
+
+class HomeUpdatesView(AsyncLoginRequiredMixin, View):
+    # since_id より新しいホームのツイートを JSON で返す。テンプレートは描画しない。
+    # ?count=1 なら件数だけ、?wait=秒 なら新着が来るまで待つ（ロングポーリング）。
+    # Accept: text/event-stream なら新着の件数を Server-Sent Events で送り続ける
+    async def get(self, request, *args, **kwargs):
+        try:
+            since_id = int(request.GET.get("since_id") or request.headers.get("Last-Event-ID") or 0)
+            wait = min(float(request.GET.get("wait") or 0), settings.TIMELINE_POLL_TIMEOUT)
+        except ValueError:
+            return JsonResponse({"error": "since_id と wait は数値で指定してください。"}, status=400)
+
+        if "text/event-stream" in request.headers.get("Accept", ""):
+            response = StreamingHttpResponse(self.stream(request.user, since_id), content_type="text/event-stream")
+            response["Cache-Control"] = "no-cache"
+            return response
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait
+        ids = await aget_new_tweet_ids(request.user, since_id)
+        while not ids and loop.time() < deadline:
+            await asyncio.sleep(min(settings.TIMELINE_POLL_INTERVAL, deadline - loop.time()))
+            ids = await aget_new_tweet_ids(request.user, since_id)
+
+        data = {"count": len(ids), "latest_id": ids[0] if ids else since_id}
+        if "count" not in request.GET:
+            data["tweets"] = await sync_to_async(self.serialize)(ids)
+        return JsonResponse(data)
+
+    @staticmethod
+    def serialize(ids):
+        tweets = Tweet.objects.select_related("user").in_bulk(ids)
+        return [
+            {
+                "id": tweet.id,
+                "username": tweet.user.username,
+                "content": tweet.content,
+                "created_at": tweet.created_at.isoformat(),
+                "like_count": tweet.like_count,
+                "url": reverse("tweets:detail", kwargs={"pk": tweet.id}),
+            }
+            for tweet in map(tweets.get, ids)
+            if tweet is not None
+        ]
+
+    async def stream(self, user, since_id):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + settings.TIMELINE_STREAM_TIMEOUT
+        # 切断後はブラウザが Last-Event-ID を付けて再接続してくるので、そこから続きを送る
+        yield f"retry: {settings.TIMELINE_POLL_INTERVAL * 1000}\n\n"
+        while loop.time() < deadline:
+            ids = await aget_new_tweet_ids(user, since_id)
+            if ids:
+                since_id = ids[0]
+                data = json.dumps({"count": len(ids), "latest_id": since_id})
+                yield f"id: {since_id}\nevent: tweets\ndata: {data}\n\n"
+            else:
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(settings.TIMELINE_POLL_INTERVAL)
+
+
+class SearchView(LoginRequiredMixin, TemplateView):
+    template_name = "tweets/search.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        query = self.request.GET.get("q", "").strip()
+        try:
+            page = search_tweets(query, cursor=self.request.GET.get("cursor"))
+        except InvalidCursor:
+            raise Http404
+        context["query"] = query
+        context["page_obj"] = page
+        context["tweet_list"] = attach_viewer_state(page.object_list, self.request.user)
+        return context
+
+
+class TweetDetailView(LoginRequiredMixin, DetailView):
+    model = Tweet
+    template_name = "tweets/detail.html"
+    queryset = Tweet.objects.select_related("user")
+
+    def get_object(self, queryset=None):
+        try:
+            tweet = super().get_object(queryset)
+        except Http404:
+            # DB から移した古いツイートは、アーカイブの索引から引いて表示する（manage.py archive_tweets）
+            tweet = get_archived_tweet(self.kwargs["pk"])
+            if tweet is None:
+                raise
+            tweet.user = get_object_or_404(User, pk=tweet.user_id)
+        attach_viewer_state([tweet], self.request.user)
+        return tweet
+
+
+class TweetDeleteView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        tweet = get_object_or_404(Tweet, pk=self.kwargs["pk"])
+        if tweet.user_id != request.user.id:
+            return HttpResponseForbidden("他のユーザーのツイートは削除できません。")
+        # いいねやタイムラインの行はここでは消さず、tweets.purge_tweet タスクに任せる
+        tweet.soft_delete()
+        return redirect("tweets:home")
+
+
+@ratelimit("user", "60/m")
+class LikeView(LoginRequiredMixin, View):
+    def post(self, request, *args, **kwargs):
+        tweet = get_object_or_404(Tweet, pk=self.kwargs["pk"])
+        Like.objects.get_or_create(user=request.user, tweet=tweet)
+        return self.respond(tweet, liked=True)
+
+    def respond(self, tweet, liked):
+        # fetch などから JSON を求められたときだけ JSON を返し、フォームから送られたときは元のページに戻す
+        request = self.request
+        if (
+            "application/json" in request.headers.get("Accept", "")
+            or request.headers.get("X-Requested-With") == "XMLHttpRequest"
+        ):
+            return JsonResponse(self.get_like_state(tweet, liked))
+        referer = request.headers.get("Referer")
+        if referer and url_has_allowed_host_and_scheme(
+            referer, allowed_hosts={request.get_host()}, require_https=request.is_secure()
+        ):
+            return redirect(referer)
+        return redirect("tweets:detail", pk=tweet.pk)
+
+    @staticmethod
+    def get_like_state(tweet, liked):
+        # DB のカウンタにまだ反映されていない増減分を足して返す
+        like_count = tweet.like_count + counters.buffer.pending(Tweet, tweet.pk, "like_count")
+        return {"liked": liked, "like_count": like_count}
+
+
+class UnlikeView(LikeView):
+    def post(self, request, *args, **kwargs):
+        tweet = get_object_or_404(Tweet, pk=self.kwargs["pk"])
+        Like.objects.filter(user=request.user, tweet=tweet).delete()
+        return self.respond(tweet, liked=False)
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import TestCase
+from django.urls import reverse
+
+
+class TestWelcomeView(TestCase):
+    def setUp(self):
+        caches[settings.ANONYMOUS_PAGE_CACHE].clear()
+        self.url = reverse("welcome:welcome")
+
+    def test_success_get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, "welcome/welcome.html")
+
+    def test_anonymous_page_is_cached(self):
+        self.client.get(self.url)
+        with self.assertTemplateNotUsed("welcome/welcome.html"):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("public", response["Cache-Control"])
+        self.assertIn("Cookie", response["Vary"])
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 304)
+
+    def test_query_string_does_not_split_cache(self):
+        self.client.get(self.url)
+        with self.assertTemplateNotUsed("welcome/welcome.html"):
+            self.client.get(self.url, {"utm_source": "example"})
+
+    def test_logged_in_page_is_not_cached(self):
+        self.client.get(self.url)
+        user = get_user_model().objects.create_user(username="testuser", password="testpassword")
+        self.client.force_login(user)
+        response = self.client.get(self.url)
+        self.assertTemplateUsed(response, "welcome/welcome.html")
+        self.assertNotIn("public", response.get("Cache-Control", ""))
@@ -1,5 +1,10 @@
 from django.views.generic import TemplateView
 
+from mysite.conditional import AnonymousPageCacheMixin
 
-class WelcomeView(TemplateView):
+
+class WelcomeView(AnonymousPageCacheMixin, TemplateView):
     template_name = "welcome/welcome.html"
+
+    async def get(self, request, *args, **kwargs):
+        return self.render_to_response(self.get_context_data(**kwargs))